@@ -0,0 +1,70 @@
+"""
+Requests and prompt tokens of the treatment extraction, one section per request versus the packing mode.
+
+Runs `LLMProcessor2.process_books` over a synthetic book of short single-formula sections against the fake LLM
+server (see fake_llm_server.py), which answers the packed requests with one result per section id.
+
+Usage:
+    python bench_batching.py --rows 200 --batch-tokens 2000
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+
+from bench_util import prepare_workdir, create_book_db
+from fake_llm_server import start_server, CANNED_TREATMENTS
+
+# A short single-formula entry, as in 傅青主女科
+SECTION = '清肝止淋汤：白芍一两醋炒，当归一两酒洗，生地五钱酒炒。水煎服。'
+SECTION_ID = re.compile(r'^### 段落 (\d+)$', re.MULTILINE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200, help='sections in the synthetic book')
+    parser.add_argument('--batch-tokens', type=int, default=2000, help='content tokens per packed request')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per fake LLM response')
+    args = parser.parse_args()
+
+    db_dir = prepare_workdir()
+    from util import estimate_tokens
+    prompt_tokens = []
+
+    def respond(request):
+        prompt = request['messages'][-1]['content']
+        prompt_tokens.append(estimate_tokens(prompt))
+        ids = SECTION_ID.findall(prompt)
+        if ids:
+            return json.dumps({ref_id: CANNED_TREATMENTS for ref_id in ids}, ensure_ascii=False)
+        return json.dumps(CANNED_TREATMENTS, ensure_ascii=False)
+
+    server = start_server(latency=args.latency, response_content=respond)
+    os.environ['OPENAI_BASE_URL'] = f'http://127.0.0.1:{server.server_port}/v1'
+    os.environ.setdefault('OPENAI_API_KEY', 'fake')
+
+    from llm_processor import LLMProcessor2
+    logging.getLogger().setLevel(logging.WARNING)
+
+    baseline = None
+    for label, batch_tokens in (('single', None), ('packed', args.batch_tokens)):
+        db_path = os.path.join(db_dir, f'bench_{label}.db')
+        create_book_db(db_path, args.rows, content=SECTION)
+        prompt_tokens.clear()
+        requests_before = server.requests
+        LLMProcessor2(db_path, book_id=0, use_cache=False, batch_tokens=batch_tokens).process_books()
+        requests = server.requests - requests_before
+        tokens = sum(prompt_tokens)
+        conn = sqlite3.connect(db_path)
+        treatments = conn.execute('SELECT COUNT(*) FROM treatment').fetchone()[0]
+        conn.close()
+        baseline = baseline or (requests, tokens)
+        print(f'{label:>7}: {requests:5d} requests ({baseline[0] / requests:.1f}x fewer), '
+              f'{tokens:8d} prompt tokens ({baseline[1] / tokens:.1f}x fewer), {treatments} treatments')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
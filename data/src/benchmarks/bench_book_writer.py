@@ -0,0 +1,84 @@
+"""
+Rows/sec of saving a parsed book to SQLite: `book_writer.BookWriter` against the pandas `to_sql` path it replaced
+in `Preprocessor.save_to_sqlite`.
+
+Usage:
+    python bench_book_writer.py --rows 200000 --books 5
+"""
+import argparse
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+from bench_util import prepare_workdir
+
+CONTENT = '妇人有带下而色红者，似血非血，淋沥不断，所以谓之赤带也。清肝止淋汤：白芍一两醋炒，当归一两酒洗。'
+
+
+def make_book(book_id, n_rows):
+    metadata = {'book_id': book_id, 'book_title': f'书{book_id}', 'author': '傅山', 'dynasty': '清'}
+    book = pd.DataFrame({
+        'book_id': book_id,
+        'chapter_id': [i // 20 for i in range(n_rows)],
+        'section_id': [i % 20 for i in range(n_rows)],
+        'chapter': [f'卷{i // 20}' for i in range(n_rows)],
+        'section': [f'节{i}' for i in range(n_rows)],
+        'content': CONTENT,
+    })
+    return metadata, book
+
+
+def legacy_save(db_path, metadata, book):
+    """
+    Preprocessor.save_to_sqlite before the bulk writer
+    """
+    conn = sqlite3.connect(db_path)
+    pd.DataFrame([metadata]).to_sql('metadata', conn, if_exists='replace', index=False)
+    for col in book.columns:
+        if book[col].dtype == 'O':
+            book[col] = book[col].astype(str)
+    conn.execute(f'DELETE FROM book WHERE book_id = {metadata["book_id"]}')
+    book.to_sql('book', conn, if_exists='append', index=False)
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000, help='rows per book')
+    parser.add_argument('--books', type=int, default=5, help='books saved one after another')
+    args = parser.parse_args()
+
+    db_dir = prepare_workdir()
+    from book_writer import BookWriter, BOOK_TABLE, BOOK_COLUMNS
+    books = [make_book(book_id, args.rows) for book_id in range(args.books)]
+    total = args.rows * args.books
+
+    legacy_path = os.path.join(db_dir, 'legacy.db')
+    conn = sqlite3.connect(legacy_path)
+    conn.execute(BOOK_TABLE)
+    conn.close()
+    start = time.perf_counter()
+    for metadata, book in books:
+        legacy_save(legacy_path, metadata, book.copy())
+    legacy = time.perf_counter() - start
+
+    writer_path = os.path.join(db_dir, 'writer.db')
+    start = time.perf_counter()
+    for metadata, book in books:
+        with BookWriter(writer_path) as writer:
+            writer.write_book(metadata, book[BOOK_COLUMNS].astype(object).values.tolist())
+    bulk = time.perf_counter() - start
+
+    for path in (legacy_path, writer_path):
+        conn = sqlite3.connect(path)
+        print(f"{os.path.basename(path)}: {conn.execute('SELECT COUNT(*) FROM book').fetchone()[0]} book rows, "
+              f"{conn.execute('SELECT COUNT(*) FROM metadata').fetchone()[0]} metadata rows")
+        conn.close()
+    print(f'to_sql:      {total / legacy:10.0f} rows/s')
+    print(f'BookWriter:  {total / bulk:10.0f} rows/s ({legacy / bulk:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Per-call overhead of the LLM clients against a local fake LLM server (see fake_llm_server.py).
+
+Compares a new ChatOpenAI per call, as `get_chatgpt_response` used to do, with the pooled clients of
+`llm_util.clients`. The fake server answers without latency, so the time per call is the client overhead:
+client construction, connection setup and the HTTP round trip on localhost. The number of TCP connections
+opened is reported as well.
+
+Usage:
+    python bench_clients.py --calls 200
+"""
+import argparse
+import logging
+import os
+import time
+
+from bench_util import prepare_workdir
+from fake_llm_server import start_server
+
+MODEL = 'gpt-4o'
+PROMPT = '妇人有带下而色红者，似血非血，淋沥不断，所以谓之赤带也。'
+
+
+def run(server, label, call, calls):
+    with server.lock:
+        server.connections.clear()
+    start = time.perf_counter()
+    for _ in range(calls):
+        call()
+    elapsed = time.perf_counter() - start
+    print(f'{label:>10}: {elapsed / calls * 1000:7.2f} ms/call, {len(server.connections)} connections')
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=200, help='sequential calls per client mode')
+    args = parser.parse_args()
+
+    prepare_workdir()
+    server = start_server(latency=0)
+    os.environ['OPENAI_BASE_URL'] = f'http://127.0.0.1:{server.server_port}/v1'
+    os.environ.setdefault('OPENAI_API_KEY', 'fake')
+
+    from langchain_openai import ChatOpenAI
+    from llm_util import get_chatgpt_response
+    logging.getLogger().setLevel(logging.WARNING)
+
+    def per_call_client():
+        ChatOpenAI(temperature=0, model=MODEL, max_tokens=4096).invoke(PROMPT)
+
+    def pooled_client():
+        get_chatgpt_response(PROMPT, model_name=MODEL, use_cache=False)
+
+    # Warm up imports and the first connection
+    per_call_client()
+    pooled_client()
+    before = run(server, 'per-call', per_call_client, args.calls)
+    after = run(server, 'pooled', pooled_client, args.calls)
+    print(f'speedup: {before / after:.2f}x')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
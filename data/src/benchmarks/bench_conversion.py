@@ -0,0 +1,69 @@
+"""
+Time of the traditional to simplified Chinese conversion of a synthetic book: zhconv on the whole text in one
+thread, as `Preprocessor.load_data` did, against `conversion.convert_text` in a process pool and
+`conversion.convert_file` reading its disk cache. All must produce the same text.
+
+Usage:
+    python bench_conversion.py --size-mb 20 --workers 8
+"""
+import argparse
+import os
+import time
+
+import zhconv
+
+from bench_util import prepare_workdir
+
+# Traditional text, as in the books-jicheng sources
+PARAGRAPHS = [
+    '婦人有帶下而色紅者，似血非血，淋瀝不斷，所以謂之赤帶也。',
+    '方用清肝止淋湯。白芍一兩醋炒，當歸一兩酒洗，生地五錢酒炒，阿膠三錢白麵炒，粉丹皮三錢。',
+    '水煎服。一劑少止，二劑又少止，四劑痊愈，十劑不再發。',
+    '此方但主補肝之血，全不利脾之濕者，以赤帶之為病，火重而濕輕也。',
+]
+
+
+def timed(label, fn):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    print(f'{label:>24}: {elapsed:7.2f}s')
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=float, default=20, help='size of the synthetic book')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='conversion processes')
+    args = parser.parse_args()
+
+    db_dir = prepare_workdir()
+    from conversion import convert_text, convert_file
+
+    lines = []
+    size = 0
+    while size < args.size_mb * 1e6:
+        paragraph = PARAGRAPHS[len(lines) % len(PARAGRAPHS)]
+        lines.append(paragraph)
+        size += len(paragraph.encode('utf-8')) + 1
+    text = '\n'.join(lines) + '\n'
+    file_path = os.path.join(db_dir, 'index.txt')
+    with open(file_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    cache_dir = os.path.join(db_dir, 'converted')
+    print(f'Book: {size / 1e6:.0f} MB, {len(lines)} lines, {args.workers} workers')
+
+    expected, single = timed('zhconv.convert', lambda: zhconv.convert(text, 'zh-cn'))
+    result, pool = timed('convert_text', lambda: convert_text(text, 'zh-cn', args.workers))
+    assert result == expected, 'convert_text differs from zhconv.convert'
+    result, miss = timed('convert_file (cache miss)', lambda: convert_file(file_path, 'zh-cn', args.workers,
+                                                                             cache_dir))
+    assert result == expected, 'convert_file differs from zhconv.convert'
+    result, hit = timed('convert_file (cache hit)', lambda: convert_file(file_path, 'zh-cn', args.workers,
+                                                                           cache_dir))
+    assert result == expected, 'cached text differs from zhconv.convert'
+    print(f'Process pool {single / pool:.1f}x faster, cache hit {single / hit:.0f}x faster')
+
+
+if __name__ == '__main__':
+    main()
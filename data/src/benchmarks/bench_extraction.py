@@ -0,0 +1,50 @@
+"""
+Throughput of the LLM extraction pipeline against a local fake LLM server (see fake_llm_server.py).
+
+Runs `LLMProcessor2.process_books` over a synthetic book for several concurrency limits and reports rows/sec.
+With a fixed API latency, throughput should grow linearly with the concurrency until the rate limits apply.
+
+Usage:
+    python bench_extraction.py --rows 200 --latency 0.5 --concurrency 1 4 16 64 --error-rate 0.05
+"""
+import argparse
+import logging
+import os
+
+from bench_util import prepare_workdir, create_book_db
+from fake_llm_server import start_server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200, help='sections in the synthetic book')
+    parser.add_argument('--latency', type=float, default=0.5, help='seconds per fake LLM response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of 429/500 responses')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--rpm', type=int, default=None, help='requests/min limit')
+    parser.add_argument('--tpm', type=int, default=None, help='tokens/min limit')
+    parser.add_argument('--cache', action='store_true', help='use the LLM response cache across the runs')
+    args = parser.parse_args()
+
+    db_dir = prepare_workdir()
+    server = start_server(latency=args.latency, error_rate=args.error_rate)
+    os.environ['OPENAI_BASE_URL'] = f'http://127.0.0.1:{server.server_port}/v1'
+    os.environ.setdefault('OPENAI_API_KEY', 'fake')
+
+    from llm_processor import LLMProcessor2
+    logging.getLogger().setLevel(logging.WARNING)
+
+    for concurrency in args.concurrency:
+        db_path = os.path.join(db_dir, f'bench_{concurrency}.db')
+        create_book_db(db_path, args.rows)
+        processor = LLMProcessor2(db_path, book_id=0, concurrency=concurrency,
+                                  requests_per_minute=args.rpm, tokens_per_minute=args.tpm, use_cache=args.cache)
+        processor_stats = processor.process_books()
+        print(f"concurrency={concurrency:>4}: {processor_stats['items_per_sec']:7.2f} rows/s, "
+              f"{processor_stats['completed']} completed, {processor_stats['failed']} failed, "
+              f"{processor_stats['retries']} retries")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
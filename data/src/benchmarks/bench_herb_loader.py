@@ -0,0 +1,126 @@
+"""
+Time and memory of `herb_loader.HerbProcessing` on synthetic HERB files, against the process-herb.py script it
+replaced, which read the whole file with csv.DictReader and inserted one row per execute.
+
+Both load the same synthetic HERB_herb_info.txt of `--legacy-rows` rows and must store the same values; the
+peak Python memory of each is traced. The streaming loader then loads a synthetic HERB_ingredient_info.txt of
+`--rows` rows and builds its indexes.
+
+Usage:
+    python bench_herb_loader.py --legacy-rows 200000 --rows 5000000
+"""
+import argparse
+import csv
+import os
+import sqlite3
+import time
+import tracemalloc
+
+from bench_util import prepare_workdir
+
+HERB_COLUMNS = [
+    'Herb_ID', 'Herb_pinyin_name', 'Herb_cn_name', 'Herb_en_name', 'Herb_latin_name',
+    'Properties', 'Meridians', 'UsePart', 'Function', 'Indication', 'Toxicity',
+    'Clinical_manifestations', 'Therapeutic_en_class', 'Therapeutic_cn_class',
+    'TCMID_id', 'TCM_ID_id', 'SymMap_id', 'TCMSP_id'
+]
+INGREDIENT_COLUMNS = [
+    'Ingredient_id', 'Ingredient_name', 'Alias', 'Ingredient_formula', 'Ingredient_Smile', 'Ingredient_weight',
+    'OB_score', 'CAS_id', 'SymMap_id', 'TCMID_id', 'TCMSP_id', 'TCM_ID_id', 'PubChem_id', 'DrugBank_id'
+]
+
+
+def herb_row(i):
+    values = {column: f'{column} {i}' for column in HERB_COLUMNS}
+    values.update(Herb_ID=f'HERB{i:06d}', Herb_cn_name=f'药{i}', TCMID_id=str(i), TCM_ID_id='',
+                  SymMap_id=f'SMHB{i:05d}', TCMSP_id=str(i * 7))
+    return [values[column] for column in HERB_COLUMNS]
+
+
+def ingredient_row(i):
+    return [f'HBIN{i:06d}', f'ingredient {i}', '', 'C15H10O5', 'C1=CC(=CC=C1C2=CC(=O)C3=C(C=C(C=C3O2)O)O)O',
+            f'{270 + i % 100}.24', f'{i % 50}.5', f'{i}-{i % 97}-1', '', str(i), '', '', str(5280000 + i), '']
+
+
+def write_tsv(file_path, columns, make_row, n_rows):
+    with open(file_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, delimiter='\t', lineterminator='\n')
+        writer.writerow(columns)
+        writer.writerows(make_row(i) for i in range(n_rows))
+
+
+def legacy_load(file_path, db_path):
+    """
+    process-herb.py before the streaming loader
+    """
+    data = []
+    with open(file_path, 'r', encoding='utf-8') as file:
+        reader = csv.DictReader(file, delimiter='\t')
+        for row in reader:
+            data.append(row)
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute(f'CREATE TABLE IF NOT EXISTS herbs ({", ".join(f"{col} TEXT" for col in HERB_COLUMNS)})')
+    conn.commit()
+    insert_sql = (f'INSERT INTO herbs ({", ".join(HERB_COLUMNS)}) '
+                  f'VALUES ({", ".join(":" + col for col in HERB_COLUMNS)})')
+    for row in data:
+        cursor.execute(insert_sql, row)
+    conn.commit()
+    conn.close()
+
+
+def traced(function, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 1e6
+
+
+def dump_herbs(db_path):
+    conn = sqlite3.connect(db_path)
+    # Compare as text: the streaming loader stores empty fields as NULL and numbers with their column type
+    rows = [tuple('' if value is None else str(value) for value in row)
+            for row in conn.execute(f'SELECT {", ".join(HERB_COLUMNS)} FROM herbs ORDER BY rowid')]
+    conn.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--legacy-rows', type=int, default=200000, help='rows of the synthetic herb file')
+    parser.add_argument('--rows', type=int, default=5000000, help='rows of the synthetic ingredient file')
+    args = parser.parse_args()
+
+    db_dir = prepare_workdir()
+    from herb_loader import HerbProcessing, HERB_FILES
+
+    data_dir = os.path.join(db_dir, 'HERB')
+    os.makedirs(data_dir)
+    write_tsv(os.path.join(data_dir, 'HERB_herb_info.txt'), HERB_COLUMNS, herb_row, args.legacy_rows)
+
+    legacy_db, herb_db = os.path.join(db_dir, 'legacy.db'), os.path.join(db_dir, 'herb_info.db')
+    legacy, legacy_peak = traced(legacy_load, os.path.join(data_dir, 'HERB_herb_info.txt'), legacy_db)
+    herb_processing = HerbProcessing(data_dir, herb_db)
+    streaming, streaming_peak = traced(herb_processing.process_herb_data)
+    assert dump_herbs(legacy_db) == dump_herbs(herb_db), 'different herbs tables'
+    print(f'{args.legacy_rows:>9} herbs: legacy {legacy:6.2f}s {legacy_peak:7.1f} MB peak, '
+          f'streaming {streaming:6.2f}s {streaming_peak:7.1f} MB peak')
+
+    write_tsv(os.path.join(data_dir, 'HERB_ingredient_info.txt'), INGREDIENT_COLUMNS, ingredient_row, args.rows)
+    ingredient_files = [herb_file for herb_file in HERB_FILES if herb_file.table == 'ingredients']
+    herb_processing = HerbProcessing(data_dir, herb_db, herb_files=ingredient_files)
+    start = time.perf_counter()
+    counts = herb_processing.process_herb_data()
+    loaded = time.perf_counter() - start
+    herb_processing.save_herb_data_to_db()
+    indexed = time.perf_counter() - start - loaded
+    print(f'{counts["ingredients"]:>9} ingredients: loaded in {loaded:6.2f}s '
+          f'({counts["ingredients"] / loaded:.0f} rows/s), indexed in {indexed:6.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Time of `update_herb_table` on a synthetic treatment table, against the row-by-row implementation it replaced.
+
+The legacy implementation runs two lookups per herb of every treatment, without an index, so it is only run on
+the first `--legacy-rows` treatments; both implementations must produce the same herb and herb_ref tables.
+The incremental update is then timed after appending `--book-rows` treatments, as extracting a new book does.
+
+Usage:
+    python bench_herb_table.py --rows 1000000 --legacy-rows 20000
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sqlite3
+import time
+
+from bench_util import prepare_workdir
+
+HERB_NAMES = [f'药{i}' for i in range(2000)]
+
+
+def create_treatment_db(db_path, n_rows, herbs_per_treatment=6, seed=0):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS treatment (
+        treatment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ref_id INTEGER,
+        disease TEXT,
+        symptoms TEXT,
+        prescription_name TEXT,
+        herbs TEXT,
+        notes TEXT
+    )
+    ''')
+    conn.executemany('INSERT INTO treatment (ref_id, prescription_name, herbs) VALUES (?, ?, ?)', (
+        (i // 3, f'方{i}', json.dumps([{'name': name, 'dosage': '一两', 'preparation': '酒洗'}
+                                       for name in rng.sample(HERB_NAMES, herbs_per_treatment)], ensure_ascii=False))
+        for i in range(n_rows)))
+    conn.commit()
+    conn.close()
+
+
+def legacy_update_herb_table(db_path):
+    """
+    update_herb_table(create_new=True) before the set-based rewrite
+    """
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute('CREATE TABLE herb (herb_id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, description TEXT)')
+    cursor.execute('CREATE TABLE herb_ref (herb_id INTEGER, treatment_id INTEGER, ref_id INTEGER, dosage TEXT, '
+                   'preparation TEXT, UNIQUE(herb_id, treatment_id, ref_id))')
+    conn.commit()
+    cursor.execute('SELECT treatment_id, ref_id, herbs FROM treatment')
+    for row in cursor.fetchall():
+        for herb in json.loads(row[2]):
+            herb.setdefault('dosage', '')
+            herb.setdefault('preparation', '')
+            cursor.execute('SELECT herb_id FROM herb WHERE name = ?', (herb['name'],))
+            herb_id = cursor.fetchone()
+            if herb_id:
+                herb_id = herb_id[0]
+            else:
+                cursor.execute('INSERT INTO herb (name, description) VALUES (?, ?)', (herb['name'], ''))
+                herb_id = cursor.lastrowid
+            cursor.execute('SELECT 1 FROM herb_ref WHERE herb_id = ? AND treatment_id = ? AND ref_id = ?',
+                           (herb_id, row[0], row[1]))
+            if not cursor.fetchone():
+                cursor.execute('INSERT INTO herb_ref (herb_id, treatment_id, ref_id, dosage, preparation) '
+                               'VALUES (?, ?, ?, ?, ?)', (herb_id, row[0], row[1], herb['dosage'], herb['preparation']))
+    conn.commit()
+    conn.close()
+
+
+def dump_tables(db_path):
+    conn = sqlite3.connect(db_path)
+    tables = (conn.execute('SELECT * FROM herb ORDER BY herb_id').fetchall(),
+              conn.execute('SELECT * FROM herb_ref ORDER BY treatment_id, herb_id').fetchall())
+    conn.close()
+    return tables
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000, help='treatments of the synthetic table')
+    parser.add_argument('--legacy-rows', type=int, default=20000, help='treatments for the legacy comparison')
+    parser.add_argument('--book-rows', type=int, default=2000, help='treatments added for the incremental update')
+    args = parser.parse_args()
+
+    db_dir = prepare_workdir()
+    from llm_processor import update_herb_table
+    logging.getLogger().setLevel(logging.WARNING)
+
+    legacy_path, small_path = os.path.join(db_dir, 'legacy.db'), os.path.join(db_dir, 'small.db')
+    for path in (legacy_path, small_path):
+        create_treatment_db(path, args.legacy_rows)
+    legacy = timed(legacy_update_herb_table, legacy_path)
+    bulk = timed(update_herb_table, create_new=True, db_path=small_path)
+    assert dump_tables(legacy_path) == dump_tables(small_path), 'different herb tables'
+    print(f'{args.legacy_rows:>8} treatments: legacy {legacy:8.2f}s, set-based {bulk:6.2f}s ({legacy / bulk:.0f}x)')
+
+    large_path = os.path.join(db_dir, 'large.db')
+    create_treatment_db(large_path, args.rows)
+    bulk = timed(update_herb_table, create_new=True, db_path=large_path)
+    print(f'{args.rows:>8} treatments: set-based {bulk:6.2f}s ({args.rows / bulk:.0f} treatments/s)')
+    rerun = timed(update_herb_table, db_path=large_path, incremental=False)
+    print(f'{args.rows:>8} treatments: full rerun {rerun:6.2f}s')
+
+    # A new book appends its treatments, the incremental update only reads those
+    create_treatment_db(large_path, args.book_rows, seed=1)
+    incremental = timed(update_herb_table, db_path=large_path)
+    print(f'{args.book_rows:>8} new treatments: incremental update {incremental:6.2f}s')
+
+
+if __name__ == '__main__':
+    main()
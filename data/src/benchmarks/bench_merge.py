@@ -0,0 +1,141 @@
+"""
+Time of `herb_merge.merge_herb_tables` on HERB-sized synthetic inputs, against the merge-table.py script it
+replaced.
+
+herb_info.db holds `--info-rows` HERB herbs (HERB_herb_info.txt has about 7,000) and tcm.db `--herb-rows` herbs
+with contiguous herb_ids, `--overlap` of them sharing their name with a HERB herb. Both implementations must
+produce the same merged table.
+
+Usage:
+    python bench_merge.py --info-rows 7263 --herb-rows 5000 --overlap 0.5
+"""
+import argparse
+import os
+import sqlite3
+import time
+
+from bench_util import prepare_workdir
+
+
+def create_herb_info_db(info_db, info_rows):
+    from herb_merge import HERB_INFO_COLUMNS
+    conn = sqlite3.connect(info_db)
+    columns = ['Herb_ID'] + HERB_INFO_COLUMNS
+    conn.execute(f'CREATE TABLE herbs ({", ".join(f"{col} TEXT" for col in columns)})')
+    conn.executemany(f'INSERT INTO herbs VALUES ({", ".join("?" * len(columns))})', (
+        [f'HERB{i:06d}'] + [f'药{i}' if col == 'Herb_cn_name' else f'{col} {i}' for col in HERB_INFO_COLUMNS]
+        for i in range(info_rows)))
+    conn.commit()
+    conn.close()
+
+
+def create_herb_db(tcm_db, herb_rows, overlap):
+    shared = int(herb_rows * overlap)
+    conn = sqlite3.connect(tcm_db)
+    conn.execute('CREATE TABLE herb (herb_id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, description TEXT)')
+    conn.executemany('INSERT INTO herb (name, description) VALUES (?, ?)',
+                     ((f'药{i}' if i < shared else f'本草{i}', '') for i in range(herb_rows)))
+    conn.commit()
+    conn.close()
+
+
+def legacy_merge(info_db, tcm_db):
+    """
+    merge-table.py before the hash join
+    """
+    conn_info = sqlite3.connect(info_db)
+    conn_tcm = sqlite3.connect(tcm_db)
+    cursor_info = conn_info.cursor()
+    cursor_tcm = conn_tcm.cursor()
+    cursor_info.execute('''
+    SELECT Herb_pinyin_name, Herb_cn_name, Herb_en_name, Herb_latin_name,
+           Properties, Meridians, UsePart, Function, Indication, Toxicity,
+           Clinical_manifestations, Therapeutic_en_class, Therapeutic_cn_class,
+           TCMID_id, TCM_ID_id, SymMap_id, TCMSP_id
+    FROM herbs
+    ''')
+    herb_info_data = cursor_info.fetchall()
+    herb_info_columns = [description[0] for description in cursor_info.description]
+    cursor_tcm.execute('SELECT * FROM herb')
+    herb_tcm_data = cursor_tcm.fetchall()
+    herb_tcm_columns = [description[0] for description in cursor_tcm.description]
+    conn_info.close()
+    conn_tcm.close()
+
+    conn_joined = sqlite3.connect(tcm_db)
+    cursor_joined = conn_joined.cursor()
+    combined_columns = herb_tcm_columns + [col for col in herb_info_columns if col != 'Herb_cn_name']
+    combined_columns_sql = ', '.join([f'{col} TEXT' for col in combined_columns])
+    cursor_joined.execute(f'CREATE TABLE IF NOT EXISTS herbJoined ({combined_columns_sql})')
+    conn_joined.commit()
+
+    def generate_unique_herb_id(existing_ids):
+        new_id = 1
+        while new_id in existing_ids:
+            new_id += 1
+        existing_ids.add(new_id)
+        return new_id
+
+    existing_herb_ids = {row[0] for row in herb_tcm_data}
+    insert_sql = (f'INSERT INTO herbJoined ({", ".join(combined_columns)}) '
+                  f'VALUES ({", ".join(["?" for _ in combined_columns])})')
+    herb_info_dict = {row[1]: row for row in herb_info_data}
+    for row in herb_tcm_data:
+        name = row[1]
+        if name in herb_info_dict:
+            info_row = herb_info_dict[name]
+            new_row = list(row) + [info_row[herb_info_columns.index(col)] for col in herb_info_columns
+                                   if col != 'Herb_cn_name']
+        else:
+            new_row = list(row) + [None] * (len(herb_info_columns) - 1)
+        cursor_joined.execute(insert_sql, new_row)
+    for row in herb_info_data:
+        if row[1] not in [r[1] for r in herb_tcm_data]:
+            new_row = [None] * len(herb_tcm_columns)
+            new_row[herb_tcm_columns.index('name')] = row[1]
+            new_row[herb_tcm_columns.index('herb_id')] = generate_unique_herb_id(existing_herb_ids)
+            new_row += [row[herb_info_columns.index(col)] for col in herb_info_columns if col != 'Herb_cn_name']
+            cursor_joined.execute(insert_sql, new_row)
+    conn_joined.commit()
+    conn_joined.close()
+
+
+def dump_table(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute('SELECT * FROM herbJoined ORDER BY rowid').fetchall()
+    conn.close()
+    return rows
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--info-rows', type=int, default=7263, help='HERB herbs in herb_info.db')
+    parser.add_argument('--herb-rows', type=int, default=5000, help='herbs in the herb table of tcm.db')
+    parser.add_argument('--overlap', type=float, default=0.5, help='share of the tcm.db herbs found in HERB')
+    args = parser.parse_args()
+
+    db_dir = prepare_workdir()
+    from herb_merge import merge_herb_tables
+
+    info_db = os.path.join(db_dir, 'herb_info.db')
+    legacy_db, merged_db = os.path.join(db_dir, 'legacy.db'), os.path.join(db_dir, 'merged.db')
+    create_herb_info_db(info_db, args.info_rows)
+    for tcm_db in (legacy_db, merged_db):
+        create_herb_db(tcm_db, args.herb_rows, args.overlap)
+
+    legacy = timed(legacy_merge, info_db, legacy_db)
+    merged = timed(merge_herb_tables, info_db, merged_db)
+    rows = dump_table(merged_db)
+    assert dump_table(legacy_db) == rows, 'different merged tables'
+    print(f'{args.herb_rows} herbs + {args.info_rows} HERB herbs -> {len(rows)} rows: legacy {legacy:7.2f}s, '
+          f'hash join {merged:5.2f}s ({legacy / merged:.0f}x)')
+
+
+if __name__ == '__main__':
+    main()
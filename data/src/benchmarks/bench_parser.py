@@ -0,0 +1,145 @@
+"""
+Time of the book parser on a synthetic book, against the line-by-line parser it replaced.
+
+The synthetic book repeats chapters of sections of 傅青主女科-like paragraphs up to `--size-mb` megabytes of
+UTF-8 text. Both parsers must produce the same rows. `remove_number` is timed on all the chapter and section
+titles against its recursive version.
+
+Usage:
+    python bench_parser.py --size-mb 100
+"""
+import argparse
+import random
+import time
+
+from bench_util import prepare_workdir
+
+PARAGRAPHS = [
+    '妇人有带下而色红者，似血非血，淋沥不断，所以谓之赤带也。',
+    '方用清肝止淋汤。白芍一两醋炒，当归一两酒洗，生地五钱酒炒，阿胶三钱白面炒，粉丹皮三钱。',
+    '水煎服。一剂少止，二剂又少止，四剂全愈，十剂不再发。',
+    '此方但主补肝之血，全不利脾之湿者，以赤带之为病，火重而湿轻也。\\',
+    '  ',
+]
+NUMBERS = '一二三四五六七八九十'
+
+
+def make_book(size_mb, seed=0):
+    """
+    :return: str, the book text after the </book> header
+    """
+    rng = random.Random(seed)
+    lines = []
+    size = 0
+    chapter = 0
+    while size < size_mb * 1e6:
+        chapter += 1
+        lines.append(f'======卷{NUMBERS[chapter % 10]}======')
+        for section in range(rng.randint(5, 30)):
+            lines.append(f'=====带下{NUMBERS[section % 10]}{NUMBERS[section % 7]}=====')
+            paragraphs = rng.choices(PARAGRAPHS, k=rng.randint(2, 20))
+            lines.extend(paragraphs)
+            size += sum(len(paragraph.encode('utf-8')) for paragraph in paragraphs)
+    return '\n'.join(lines)
+
+
+def legacy_iter_book_rows(book_lines, book_id=0, chapter_break='======', section_break='====='):
+    """
+    Preprocessor.iter_book_rows before the tokenizer
+    """
+    chapter = None
+    section = None
+    chapter_id = 0
+    section_id = 0
+    content = []
+
+    def make_row():
+        return {
+            'book_id': book_id,
+            'chapter_id': chapter_id,
+            'section_id': section_id,
+            'chapter': chapter,
+            'section': section,
+            'content': "\n".join(content).strip()
+        }
+
+    for line in book_lines:
+        line = line.replace('\\', '').strip()
+        if line.startswith(chapter_break):
+            if content:
+                yield make_row()
+            content = []
+            line = line.replace('=', '')
+            line = line.strip()
+            chapter = line
+            chapter_id += 1
+            section_id = 0
+        elif line.startswith(section_break):
+            if content:
+                yield make_row()
+            content = []
+            line = line.replace('=', '')
+            line = line.strip()
+            section = line
+            section_id += 1
+        else:
+            content.append(line)
+            if content == ['']:
+                content = []
+    if content:
+        yield make_row()
+
+
+def legacy_remove_number(text):
+    if not text:
+        return text
+    text = text.strip()
+    if text[-1] in ['一', '二', '三', '四', '五', '六', '七', '八', '九', '十']:
+        text = text[:-1]
+        text = legacy_remove_number(text)
+    return text
+
+
+def timed(label, fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    print(f'{label:>20}: {elapsed:7.2f}s')
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=float, default=100, help='size of the synthetic book')
+    args = parser.parse_args()
+
+    prepare_workdir()
+    from book_parser import BookTokenizer, parse_rows
+    from util import remove_number
+
+    text = make_book(args.size_mb)
+    print(f'Book: {len(text.encode("utf-8")) / 1e6:.0f} MB, {text.count(chr(10)) + 1} lines')
+    tokenizer = BookTokenizer()
+
+    # Whole text, as `Preprocessor.load_data`
+    legacy, legacy_time = timed('legacy', lambda: list(legacy_iter_book_rows(text.strip().split('\n'))))
+    rows, text_time = timed('tokenize', lambda: list(parse_rows(tokenizer.tokenize(text), 0)))
+    assert rows == legacy, 'tokenize rows differ from the legacy parser'
+
+    # Lines with their line breaks, as read from the file by `Preprocessor.stream_to_sqlite`
+    lines = text.splitlines(keepends=True)
+    legacy, legacy_lines_time = timed('legacy (lines)', lambda: list(legacy_iter_book_rows(lines)))
+    rows, lines_time = timed('tokenize_lines', lambda: list(parse_rows(tokenizer.tokenize_lines(lines), 0)))
+    assert rows == legacy, 'tokenize_lines rows differ from the legacy parser'
+    print(f'{len(rows)} rows, tokenize {legacy_time / text_time:.1f}x and tokenize_lines '
+          f'{legacy_lines_time / lines_time:.1f}x faster')
+
+    titles = [row[key] for row in rows for key in ('chapter', 'section')]
+    expected, legacy_time = timed('legacy remove_number', lambda: [legacy_remove_number(t) for t in titles])
+    result, new_time = timed('remove_number', lambda: [remove_number(t) for t in titles])
+    assert result == expected
+    print(f'{len(titles)} titles, remove_number {legacy_time / new_time:.1f}x faster')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Helpers shared by the pipeline benchmarks
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+
+PREPROCESSING_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../preprocessing')
+DB_PROCESSING_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../db-processing')
+
+
+def prepare_workdir():
+    """
+    Create a scratch copy of the pipeline's directory layout (work/ next to db/) and move into work/, so the
+    preprocessing and db-processing modules, which use paths such as '../db/tcm.db', only touch scratch databases.
+    :return: str, path of the scratch db directory
+    """
+    root = tempfile.mkdtemp(prefix='opentcm-bench-')
+    db_dir = os.path.join(root, 'db')
+    os.makedirs(db_dir)
+    os.makedirs(os.path.join(root, 'work'))
+    os.chdir(os.path.join(root, 'work'))
+    for module_dir in (DB_PROCESSING_DIR, PREPROCESSING_DIR):
+        if module_dir not in sys.path:
+            sys.path.insert(0, module_dir)
+    return db_dir
+
+
+def create_book_db(db_path, n_rows, book_id=0, content='妇人有带下而色红者，似血非血，淋沥不断，所以谓之赤带也。'):
+    """
+    Create a database with a synthetic book of n_rows sections and an empty treatment table
+    """
+    conn = sqlite3.connect(db_path)
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS book (
+        ref_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        book_id INTEGER,
+        chapter_id INTEGER,
+        section_id TEXT,
+        chapter TEXT,
+        section TEXT,
+        content TEXT
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS treatment (
+        treatment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ref_id INTEGER,
+        disease TEXT,
+        symptoms TEXT,
+        prescription_name TEXT,
+        herbs TEXT,
+        notes TEXT
+    )
+    ''')
+    conn.executemany('INSERT INTO book (book_id, chapter_id, section_id, chapter, section, content) '
+                     'VALUES (?, ?, ?, ?, ?, ?)',
+                     ((book_id, i // 10, str(i % 10), f'卷{i // 10}', f'节{i}', content) for i in range(n_rows)))
+    conn.commit()
+    conn.close()
@@ -0,0 +1,118 @@
+"""
+Local fake of the OpenAI chat completions API, for measuring the LLM pipeline offline.
+
+Every request is answered after a fixed latency with a canned treatment extraction. A fraction of the requests
+can be rejected with 429 (rate limited) or 500 to exercise the retries, at random or in a scripted order.
+
+Usage:
+    python fake_llm_server.py --port 8765 --latency 0.5 --error-rate 0.05
+    export OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+CANNED_TREATMENTS = [{
+    "disease": "赤带下",
+    "symptoms": "妇人有带下而色红者，似血非血，淋沥不断",
+    "prescription_name": "清肝止淋汤",
+    "herbs": [
+        {"name": "白芍", "dosage": "一两", "preparation": "醋炒"},
+        {"name": "当归", "dosage": "一两", "preparation": "酒洗"}
+    ],
+    "notes": "水煎服"
+}]
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, avoid the Nagle + delayed ACK stall on keep-alive connections
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.connections.add(self.client_address)
+            error = server.errors.pop(0) if server.errors else None
+        time.sleep(server.latency)
+
+        if error is None and random.random() < server.error_rate:
+            error = 429 if random.random() < 0.5 else 500
+        if error is not None:
+            if error == 429:
+                self.send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'requests'}},
+                               {'Retry-After': '0.1'})
+            else:
+                self.send_json(error, {'error': {'message': 'Internal error', 'type': 'server_error'}})
+            return
+
+        content = server.response_content or json.dumps(CANNED_TREATMENTS, ensure_ascii=False)
+        if callable(content):
+            content = content(request)
+        self.send_json(200, {
+            'id': f'chatcmpl-{server.requests}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'fake'),
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': content}}],
+            'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2},
+        })
+
+
+def start_server(port=0, latency=0.5, error_rate=0.0, response_content=None, errors=None):
+    """
+    Start the fake server in a background thread
+    :param port: int, 0 picks a free port
+    :param latency: float, seconds before each response
+    :param error_rate: float, fraction of requests answered with 429 or 500
+    :param response_content: str, or function (request JSON) -> str, content of the assistant message
+    :param errors: list of HTTP status codes answered, in order, to the next requests. Appending to
+        `server.errors` scripts the following ones.
+    :return: server, its base URL is f'http://127.0.0.1:{server.server_port}/v1'
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), FakeLLMHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.error_rate = error_rate
+    server.response_content = response_content
+    server.errors = list(errors or [])
+    server.requests = 0
+    server.connections = set()
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    fake_server = start_server(args.port, args.latency, args.error_rate)
+    print(f'Fake LLM server on http://127.0.0.1:{fake_server.server_port}/v1')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake_server.shutdown()
@@ -0,0 +1,183 @@
+"""
+Loader of the HERB dataset (http://herb.ac.cn) into SQLite.
+
+The HERB files are tab-separated with a header line. Each file is streamed into its table with `executemany`
+in batched transactions, so files of tens of millions of rows are loaded without being held in memory. The
+columns are named after the header. Their types are inferred from the first rows: INTEGER or REAL when every
+non-empty sampled value is a number, TEXT otherwise. The identifier columns are always TEXT. SQLite keeps any
+later value that does not fit the declared type as TEXT, so a wrong guess never rejects a row. Empty fields
+are stored as NULL.
+
+The indexes are built once the table is loaded. Each table gets an index on its name columns, such as
+Herb_cn_name, and on its key. Every cross-database ID column, named `*_id` (TCMID_id, SymMap_id, PubChem_id,
+...), also gets an index.
+
+Usage:
+    python process-herb.py
+"""
+import csv
+import itertools
+import logging
+import os
+import sqlite3
+import sys
+import time
+from collections import namedtuple
+
+# Bulk-loading pragmas: the tables are rebuilt from the source files, so a crash only costs a reload
+LOADER_PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = OFF',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -262144',
+]
+
+# Rows read to infer the column types
+SAMPLE_ROWS = 1000
+
+HerbFile = namedtuple('HerbFile', ['file_name', 'table', 'key', 'name_columns'])
+
+# HERB files, their table and the columns to index besides the cross-database IDs
+HERB_FILES = [
+    HerbFile('HERB_herb_info.txt', 'herbs', 'Herb_ID', ['Herb_cn_name', 'Herb_pinyin_name']),
+    HerbFile('HERB_ingredient_info.txt', 'ingredients', 'Ingredient_id', ['Ingredient_name']),
+    HerbFile('HERB_target_info.txt', 'targets', 'Target_id', ['Gene_symbol']),
+    HerbFile('HERB_disease_info.txt', 'diseases', 'Disease_id', ['Disease_name']),
+]
+
+
+def infer_type(values):
+    """
+    SQLite type of a column from a sample of its values
+    :param values: list of str, the non-empty sampled values
+    :return: str, INTEGER, REAL or TEXT
+    """
+    if not values:
+        return 'TEXT'
+    for column_type, parse in (('INTEGER', int), ('REAL', float)):
+        try:
+            for value in values:
+                parse(value)
+        except ValueError:
+            continue
+        return column_type
+    return 'TEXT'
+
+
+def is_identifier(column):
+    return column.lower() == 'id' or column.lower().endswith('_id')
+
+
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class HerbProcessing:
+    """
+    Streaming loader of the HERB files
+    ----------
+    process_herb_data: Load the HERB files found in the data directory into their tables
+    save_herb_data_to_db: Build the indexes of the loaded tables
+    load_file: Load one TSV file into a table
+    """
+
+    def __init__(self, herb_data_path, db_path='herb_info.db', batch_size=50000, herb_files=None):
+        """
+        :param herb_data_path: str, directory of the HERB files
+        :param db_path: str
+        :param batch_size: int, rows per transaction
+        :param herb_files: list of HerbFile, default HERB_FILES
+        """
+        self.herb_data_path = herb_data_path
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.herb_files = herb_files or HERB_FILES
+        # Tables loaded by process_herb_data, with their HerbFile and columns
+        self.loaded = []
+
+    def process_herb_data(self):
+        """
+        Load every HERB file of the data directory, the missing files are skipped
+        :return: dict of table -> rows loaded
+        """
+        counts = {}
+        for herb_file in self.herb_files:
+            file_path = os.path.join(self.herb_data_path, herb_file.file_name)
+            if not os.path.exists(file_path):
+                logging.warning(f'{file_path} not found, {herb_file.table} is not loaded')
+                continue
+            columns, counts[herb_file.table] = self.load_file(file_path, herb_file.table)
+            self.loaded.append((herb_file, columns))
+        return counts
+
+    def save_herb_data_to_db(self):
+        """
+        Index the tables loaded by `process_herb_data`
+        """
+        for herb_file, columns in self.loaded:
+            index_columns = [herb_file.key] + herb_file.name_columns + [
+                column for column in columns if is_identifier(column) and column != herb_file.key]
+            self.create_indexes(herb_file.table, [column for column in index_columns if column in columns])
+        self.loaded = []
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path)
+        for pragma in LOADER_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def load_file(self, file_path, table):
+        """
+        Stream a TSV file with a header line into a table, replacing the table
+        :param file_path: str
+        :param table: str
+        :return: (list of column names, number of rows loaded)
+        """
+        start = time.perf_counter()
+        # Long free-text fields, such as the clinical manifestations, exceed the default field size limit
+        csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+        conn = self.connect()
+        row_count = 0
+        try:
+            with open(file_path, 'r', encoding='utf-8-sig', newline='') as f:
+                reader = csv.reader(f, delimiter='\t')
+                columns = [column.strip() for column in next(reader)]
+                width = len(columns)
+                sample = list(itertools.islice(reader, SAMPLE_ROWS))
+                types = ['TEXT' if is_identifier(column) else
+                         infer_type([row[i] for row in sample if i < len(row) and row[i]])
+                         for i, column in enumerate(columns)]
+
+                conn.execute(f'DROP TABLE IF EXISTS {quote(table)}')
+                conn.execute(f'CREATE TABLE {quote(table)} '
+                             f'({", ".join(f"{quote(c)} {t}" for c, t in zip(columns, types))})')
+                insert_sql = f'INSERT INTO {quote(table)} VALUES ({", ".join("?" * width)})'
+
+                # Empty fields as NULL, and the rows padded or cut to the header
+                rows = ([value or None for value in row[:width]] + [None] * (width - len(row))
+                        for row in itertools.chain(sample, reader) if row)
+                while True:
+                    # executemany consumes the batch lazily, one row at a time
+                    with conn:
+                        inserted = conn.executemany(insert_sql, itertools.islice(rows, self.batch_size)).rowcount
+                    if inserted <= 0:
+                        break
+                    row_count += inserted
+                    logging.debug(f'{table}: {row_count} rows')
+        finally:
+            conn.close()
+        logging.info(f'{table}: {row_count} rows loaded from {file_path} in {time.perf_counter() - start:.1f}s')
+        return columns, row_count
+
+    def create_indexes(self, table, columns):
+        """
+        :param table: str
+        :param columns: list of str, one index per column
+        """
+        conn = self.connect()
+        with conn:
+            for column in dict.fromkeys(columns):
+                conn.execute(f'CREATE INDEX IF NOT EXISTS {quote(f"idx_{table}_{column}")} '
+                             f'ON {quote(table)} ({quote(column)})')
+            conn.execute(f'ANALYZE {quote(table)}')
+        conn.close()
@@ -0,0 +1,99 @@
+"""
+Merge of the HERB herb information (herb_info.db, see process-herb.py) into the herb table of tcm.db.
+
+Every herb of tcm.db is joined with the HERB herb of the same Chinese name, with a dict lookup. The HERB herbs
+that match no herb of tcm.db are appended with new herb_ids, counted up from the highest existing herb_id.
+The merged rows are inserted with a single executemany in one transaction.
+
+Usage:
+    python merge-table.py
+"""
+import sqlite3
+from operator import itemgetter
+
+# Columns of the herbs table of herb_info.db, without its Herb_ID
+HERB_INFO_COLUMNS = [
+    'Herb_pinyin_name', 'Herb_cn_name', 'Herb_en_name', 'Herb_latin_name',
+    'Properties', 'Meridians', 'UsePart', 'Function', 'Indication', 'Toxicity',
+    'Clinical_manifestations', 'Therapeutic_en_class', 'Therapeutic_cn_class',
+    'TCMID_id', 'TCM_ID_id', 'SymMap_id', 'TCMSP_id'
+]
+
+
+def read_table(conn, query):
+    """
+    :return: (list of column names, list of rows)
+    """
+    cursor = conn.execute(query)
+    return [description[0] for description in cursor.description], cursor.fetchall()
+
+
+def merge_rows(herb_columns, herb_rows, info_columns, info_rows, key='Herb_cn_name', name_column='name',
+               id_column='herb_id'):
+    """
+    Hash join of the herbs of tcm.db with the HERB herbs on their Chinese name
+    :param herb_columns: list of str, columns of the herb table of tcm.db
+    :param herb_rows: list of rows of the herb table
+    :param info_columns: list of str, columns of the HERB herbs
+    :param info_rows: list of rows of the HERB herbs
+    :param key: str, HERB column joined with the name column, not repeated in the merged rows
+    :return: (list of merged column names, generator of merged rows)
+    """
+    # Precomputed projection of the HERB columns kept in the merged rows
+    projection = [i for i, column in enumerate(info_columns) if column != key]
+    project = itemgetter(*projection) if len(projection) > 1 else lambda row: (row[projection[0]],)
+    key_index = info_columns.index(key)
+    name_index = herb_columns.index(name_column)
+    id_index = herb_columns.index(id_column)
+    columns = herb_columns + [info_columns[i] for i in projection]
+
+    def rows():
+        # The last HERB herb of a duplicated name is joined, and the HERB herbs are only appended once their
+        # name is known to match no herb of tcm.db
+        info_by_name = {row[key_index]: row for row in info_rows}
+        names = set()
+        missing = (None,) * len(projection)
+        max_id = 0
+        for row in herb_rows:
+            names.add(row[name_index])
+            if row[id_index] is not None:
+                max_id = max(max_id, int(row[id_index]))
+            info = info_by_name.get(row[name_index])
+            yield tuple(row) + (project(info) if info is not None else missing)
+
+        empty = [None] * len(herb_columns)
+        for info in info_rows:
+            name = info[key_index]
+            if name in names:
+                continue
+            max_id += 1
+            row = list(empty)
+            row[name_index] = name
+            row[id_index] = max_id
+            yield tuple(row) + project(info)
+
+    return columns, rows()
+
+
+def merge_herb_tables(info_db='herb_info.db', tcm_db='../db/tcm.db', table='herbJoined'):
+    """
+    Create the merged herb table in tcm.db and insert the merged herbs
+    :param info_db: str, path of herb_info.db
+    :param tcm_db: str, path of tcm.db
+    :param table: str, merged table
+    :return: int, number of rows inserted
+    """
+    conn_info = sqlite3.connect(info_db)
+    info_columns, info_rows = read_table(conn_info, f'SELECT {", ".join(HERB_INFO_COLUMNS)} FROM herbs')
+    conn_info.close()
+
+    conn = sqlite3.connect(tcm_db)
+    herb_columns, herb_rows = read_table(conn, 'SELECT * FROM herb')
+    columns, rows = merge_rows(herb_columns, herb_rows, info_columns, info_rows)
+
+    with conn:
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {table} ({", ".join(f"{col} TEXT" for col in columns)})')
+        cursor = conn.executemany(f'INSERT INTO {table} ({", ".join(columns)}) '
+                                  f'VALUES ({", ".join("?" * len(columns))})', rows)
+    conn.close()
+    return cursor.rowcount
@@ -0,0 +1,223 @@
+"""
+Asynchronous extraction engine for the LLM pipeline.
+
+The extraction is network-bound: the time of each row is spent waiting for the LLM API. Instead of one
+synchronous request per process, the engine keeps up to `concurrency` requests in flight in a single event
+loop, throttled by token buckets for the API's requests/min and tokens/min limits, and retries rate-limited
+(429) and server (5xx) errors with exponential backoff.
+"""
+import asyncio
+import logging
+import random
+import time
+
+import tqdm
+from openai import APIConnectionError
+
+# HTTP status codes worth retrying besides the 5xx server errors: request timeout and rate limited. 409 (conflict)
+# is a client error, a retry would fail the same way.
+RETRYABLE_STATUS = {408, 429}
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `rate_per_minute`, holding at most one minute worth of tokens
+    """
+
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        """
+        Wait until `amount` tokens are available and take them
+        :param amount: float, capped at the capacity so that a single large request can always proceed
+        """
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+def status_code(exc):
+    """
+    HTTP status code carried by an API error, None if there is none
+    """
+    code = getattr(exc, 'status_code', None)
+    if code is None:
+        code = getattr(getattr(exc, 'response', None), 'status_code', None)
+    return code
+
+
+def is_retryable(exc):
+    """
+    Whether a failed request should be retried: rate limits, server errors, timeouts and connection errors
+    """
+    if isinstance(exc, (APIConnectionError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    code = status_code(exc)
+    return code is not None and (code in RETRYABLE_STATUS or code >= 500)
+
+
+def retry_after(exc):
+    """
+    Delay requested by the server through the Retry-After header, None if absent
+    """
+    headers = getattr(getattr(exc, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class ExtractionEngine:
+    """
+    Run an async LLM call over many items with bounded concurrency, rate limiting and retries
+    ----------
+    run: Process all the items, return the statistics of the run
+    submit: Add items to the run, e.g. the parts of a result that must be processed again
+    stop: Cancel the items not started yet, e.g. when their results can no longer be saved
+    """
+
+    def __init__(self,
+                 call,
+                 concurrency=16,
+                 requests_per_minute=None,
+                 tokens_per_minute=None,
+                 max_retries=5,
+                 base_delay=1.0,
+                 max_delay=60.0,
+                 progress=True):
+        """
+        :param call: async function (item) -> result, performing the LLM request(s) for one item
+        :param concurrency: int, maximum number of items in flight
+        :param requests_per_minute: int, request rate limit, None for no limit
+        :param tokens_per_minute: int, token rate limit, None for no limit. Items must then have a `tokens` attribute
+            or key with the estimated tokens of their request.
+        :param max_retries: int, retries of a retryable error before the item fails
+        :param base_delay: float, first backoff delay in seconds, doubled at every retry
+        :param max_delay: float, maximum backoff delay in seconds
+        :param progress: bool, show a progress bar
+        """
+        self.call = call
+        self.concurrency = concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.progress = progress
+        self.stats = {}
+        self.stopped = False
+        self.spawn = None
+
+    def stop(self):
+        """
+        Stop the run: the items in flight complete, the others are skipped without a request
+        """
+        if not self.stopped:
+            logging.warning('Extraction stopped, skipping the remaining items')
+        self.stopped = True
+
+    def submit(self, items):
+        """
+        Process more items in the current run, under the same concurrency, rate limits and retries. Must be called
+        from the event loop of the run, e.g. from `on_result`.
+        :param items: list of items passed to `call`
+        """
+        if self.spawn is None:
+            raise RuntimeError('Items can only be submitted while the engine runs')
+        for item in items:
+            self.spawn(item)
+
+    async def run(self, items, on_result=None, on_error=None):
+        """
+        Process the items
+        :param items: list of items passed to `call`
+        :param on_result: function (item, result) called in the event loop for every successful item
+        :param on_error: function (item, exception) called for every item that failed
+        :return: dict with completed, failed, skipped, retries, elapsed seconds and items/sec, the submitted items
+            included
+        """
+        request_bucket = TokenBucket(self.requests_per_minute) if self.requests_per_minute else None
+        token_bucket = TokenBucket(self.tokens_per_minute) if self.tokens_per_minute else None
+        semaphore = asyncio.Semaphore(self.concurrency)
+        self.stats = {'completed': 0, 'failed': 0, 'skipped': 0, 'retries': 0}
+        self.stopped = False
+        progress_bar = tqdm.tqdm(total=len(items), disable=not self.progress, desc='Extracting')
+        start = time.monotonic()
+
+        async def process(item):
+            async with semaphore:
+                for attempt in range(self.max_retries + 1):
+                    if self.stopped:
+                        self.stats['skipped'] += 1
+                        break
+                    if request_bucket:
+                        await request_bucket.acquire()
+                    if token_bucket:
+                        await token_bucket.acquire(item_tokens(item))
+                    try:
+                        result = await self.call(item)
+                    except Exception as e:
+                        if attempt < self.max_retries and is_retryable(e):
+                            self.stats['retries'] += 1
+                            delay = retry_after(e)
+                            if delay is None:
+                                # Exponential backoff with full jitter
+                                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                            logging.warning(f'Retrying in {delay:.1f}s after {type(e).__name__}: {e}')
+                            await asyncio.sleep(delay)
+                            continue
+                        self.stats['failed'] += 1
+                        logging.error(f'Extraction failed after {attempt + 1} attempts: {e}')
+                        if on_error:
+                            on_error(item, e)
+                        break
+                    self.stats['completed'] += 1
+                    if on_result:
+                        on_result(item, result)
+                    break
+                progress_bar.update(1)
+
+        tasks = []
+
+        def spawn(item):
+            progress_bar.total += 1
+            progress_bar.refresh()
+            tasks.append(asyncio.ensure_future(process(item)))
+
+        self.spawn = spawn
+        try:
+            tasks.extend(asyncio.ensure_future(process(item)) for item in items)
+            # Wait again for the items submitted while waiting
+            waited = 0
+            while waited < len(tasks):
+                pending = tasks[waited:]
+                waited = len(tasks)
+                await asyncio.gather(*pending)
+        finally:
+            self.spawn = None
+            progress_bar.close()
+        elapsed = time.monotonic() - start
+        self.stats['elapsed'] = elapsed
+        self.stats['items_per_sec'] = len(tasks) / elapsed if elapsed > 0 else 0.0
+        logging.info(f"Extraction done: {self.stats['completed']} completed, {self.stats['failed']} failed, "
+                     f"{self.stats['skipped']} skipped, {self.stats['retries']} retries in {elapsed:.1f}s "
+                     f"({self.stats['items_per_sec']:.2f} items/s)")
+        return self.stats
+
+
+def item_tokens(item):
+    if isinstance(item, dict):
+        return item.get('tokens', 0)
+    return getattr(item, 'tokens', 0)
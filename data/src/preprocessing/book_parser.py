@@ -0,0 +1,156 @@
+"""
+Tokenizer and parser of the book text.
+
+The headings of the books are DokuWiki-style:
+======Chapter======
+=====Section=====
+====Subsection====
+
+with one "=" less per level; the chapter and section breaks are configured per book, and the subsection break
+is one "=" shorter than the section break. A line is a heading of the highest level whose break it starts with,
+as `str.startswith` did before: a chapter line is any line starting with the chapter break. A subsection must
+also end with its break, so that text starting with a few "=" is not mistaken for a heading.
+
+The text is tokenized in one pass with a single precompiled regex into typed tokens: CHAPTER, SECTION and
+SUBSECTION headings with their title, and CONTENT blocks of the lines between two headings, stripped line by
+line. Only the lines starting with the common prefix of the breaks are matched against the heading regex, and
+the whole text is searched for them with `str.find`. `parse_rows` groups the tokens into the book rows, one per section.
+"""
+import os
+import re
+from collections import namedtuple
+
+CHAPTER = 'chapter'
+SECTION = 'section'
+SUBSECTION = 'subsection'
+CONTENT = 'content'
+
+Token = namedtuple('Token', ['kind', 'text'])
+
+
+class BookTokenizer:
+    """
+    Tokenizer of the book text
+    ----------
+    tokenize: Tokens of a whole text
+    tokenize_lines: Tokens of an iterable of lines, holding one content block at a time
+    """
+
+    def __init__(self, chapter_break='======', section_break='=====', subsection_break=None):
+        """
+        :param subsection_break: str, None for the section break minus one "="
+        """
+        if subsection_break is None:
+            subsection_break = section_break[:-1]
+        # Text that every heading starts with, searched for with `str.find`
+        self.marker = os.path.commonprefix([b for b in (chapter_break, section_break, subsection_break) if b])
+        levels = [rf'(?P<{CHAPTER}>{re.escape(chapter_break)}[^\n]*)',
+                  rf'(?P<{SECTION}>{re.escape(section_break)}[^\n]*)']
+        if subsection_break:
+            subsection = re.escape(subsection_break)
+            levels.append(rf'(?P<{SUBSECTION}>{subsection}[^=\n][^\n]*{subsection}[^\S\n]*)')
+        # Alternatives from the longest break, and leading spaces as `str.strip` of the line
+        self.heading = re.compile(rf'^[^\S\n]*(?:{"|".join(levels)})$', re.MULTILINE)
+
+    def tokenize(self, text):
+        """
+        :param text: str, the book after the </book> header
+        :return: generator of Tokens
+        """
+        # Strip every line once, so that the headings start right after a line break
+        text = '\n' + '\n'.join(map(str.strip, text.replace('\\', '').split('\n')))
+        find = text.find
+        heading_start = '\n' + self.marker
+        # Start of the current content block, and of the search for the next heading
+        start = position = 0
+        while True:
+            line_start = find(heading_start, position) + 1
+            if not line_start:
+                break
+            line_end = find('\n', line_start)
+            if line_end < 0:
+                line_end = len(text)
+            position = line_end
+            match = self.heading.match(text, line_start, line_end)
+            if not match:
+                continue
+            content = text[start:line_start].strip()
+            if content:
+                yield Token(CONTENT, content)
+            yield Token(match.lastgroup, match.group(match.lastgroup).replace('=', '').strip())
+            start = line_end
+        content = text[start:].strip()
+        if content:
+            yield Token(CONTENT, content)
+
+    def tokenize_lines(self, lines):
+        """
+        :param lines: iterable of str, the lines of the book after the </book> header
+        :return: generator of Tokens, the same as `tokenize` of the joined lines
+        """
+        block = []
+        for line in lines:
+            # Only the lines with a "=" can be headings: the others are kept raw, and stripped a block at a time
+            if '=' in line:
+                stripped = line.replace('\\', '').strip()
+                match = self.heading.match(stripped) if stripped.startswith(self.marker) else None
+                if match:
+                    content = content_block(block)
+                    if content:
+                        yield Token(CONTENT, content)
+                    block = []
+                    yield Token(match.lastgroup, match.group(match.lastgroup).replace('=', '').strip())
+                    continue
+            block.append(line)
+        content = content_block(block)
+        if content:
+            yield Token(CONTENT, content)
+
+
+def content_block(lines):
+    """
+    Content of raw lines between two headings: each line stripped, without the blank lines at both ends
+    """
+    return '\n'.join([line.replace('\\', '').strip() for line in lines]).strip()
+
+
+def parse_rows(tokens, book_id):
+    """
+    Group the tokens into book rows of chapter_id, chapter, section_id, section, and content. The subsection
+    titles are kept as lines of the content of their section.
+    :param tokens: iterable of Tokens
+    :param book_id: int
+    :return: generator of dicts, one per section with content
+    """
+    chapter = None
+    section = None
+    chapter_id = 0
+    section_id = 0
+    content = []
+
+    def make_row():
+        return {
+            'book_id': book_id,
+            'chapter_id': chapter_id,
+            'section_id': section_id,
+            'chapter': chapter,
+            'section': section,
+            'content': '\n'.join(content)
+        }
+
+    for kind, text in tokens:
+        if kind == CONTENT or kind == SUBSECTION:
+            content.append(text)
+            continue
+        if content:
+            yield make_row()
+        content = []
+        if kind == CHAPTER:
+            chapter = text
+            chapter_id += 1
+            section_id = 0
+        else:
+            section = text
+            section_id += 1
+    if content:
+        yield make_row()
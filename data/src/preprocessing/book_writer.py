@@ -0,0 +1,156 @@
+"""
+Bulk writer of the parsed books to SQLite.
+
+A book replaces its previous rows and its metadata row in a single transaction, with prepared `executemany`
+inserts in batches, on a connection tuned for bulk loading. The metadata of the other books is left untouched.
+"""
+import itertools
+import sqlite3
+
+# Bulk-loading pragmas: WAL lets the backend keep reading during the load, NORMAL syncs only at checkpoints
+WRITER_PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -65536',
+]
+
+METADATA_TABLE = '''
+CREATE TABLE IF NOT EXISTS metadata (
+    book_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    book_title TEXT,
+    author TEXT,
+    dynasty TEXT,
+    year TEXT,
+    category TEXT,
+    quality TEXT,
+    version TEXT,
+    reference TEXT,
+    notes TEXT
+)
+'''
+
+BOOK_TABLE = '''
+CREATE TABLE IF NOT EXISTS book (
+    ref_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    book_id INTEGER,
+    chapter_id INTEGER,
+    section_id TEXT,
+    chapter TEXT,
+    section TEXT,
+    content TEXT
+)
+'''
+
+# Serves the per-book DELETE of replace_book and the book_id lookups of the ingestion and the extraction.
+# Executed with BOOK_TABLE, so that it is also added to existing databases.
+BOOK_INDEX = 'CREATE INDEX IF NOT EXISTS idx_book_book_id ON book (book_id)'
+
+BOOK_COLUMNS = ['book_id', 'chapter_id', 'section_id', 'chapter', 'section', 'content']
+
+# Rows per INSERT statement: multi-row VALUES amortize the per-statement cost of executemany
+ROWS_PER_STATEMENT = 100
+
+
+def upsert_metadata(conn, metadata):
+    """
+    Replace the metadata row of one book, leaving the other books' rows untouched. Columns missing from the
+    metadata table are added. The row is deleted then inserted rather than INSERT OR REPLACE-d: a metadata table
+    written by pandas `to_sql` has no key on book_id, and would get one more row per save.
+    :param conn: sqlite3 connection, within the caller's transaction
+    :param metadata: dict of column -> value, with the book_id
+    """
+    conn.execute(METADATA_TABLE)
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(metadata)')}
+    for column in metadata:
+        if column not in columns:
+            conn.execute(f'ALTER TABLE metadata ADD COLUMN "{column}" TEXT')
+    names = ', '.join(f'"{column}"' for column in metadata)
+    placeholders = ', '.join('?' * len(metadata))
+    conn.execute('DELETE FROM metadata WHERE book_id = ?', (metadata['book_id'],))
+    conn.execute(f'INSERT INTO metadata ({names}) VALUES ({placeholders})', list(metadata.values()))
+
+
+def replace_book(conn, metadata, rows, batch_size=1000):
+    """
+    Replace the metadata and rows of one book, within the caller's transaction
+    :param conn: sqlite3 connection
+    :param metadata: dict, with the book_id
+    :param rows: iterable of tuples of BOOK_COLUMNS values, inserted in batches of batch_size
+    :return: int, number of rows inserted
+    """
+    conn.execute(BOOK_TABLE)
+    conn.execute(BOOK_INDEX)
+    upsert_metadata(conn, metadata)
+    conn.execute('DELETE FROM book WHERE book_id = ?', (metadata['book_id'],))
+    row_count = 0
+    for batch in batched(rows, batch_size):
+        insert_rows(conn, 'book', BOOK_COLUMNS, batch)
+        row_count += len(batch)
+    return row_count
+
+
+def insert_rows(conn, table, columns, rows):
+    """
+    Insert rows with prepared multi-row INSERT statements of ROWS_PER_STATEMENT rows
+    :param conn: sqlite3 connection
+    :param table: str
+    :param columns: list of str
+    :param rows: list of tuples of column values
+    """
+    values = f'({", ".join("?" * len(columns))})'
+    insert = f'INSERT INTO {table} ({", ".join(columns)}) VALUES '
+    full = len(rows) - len(rows) % ROWS_PER_STATEMENT
+    if full:
+        conn.executemany(insert + ', '.join([values] * ROWS_PER_STATEMENT),
+                         (tuple(itertools.chain.from_iterable(rows[i:i + ROWS_PER_STATEMENT]))
+                          for i in range(0, full, ROWS_PER_STATEMENT)))
+    conn.executemany(insert + values, rows[full:])
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+class BookWriter:
+    """
+    Connection to the book database for bulk writes
+    ----------
+    write_book: Replace the metadata and rows of a book in one transaction
+    close: Close the connection
+    """
+
+    def __init__(self, db_path, batch_size=1000, pragmas=WRITER_PRAGMAS):
+        """
+        :param db_path: str
+        :param batch_size: int, rows per executemany batch
+        :param pragmas: list of PRAGMA statements run on the connection
+        """
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(db_path)
+        for pragma in pragmas:
+            self.conn.execute(pragma)
+
+    def write_book(self, metadata, rows, extra_statements=()):
+        """
+        :param metadata: dict, with the book_id
+        :param rows: iterable of tuples of BOOK_COLUMNS values
+        :param extra_statements: (sql, parameters) pairs run in the same transaction, e.g. bookkeeping of the caller
+        :return: int, number of rows written
+        """
+        with self.conn:
+            row_count = replace_book(self.conn, metadata, rows, self.batch_size)
+            for sql, parameters in extra_statements:
+                self.conn.execute(sql, parameters)
+        return row_count
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,124 @@
+"""
+Token-aware chunking of long book sections.
+
+A section longer than the token budget of the LLM extraction is split into chunks at sentence boundaries,
+preferably right after a formula is complete: after its "右…味" ingredient count, or after its "…服。"
+administration sentence. A formula is never cut before its "右…味" line. Consecutive chunks overlap by a few
+sentences, so a treatment cut by a chunk boundary is complete in one of the two chunks; the duplicates are
+dropped when the treatments are saved (see extraction_jobs.JobWriter).
+
+Chunks are stored as book rows of the same chapter and section, with the stable sub-ids
+"<section_id>.1", "<section_id>.2", ...: the same content and budget always give the same chunks.
+"""
+import re
+
+from util import estimate_tokens
+
+# Sentences, with their terminator and the spaces that follow
+SENTENCE = re.compile(r'[^。！？；\n]*(?:[。！？；]+|\n|$)\s*')
+# A sentence closing the ingredient list of a formula, e.g. 右六味，以水七升
+FORMULA_COUNT = re.compile(r'^右[^。，,]{0,8}味')
+# Administration of a formula, e.g. 水煎服。
+ADMINISTRATION = re.compile(r'服[^。]{0,6}[。\n]?\s*$')
+
+
+def split_sentences(text):
+    return [sentence for sentence in SENTENCE.findall(text) if sentence]
+
+
+def hard_split(text, max_tokens):
+    """
+    Split a single sentence longer than the budget into pieces of at most max_tokens
+    """
+    pieces, start, tokens = [], 0, 0
+    for end, char in enumerate(text, 1):
+        # Same weights as estimate_tokens: one token per CJK character, a quarter per other character
+        tokens += 1 if ord(char) > 0x2e80 else 0.25
+        if tokens >= max_tokens:
+            pieces.append(text[start:end])
+            start, tokens = end, 0
+    if start < len(text):
+        pieces.append(text[start:])
+    return pieces
+
+
+def split_section(content, max_tokens, overlap_tokens=0):
+    """
+    Split a section into chunks of at most max_tokens
+    :param content: str
+    :param max_tokens: int, token budget of a chunk
+    :param overlap_tokens: int, tokens of trailing sentences repeated at the start of the next chunk
+    :return: list of str, [content] if it fits in the budget
+    """
+    if estimate_tokens(content) <= max_tokens:
+        return [content]
+
+    sentences = []
+    for sentence in split_sentences(content):
+        if estimate_tokens(sentence) > max_tokens:
+            sentences.extend(hard_split(sentence, max_tokens))
+        else:
+            sentences.append(sentence)
+    tokens = [estimate_tokens(sentence) for sentence in sentences]
+
+    chunks = []
+    start = 0
+    while start < len(sentences):
+        # Longest run of sentences from start that fits in the budget
+        end, total = start, 0
+        while end < len(sentences) and total + tokens[end] <= max_tokens:
+            total += tokens[end]
+            end += 1
+        end = max(end, start + 1)
+        if end < len(sentences):
+            end = cut_point(sentences, start, end)
+        chunks.append(''.join(sentences[start:end]).strip())
+        if end >= len(sentences):
+            break
+
+        # Next chunk starts with the last sentences of this one, within the overlap budget
+        next_start, overlap = end, 0
+        while next_start - 1 > start and overlap + tokens[next_start - 1] <= overlap_tokens:
+            next_start -= 1
+            overlap += tokens[next_start]
+        start = next_start
+    return chunks
+
+
+def cut_point(sentences, start, end):
+    """
+    Best end of a chunk of sentences[start:end]: right after the last complete formula in its second half, else the
+    last boundary that does not separate a formula from its "右…味" line
+    """
+    for cut in range(end, start + (end - start) // 2, -1):
+        if FORMULA_COUNT.match(sentences[cut - 1]) or ADMINISTRATION.search(sentences[cut - 1]):
+            if cut == len(sentences) or not FORMULA_COUNT.match(sentences[cut]):
+                return cut
+    for cut in range(end, start, -1):
+        if not FORMULA_COUNT.match(sentences[cut]):
+            return cut
+    return end
+
+
+def chunk_rows(rows, max_tokens, overlap_tokens=0):
+    """
+    Split the long book rows into chunk rows with the sub-ids "<section_id>.<n>"
+    :param rows: iterable of book row dicts
+    :param max_tokens: int, token budget of a chunk, None to keep the rows whole
+    :param overlap_tokens: int
+    :return: generator of book row dicts
+    """
+    for row in rows:
+        chunks = split_section(row['content'], max_tokens, overlap_tokens) if max_tokens else [row['content']]
+        if len(chunks) == 1:
+            yield row
+            continue
+        for number, chunk in enumerate(chunks, 1):
+            yield dict(row, section_id=f"{row['section_id']}.{number}", content=chunk)
+
+
+def section_key(section_id):
+    """
+    Section of a book row: the section_id without the chunk sub-id
+    """
+    return str(section_id).split('.')[0]
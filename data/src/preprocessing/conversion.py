@@ -0,0 +1,141 @@
+"""
+Traditional to simplified Chinese conversion of the book sources.
+
+zhconv converts a text by longest dictionary match, and no dictionary phrase spans a line break, so a text split
+at line boundaries converts to the same result piece by piece. Large books are split into one piece per worker
+and converted in a process pool.
+
+The converted text is cached on disk, in a file named after the SHA-256 of the locale and of the source bytes:
+re-ingesting an unchanged book reads the cached text and skips the conversion.
+"""
+import hashlib
+import logging
+import multiprocessing as mp
+import os
+
+import zhconv
+
+CACHE_DIR = '../db/converted'
+# Texts shorter than this are converted in the calling process
+MIN_PARALLEL_CHARS = 1 << 20
+
+
+def file_hash(file_path, locale='zh-cn'):
+    """
+    :return: str, SHA-256 hex digest of the locale and the file bytes
+    """
+    digest = hashlib.sha256(locale.encode('utf-8') + b'\0')
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_path(file_path, locale='zh-cn', cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f'{file_hash(file_path, locale)}.txt')
+
+
+def split_lines(text, pieces):
+    """
+    Split a text into about `pieces` parts of similar length, at line boundaries
+    :return: list of str, joining to the text
+    """
+    size = len(text) // pieces + 1
+    parts = []
+    start = 0
+    while start < len(text):
+        end = text.find('\n', start + size)
+        end = len(text) if end < 0 else end + 1
+        parts.append(text[start:end])
+        start = end
+    return parts
+
+
+def load_dictionary(locale):
+    # Pool initializer: load the conversion tables once per worker, not in the first task
+    zhconv.convert('', locale)
+
+
+def convert_piece(args):
+    text, locale = args
+    return zhconv.convert(text, locale)
+
+
+def convert_text(text, locale='zh-cn', workers=None):
+    """
+    Convert a text, in a process pool for large texts
+    :param text: str
+    :param locale: str, zhconv locale
+    :param workers: int, conversion processes, None for one per CPU, 1 to convert in this process
+    :return: str
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(text) < MIN_PARALLEL_CHARS:
+        return zhconv.convert(text, locale)
+    pieces = split_lines(text, workers)
+    with mp.Pool(min(workers, len(pieces)), initializer=load_dictionary, initargs=(locale,)) as pool:
+        return ''.join(pool.map(convert_piece, [(piece, locale) for piece in pieces]))
+
+
+def convert_file(file_path, locale='zh-cn', workers=None, cache_dir=CACHE_DIR):
+    """
+    Read a UTF-8 text file converted to the locale, from the cache if the file has not changed
+    :param file_path: str
+    :param locale: str, zhconv locale
+    :param workers: int, conversion processes, see `convert_text`
+    :param cache_dir: str, None to disable the cache
+    :return: str
+    """
+    cached = cache_path(file_path, locale, cache_dir) if cache_dir else None
+    if cached and os.path.exists(cached):
+        logging.debug(f'Converted text of {file_path} read from {cached}')
+        with open(cached, 'r', encoding='utf-8', newline='') as f:
+            return f.read()
+
+    with open(file_path, 'r', encoding='utf-8') as f:
+        text = convert_text(f.read(), locale, workers)
+    if cached:
+        write_cache(cached, text)
+    return text
+
+
+def iter_converted_lines(file_path, locale='zh-cn', cache_dir=CACHE_DIR):
+    """
+    Streaming version of `convert_file`: the lines of the file converted to the locale. On a cache miss the
+    lines are converted one by one and cached once the whole file has been read.
+    :return: generator of str
+    """
+    cached = cache_path(file_path, locale, cache_dir) if cache_dir else None
+    if cached and os.path.exists(cached):
+        with open(cached, 'r', encoding='utf-8', newline='') as f:
+            yield from f
+        return
+
+    with open(file_path, 'r', encoding='utf-8') as f:
+        if not cached:
+            for line in f:
+                yield zhconv.convert(line, locale)
+            return
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f'{cached}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8', newline='') as out:
+                for line in f:
+                    line = zhconv.convert(line, locale)
+                    out.write(line)
+                    yield line
+            os.replace(tmp_path, cached)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def write_cache(cached, text):
+    """
+    Write the converted text atomically, so that concurrent ingestions never read a partial file
+    """
+    os.makedirs(os.path.dirname(cached), exist_ok=True)
+    tmp_path = f'{cached}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+        f.write(text)
+    os.replace(tmp_path, cached)
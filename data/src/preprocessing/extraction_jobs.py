@@ -0,0 +1,253 @@
+"""
+Checkpoints of the LLM extraction.
+
+The extraction_job table records the state of every book row: pending, in_flight, done or failed. The
+extraction workers only produce results; a single writer thread owns the database connection and commits the
+treatments of a row together with its `done` state, in batched transactions. A killed run therefore leaves
+every row either done, with all its treatments, or not done, with none, and the next run resumes from the job
+table without rescanning the treatments.
+"""
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from book_writer import BOOK_INDEX
+
+PENDING = 'pending'
+IN_FLIGHT = 'in_flight'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def init_jobs(conn):
+    """
+    Create the job table, and the indexes on treatment.ref_id and book.book_id. On a database extracted before the job table
+    existed, the rows that already have treatments are recorded as done.
+    :param conn: sqlite3 connection of tcm.db
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'extraction_job'").fetchone()
+    with conn:
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS extraction_job (
+            ref_id INTEGER PRIMARY KEY,
+            book_id INTEGER,
+            status TEXT,
+            attempts INTEGER DEFAULT 0,
+            error TEXT,
+            updated_at REAL
+        )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_extraction_job_status ON extraction_job (book_id, status)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_treatment_ref_id ON treatment (ref_id)')
+        conn.execute(BOOK_INDEX)
+        if not exists:
+            conn.execute('''
+            INSERT OR IGNORE INTO extraction_job (ref_id, book_id, status, updated_at)
+            SELECT DISTINCT t.ref_id, b.book_id, ?, ? FROM treatment t JOIN book b ON b.ref_id = t.ref_id
+            ''', (DONE, time.time()))
+
+
+def queue_jobs(conn, book_id, retry_failed=True, reset=False):
+    """
+    Register the rows of a book and select the ones to extract
+    :param conn: sqlite3 connection of tcm.db
+    :param book_id: int
+    :param retry_failed: bool, extract the rows that failed in a previous run again
+    :param reset: bool, extract all the rows again, including the done ones
+    :return: set of ref_ids to extract
+    """
+    now = time.time()
+    with conn:
+        conn.execute('''
+        INSERT OR IGNORE INTO extraction_job (ref_id, book_id, status, updated_at)
+        SELECT ref_id, book_id, ?, ? FROM book WHERE book_id = ?
+        ''', (PENDING, now, book_id))
+        # Rows in flight when a previous run was killed have no result: extract them again
+        statuses = [IN_FLIGHT] + ([FAILED] if retry_failed else []) + ([DONE] if reset else [])
+        placeholders = ', '.join('?' * len(statuses))
+        conn.execute(f'UPDATE extraction_job SET status = ?, updated_at = ? '
+                     f'WHERE book_id = ? AND status IN ({placeholders})', (PENDING, now, book_id, *statuses))
+    return {ref_id for ref_id, in conn.execute('SELECT ref_id FROM extraction_job WHERE book_id = ? AND status = ?',
+                                               (book_id, PENDING))}
+
+
+def job_counts(conn, book_id):
+    """
+    :return: dict of status -> number of rows of the book
+    """
+    return dict(conn.execute('SELECT status, COUNT(*) FROM extraction_job WHERE book_id = ? GROUP BY status',
+                             (book_id,)).fetchall())
+
+
+def treatment_key(prescription_name, herbs):
+    """
+    Identity of a treatment for deduplication: its prescription name and the names of its herbs
+    """
+    names = sorted(herb.get('name') or '' for herb in herbs or [] if isinstance(herb, dict))
+    return (prescription_name or '').strip(), tuple(names)
+
+
+def treatment_list(result):
+    """
+    Treatments of an LLM result: the dict elements of a list, or a single dict as a list
+    :param result: JSON value parsed from the LLM response
+    :return: list of dicts, None if the result holds no treatment object
+    """
+    if isinstance(result, dict):
+        return [result]
+    if not isinstance(result, list):
+        return None
+    treatments = [treatment for treatment in result if isinstance(treatment, dict)]
+    if len(treatments) < len(result):
+        if not treatments:
+            return None
+        logging.warning(f'Dropped {len(result) - len(treatments)} treatments that are not JSON objects')
+    return treatments
+
+
+def treatment_row(ref_id, treatment):
+    return (ref_id, treatment.get('disease'), treatment.get('symptoms'), treatment.get('prescription_name'),
+            json.dumps(treatment.get('herbs') or [], ensure_ascii=False), treatment.get('notes'))
+
+
+class JobWriter(threading.Thread):
+    """
+    Single writer of the extraction results. Results are queued from any thread and committed in batches.
+    ----------
+    start_jobs: Mark rows as in flight
+    done: Queue the treatments of a row, which replace its previous ones, the row is marked done in the same
+        transaction. The treatments already saved for another chunk of the same section are dropped. A result that is not a list of treatments fails
+        the row.
+    failed: Queue the failure of a row
+    close: Flush the queued results and stop the thread
+    """
+
+    def __init__(self, db_path, batch_size=200, flush_interval=1.0):
+        """
+        :param db_path: str
+        :param batch_size: int, results per transaction
+        :param flush_interval: float, maximum seconds a result waits in the queue
+        """
+        super().__init__(name='JobWriter', daemon=True)
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.error = None
+        self.written = 0
+
+    def start_jobs(self, ref_ids):
+        self.queue.put((IN_FLIGHT, list(ref_ids), None))
+
+    def done(self, ref_id, treatments, siblings=None):
+        """
+        :param ref_id: int
+        :param treatments: list of treatments, as parsed from the LLM response
+        :param siblings: tuple of the ref_ids of all the chunks of the row's section, None if it is not chunked
+        """
+        result = treatments
+        treatments = treatment_list(result)
+        if treatments is None:
+            self.failed(ref_id, ValueError(f'not a list of treatments: {str(result)[:200]}'))
+            return
+        self.queue.put((DONE, ref_id, (treatments, siblings)))
+
+    def failed(self, ref_id, error):
+        self.queue.put((FAILED, ref_id, f'{type(error).__name__}: {error}'))
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+        if self.error:
+            raise self.error
+
+    def run(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        try:
+            batch = []
+            deadline = None
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    message = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    # The oldest queued result has waited flush_interval
+                    message = False
+                if message:
+                    if not batch:
+                        deadline = time.monotonic() + self.flush_interval
+                    batch.append(message)
+                if batch and (not message or len(batch) >= self.batch_size):
+                    self.flush(conn, batch)
+                    batch = []
+                    deadline = None
+                if message is None:
+                    break
+        except Exception as e:
+            logging.exception('Extraction writer failed')
+            self.error = e
+        finally:
+            conn.close()
+
+    def flush(self, conn, messages):
+        now = time.time()
+        treatments, states, done = [], [], []
+        # Treatment keys of the chunk rows of each chunked section, loaded on first use
+        section_keys = {}
+        for status, ref_id, payload in messages:
+            if status == IN_FLIGHT:
+                conn.executemany('UPDATE extraction_job SET status = ?, attempts = attempts + 1, updated_at = ? '
+                                 'WHERE ref_id = ?', ((IN_FLIGHT, now, r) for r in ref_id))
+            elif status == DONE:
+                row_treatments, siblings = payload
+                if siblings:
+                    row_treatments = self.drop_duplicates(conn, section_keys, ref_id, row_treatments, siblings)
+                treatments.extend(treatment_row(ref_id, treatment) for treatment in row_treatments or [])
+                states.append((DONE, None, now, ref_id))
+                done.append((ref_id,))
+            else:
+                states.append((FAILED, payload, now, ref_id))
+        herb_ref = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'herb_ref'").fetchone()
+        with conn:
+            # A row extracted again, e.g. with skip_processed=False, replaces its treatments of the previous run
+            if herb_ref:
+                conn.executemany('DELETE FROM herb_ref WHERE treatment_id IN '
+                                 '(SELECT treatment_id FROM treatment WHERE ref_id = ?)', done)
+            conn.executemany('DELETE FROM treatment WHERE ref_id = ?', done)
+            conn.executemany('INSERT INTO treatment (ref_id, disease, symptoms, prescription_name, herbs, notes) '
+                             'VALUES (?, ?, ?, ?, ?, ?)', treatments)
+            conn.executemany('UPDATE extraction_job SET status = ?, error = ?, updated_at = ? WHERE ref_id = ?',
+                             states)
+        self.written += len(states)
+        logging.debug(f'Committed {len(states)} rows, {len(treatments)} treatments')
+
+    @staticmethod
+    def drop_duplicates(conn, section_keys, ref_id, treatments, siblings):
+        """
+        Drop the treatments already saved, or queued in this batch, for the other chunks of the section
+        :param section_keys: dict of siblings -> dict of treatment key -> ref_id of the chunk it was saved for
+        :return: list of treatments
+        """
+        if siblings not in section_keys:
+            placeholders = ', '.join('?' * len(siblings))
+            section_keys[siblings] = {
+                treatment_key(name, json.loads(herbs or '[]')): row_ref_id
+                for row_ref_id, name, herbs in conn.execute(
+                    f'SELECT ref_id, prescription_name, herbs FROM treatment WHERE ref_id IN ({placeholders})',
+                    siblings)}
+        keys = section_keys[siblings]
+        kept = []
+        for treatment in treatments or []:
+            key = treatment_key(treatment.get('prescription_name'), treatment.get('herbs'))
+            if keys.setdefault(key, ref_id) != ref_id:
+                continue
+            kept.append(treatment)
+        if len(kept) < len(treatments or []):
+            logging.debug(f'Dropped {len(treatments) - len(kept)} treatments of ref_id {ref_id} already saved '
+                          f'for another chunk')
+        return kept
@@ -0,0 +1,181 @@
+"""
+Build the SQLite FTS5 full-text index searched by the backend's `/api/search?mode=fulltext`.
+
+FTS5 has no tokenizer for unsegmented Chinese text, so the indexed copy of every column is stored with a
+separator around each non-ASCII character: the unicode61 tokenizer then treats every Chinese character as
+a token. The backend segments its queries the same way (web-backend/app/fulltext.py).
+
+Segmentation happens in Python, so the source tables cannot feed the index directly. Triggers on the source
+tables record the changed rows in `fulltext_log`, whatever the writer, and `sync_fulltext` re-indexes them.
+The rowid of an index row is derived from its source and source id (`fulltext_rowid`), so that the index
+rows of a source row are found through the rowid instead of a scan of the unindexed source columns.
+Dropping a source table drops its triggers: `init_fulltext` is called by the writers that recreate the tables
+(`preprocessor.init_db`, `llm_processor.create_treatment_table`) and re-indexes a source in full when its
+triggers were missing or its rows no longer match the index. Run `build_fulltext` after the tables have been
+written; the backend only reads the index.
+"""
+import logging
+import re
+import sqlite3
+
+# Separator placed around non-ASCII characters in the indexed text, as in web-backend/app/fulltext.py.
+# U+2028 (LINE SEPARATOR) is a separator for unicode61 and does not occur in the book texts.
+SEPARATOR = '\u2028'
+RE_NON_ASCII = re.compile(r'([^\x00-\x7f])')
+
+# Indexed sources: source name -> (table, primary key, title expression, body expression)
+SOURCES = {
+    'book': ('book', 'ref_id',
+             "coalesce(chapter, '') || ' ' || coalesce(section, '')",
+             "coalesce(content, '')"),
+    'treatment': ('treatment', 'treatment_id',
+                  "coalesce(prescription_name, '')",
+                  "coalesce(disease, '') || ' ' || coalesce(symptoms, '') || ' ' || coalesce(notes, '')"),
+    'herb': ('herb_jointed', 'herb_id',
+             "coalesce(name, '')",
+             "coalesce(function, '') || ' ' || coalesce(indication, '')"),
+}
+
+# Code of each source in the rowid of its index rows, see `fulltext_rowid`
+SOURCE_CODES = {'book': 1, 'treatment': 2, 'herb': 3}
+SOURCE_ID_BITS = 40
+
+TRIGGER_EVENTS = (('INSERT', 'new'), ('UPDATE', 'old'), ('DELETE', 'old'))
+
+
+def segment(text):
+    """
+    Surround every non-ASCII character with the separator so that FTS5 indexes it as one token
+    :param text: str
+    :return: str
+    """
+    return RE_NON_ASCII.sub(SEPARATOR + r'\1' + SEPARATOR, text or '')
+
+
+def fulltext_rowid(source, source_id=0):
+    """
+    Rowid of the index row of a source row: the source code in the high bits, the source id in the low bits
+    :param source: str, key of SOURCES
+    :param source_id: int
+    :return: int
+    """
+    return (SOURCE_CODES[source] << SOURCE_ID_BITS) + source_id
+
+
+def init_fulltext(conn):
+    """
+    Create the FTS5 table, the change log and the missing sync triggers. A source is queued for a full re-index
+    when its triggers were missing, i.e. its table is new or was dropped and recreated, or when the ids of its
+    rows differ from the ids in the index. A source whose table does not exist is removed from the index.
+    :param conn: sqlite3 connection of tcm.db
+    :return: list of the sources queued for a full re-index
+    """
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    triggers = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+    rebuilt = []
+    with conn:
+        if 'fulltext' in tables and conn.execute('SELECT EXISTS (SELECT 1 FROM fulltext WHERE rowid < ?)',
+                                                 (1 << SOURCE_ID_BITS,)).fetchone()[0]:
+            # Index written before the rowids were derived from the source rows
+            conn.execute('DROP TABLE fulltext')
+            triggers = set()
+        conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS fulltext USING fts5(
+            source UNINDEXED,
+            source_id UNINDEXED,
+            title,
+            body,
+            tokenize = 'unicode61'
+        )
+        ''')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS fulltext_log (
+            source TEXT,
+            source_id INTEGER,
+            PRIMARY KEY (source, source_id)
+        )
+        ''')
+        for source, (table, key, _, _) in SOURCES.items():
+            # Index rows of the source, as the source ids of its rowid range
+            low, high = fulltext_rowid(source), fulltext_rowid(source, 1 << SOURCE_ID_BITS)
+            indexed = f'SELECT rowid - {low} FROM fulltext WHERE rowid >= {low} AND rowid < {high}'
+            logged = f"SELECT source_id FROM fulltext_log WHERE source = '{source}'"
+            if table not in tables:
+                conn.execute(f'DELETE FROM fulltext WHERE rowid >= {low} AND rowid < {high}')
+                continue
+            names = [f'fulltext_{table}_{event.lower()}' for event, _ in TRIGGER_EVENTS]
+            stale = not all(name in triggers for name in names)
+            for name, (event, row) in zip(names, TRIGGER_EVENTS):
+                conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table}
+                BEGIN
+                    INSERT OR IGNORE INTO fulltext_log (source, source_id) VALUES ('{source}', {row}.{key});
+                END
+                ''')
+            if not stale:
+                # Rows written while the triggers were missing, e.g. by an older version of the pipeline. The rows
+                # in the change log are re-indexed anyway.
+                stale = conn.execute(f'''
+                SELECT EXISTS (SELECT {key} FROM {table} EXCEPT {indexed} EXCEPT {logged})
+                    OR EXISTS ({indexed} EXCEPT SELECT {key} FROM {table} EXCEPT {logged})
+                ''').fetchone()[0]
+            if stale:
+                # Re-index every row of the table, and drop the index rows of the rows that are gone
+                conn.execute(f'''
+                INSERT OR IGNORE INTO fulltext_log (source, source_id)
+                SELECT '{source}', {key} FROM {table}
+                UNION SELECT '{source}', * FROM ({indexed})
+                ''')
+                rebuilt.append(source)
+    if rebuilt:
+        logging.info(f'Full-text index queued for a full re-index of {", ".join(rebuilt)}')
+    return rebuilt
+
+
+def sync_fulltext(conn, batch_size=1000):
+    """
+    Re-index the rows recorded in the change log
+    :param conn: sqlite3 connection of tcm.db
+    :param batch_size: int, number of rows re-indexed per transaction
+    :return: int, number of rows re-indexed
+    """
+    total = 0
+    while True:
+        changes = conn.execute('SELECT source, source_id FROM fulltext_log LIMIT ?', (batch_size,)).fetchall()
+        if not changes:
+            break
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        with conn:
+            for source, source_id in changes:
+                table, key, title, body = SOURCES[source]
+                conn.execute('DELETE FROM fulltext WHERE rowid = ?', (fulltext_rowid(source, source_id),))
+                row = conn.execute(f'SELECT {title}, {body} FROM {table} WHERE {key} = ?',
+                                   (source_id,)).fetchone() if table in tables else None
+                if row is not None:
+                    conn.execute('INSERT INTO fulltext (rowid, source, source_id, title, body) VALUES (?, ?, ?, ?, ?)',
+                                 (fulltext_rowid(source, source_id), source, source_id, segment(row[0]),
+                                  segment(row[1])))
+                conn.execute('DELETE FROM fulltext_log WHERE source = ? AND source_id = ?', (source, source_id))
+        total += len(changes)
+    return total
+
+
+def build_fulltext(db_path='../db/tcm.db'):
+    """
+    Bring the full-text index up to date with the source tables
+    :param db_path: str
+    :return: int, number of rows re-indexed
+    """
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        init_fulltext(conn)
+        total = sync_fulltext(conn)
+        logging.info(f'Full-text index synced: {total} rows')
+        return total
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    build_fulltext()
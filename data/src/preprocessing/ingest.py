@@ -0,0 +1,182 @@
+"""
+Bulk ingestion of a library of books, driven by the YAML book configs (see ../config).
+
+Books are parsed and converted to simplified Chinese in a process pool, and their rows are funneled to this
+process, the single SQLite writer, which replaces each book in one batched transaction. At most two books per
+worker are parsed ahead of the writer, so that the parsed books waiting for the writer stay bounded in memory. The hash of every
+book's source file and parsing config is recorded in the book_source table, and books whose hash has not
+changed since their last ingestion, and whose rows and metadata are still in the database, are skipped. Unlike
+running `preprocessor.py`, the tables are not dropped.
+
+Usage:
+    python ingest.py --config-dir ../config --workers 8
+    python ingest.py --config-dir ../config --force   # re-ingest all the books
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing as mp
+import os
+import queue
+import time
+
+from book_writer import BookWriter, BOOK_TABLE, BOOK_INDEX, METADATA_TABLE
+from fulltext_index import build_fulltext
+from preprocessor import from_config, load_config
+
+# Config fields that change the parsed rows of a book
+PARSING_FIELDS = ['book_id', 'chapter_break', 'section_break', 'remove_title_number', 'max_section_tokens',
+                  'chunk_overlap_tokens']
+
+
+def source_hash(config):
+    """
+    Hash of a book's source file and of the config fields that change its parsing
+    :param config: dict, book config
+    :return: str, SHA-256 hex digest
+    """
+    digest = hashlib.sha256(json.dumps({field: config.get(field) for field in PARSING_FIELDS},
+                                       sort_keys=True).encode('utf-8'))
+    with open(os.path.join(config['data_dir'], 'index.txt'), 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def init_source_table(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS book_source (
+        book_id INTEGER PRIMARY KEY,
+        config_path TEXT,
+        source_hash TEXT,
+        ingested_at REAL
+    )
+    ''')
+    conn.commit()
+
+
+def ingested_hashes(conn):
+    """
+    Source hashes of the books still in the database. A book whose rows or metadata row are gone, e.g. after
+    `preprocessor.init_db(create_new=True)` dropped the tables, is ingested again whatever its hash.
+    :param conn: sqlite3 connection
+    :return: dict of book_id -> source hash
+    """
+    conn.execute(BOOK_TABLE)
+    conn.execute(BOOK_INDEX)
+    conn.execute(METADATA_TABLE)
+    return dict(conn.execute('''
+    SELECT book_id, source_hash FROM book_source
+    WHERE book_id IN (SELECT book_id FROM book) AND book_id IN (SELECT book_id FROM metadata)
+    '''))
+
+
+def parse_book(task):
+    """
+    Worker: hash the book and, if it changed, parse it
+    :param task: (config_path, config, hash of the last ingestion or None)
+    :return: (config_path, config, hash, metadata, rows, error), metadata and rows are None if the book is
+        unchanged or failed, error is the message of the failure or None
+    """
+    config_path, config, known_hash = task
+    try:
+        digest = source_hash(config)
+        if digest == known_hash:
+            return config_path, config, digest, None, None, None
+        preprocessor = from_config(config)
+        lines = preprocessor.read_header()
+        rows = list(preprocessor.iter_rows(lines))
+    except Exception as e:
+        return config_path, config, None, None, None, f'{type(e).__name__}: {e}'
+    return config_path, config, digest, preprocessor.metadata, rows, None
+
+
+def load_configs(config_dir):
+    """
+    :return: list of (config_path, config) of the YAML files of the directory, sorted by path
+    """
+    configs = []
+    for name in sorted(os.listdir(config_dir)):
+        if name.endswith(('.yaml', '.yml')):
+            config_path = os.path.join(config_dir, name)
+            configs.append((config_path, load_config(config_path)))
+    return configs
+
+
+def ingest_library(config_dir='../config', db_path='../db/tcm.db', workers=None, force=False, batch_size=1000):
+    """
+    Ingest all the books of a config directory
+    :param config_dir: str, directory of the YAML book configs
+    :param db_path: str
+    :param workers: int, parsing processes, None for one per CPU
+    :param force: bool, re-ingest the books whose source has not changed
+    :param batch_size: int, rows per insert batch
+    :return: dict with the ingested, skipped and failed book counts and the rows written
+    """
+    configs = load_configs(config_dir)
+    book_ids = [config['book_id'] for _, config in configs]
+    duplicates = {book_id for book_id in book_ids if book_ids.count(book_id) > 1}
+    if duplicates:
+        raise ValueError(f'Duplicate book_id in {config_dir}: {sorted(duplicates)}')
+
+    writer = BookWriter(db_path, batch_size)
+    init_source_table(writer.conn)
+    known = {} if force else ingested_hashes(writer.conn)
+    tasks = [(config_path, config, known.get(config['book_id'])) for config_path, config in configs]
+
+    stats = {'ingested': 0, 'skipped': 0, 'failed': 0, 'rows': 0}
+    start = time.perf_counter()
+    # Results of the workers, or the exceptions raised while getting them, in completion order
+    results = queue.Queue()
+    pending = iter(tasks)
+    in_flight = 0
+    max_in_flight = 2 * (workers or os.cpu_count() or 1)
+    with mp.Pool(workers) as pool:
+        while True:
+            # A book is submitted only when a parsed one has been written
+            for task in itertools.islice(pending, max_in_flight - in_flight):
+                pool.apply_async(parse_book, (task,), callback=results.put, error_callback=results.put)
+                in_flight += 1
+            if not in_flight:
+                break
+            result = results.get()
+            in_flight -= 1
+            if isinstance(result, BaseException):
+                # The result of a worker could not be received
+                logging.error(f'Failed to parse a book: {result}')
+                stats['failed'] += 1
+                continue
+            config_path, config, digest, metadata, rows, error = result
+            if error:
+                # The failed book is retried at the next ingestion, as its hash is not recorded
+                logging.error(f'Failed to parse {config_path} (book_id {config.get("book_id")}): {error}')
+                stats['failed'] += 1
+                continue
+            if metadata is None:
+                stats['skipped'] += 1
+                continue
+            row_count = writer.write_book(metadata, rows, [(
+                'INSERT OR REPLACE INTO book_source (book_id, config_path, source_hash, ingested_at) '
+                'VALUES (?, ?, ?, ?)', (config['book_id'], config_path, digest, time.time()))])
+            stats['ingested'] += 1
+            stats['rows'] += row_count
+            logging.info(f"Ingested {metadata.get('book_title')} (book_id {config['book_id']}): {row_count} rows")
+    writer.close()
+    stats['elapsed'] = time.perf_counter() - start
+    logging.info(f"Library ingested in {stats['elapsed']:.1f}s: {stats['ingested']} books ingested, "
+                 f"{stats['skipped']} unchanged, {stats['failed']} failed, {stats['rows']} rows")
+    return stats
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config-dir', default='../config', help='directory of the YAML book configs')
+    parser.add_argument('--db-path', default='../db/tcm.db')
+    parser.add_argument('--workers', type=int, default=None, help='parsing processes, default one per CPU')
+    parser.add_argument('--force', action='store_true', help='re-ingest the unchanged books')
+    args = parser.parse_args()
+    ingest_library(args.config_dir, args.db_path, args.workers, args.force)
+    build_fulltext(args.db_path)
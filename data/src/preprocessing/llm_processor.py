@@ -3,24 +3,26 @@ Use LLM to extract the herb, disease, symptom, and treatment information from th
 """
 import logging
 
-from llm_util import get_bedrock_response, llm_post_processor, get_chatgpt_response
-
+from llm_util import get_bedrock_response, llm_post_processor, get_chatgpt_response, aget_chatgpt_response, \
+    llm_cache, clients as llm_clients
+from util import estimate_tokens
+from async_extractor import ExtractionEngine
+from extraction_jobs import JobWriter, init_jobs, queue_jobs, job_counts
+from chunker import section_key
+from read_model import build_read_model
+from fulltext_index import init_fulltext, build_fulltext
+
+import asyncio
 import sqlite3
+import httpx
 import pandas as pd
 import json
-import tqdm
-import multiprocessing as mp
-import numpy as np
 
 ## Set logging level to debug
 logging.basicConfig(level=logging.DEBUG)
 
 
-def get_treatment(text):
-    """
-    Get the list of herbs from the text
-    """
-    user_message = """
+TREATMENT_PROMPT = """
 请将以下中医书本内容重新整理为单个JSON格式，包括以下字段：
 
 - `disease`: Name of the disease.
@@ -67,13 +69,132 @@ def get_treatment(text):
 
 书本内容：
 """
-    user_message += text
+
+
+# Packing mode: several book sections share one request, and the instructions, see `aget_treatments_batch`
+BATCH_TREATMENT_PROMPT = """
+请将以下中医书本内容按段落分别重新整理为JSON格式，每个处方包括以下字段：
+
+- `disease`: Name of the disease.
+- `symptoms`: Description of the symptoms.
+- `prescription_name`: Name of the prescription.
+- `herbs`: List of herbs used in the prescription.
+  - `name`: Name of the herb.
+  - `dosage`: Dosage amount of the herb.
+  - `preparation`: Preparation method of the herb.
+- `notes`: Additional notes on the prescription and its effects.
+
+每个段落以“### 段落 <编号>”开头，可能包含多个处方，每个处方包含一个疾病、症状、处方名称、草药列表和备注。
+章节名称可能包含数字，如“產後肝痿七十五”，请将数字去掉，只保留中文部分。
+
+回复单个JSON对象，键为段落编号，值为该段落的处方列表，每个段落编号都必须出现，不要带“```”，JSON格式的示例：
+
+```
+{
+  "12": [{
+    "disease": "赤帶下",
+    "symptoms": "婦人有帶下而色紅者，似血非血，淋瀝不斷",
+    "prescription_name": "清肝止淋湯",
+    "herbs": [
+      {
+        "name": "白芍",
+        "dosage": "一两",
+        "preparation": "醋炒"
+      },
+      {
+        "name": "當歸",
+        "dosage": "一两",
+        "preparation": "酒洗"
+      }
+    ],
+    "notes": "水煎服，一劑少止..."
+  }],
+  "13": []
+}
+```
+
+仅回复JSON内容，如果段落不是处方，该段落的值为 []。无需加其他note或者其他内容，只需回复JSON格式的内容。
+
+书本内容：
+"""
+
+SECTION_HEADER = '### 段落 {ref_id}\n'
+
+
+def get_treatment(text):
+    """
+    Get the list of herbs from the text
+    """
+    user_message = TREATMENT_PROMPT + text
     # response_text = get_bedrock_response(user_message, max_gen_len=2048)
-    response_text = get_chatgpt_response(user_message, model_name="gpt-4o", max_tokens=None)
+    response_text = get_chatgpt_response(user_message, model_name="gpt-4o", max_tokens=None, json_response=True)
     response_json = llm_post_processor(response_text)
     return response_json
 
 
+async def aget_treatment(text, model_name="gpt-4o", http_async_client=None, use_cache=True):
+    """
+    Async version of `get_treatment`
+    """
+    response_text = await aget_chatgpt_response(TREATMENT_PROMPT + text, model_name=model_name, max_tokens=None,
+                                                http_async_client=http_async_client, use_cache=use_cache,
+                                                json_response=True)
+    return llm_post_processor(response_text)
+
+
+async def aget_treatments_batch(sections, model_name="gpt-4o", http_async_client=None, use_cache=True):
+    """
+    Extract the treatments of several book sections with one request
+    :param sections: list of (ref_id, content)
+    :return: (dict of ref_id -> list of treatments, list of the (ref_id, content) missing from the response). All
+        the sections are missing if the response is not a JSON object. The caller extracts them one by one.
+    """
+    text = '\n'.join(SECTION_HEADER.format(ref_id=ref_id) + content for ref_id, content in sections)
+    response_text = await aget_chatgpt_response(BATCH_TREATMENT_PROMPT + text, model_name=model_name,
+                                                max_tokens=None, http_async_client=http_async_client,
+                                                use_cache=use_cache, json_response=True)
+    response_json = llm_post_processor(response_text)
+    if not isinstance(response_json, dict):
+        response_json = {}
+
+    results = {}
+    missing = []
+    for ref_id, content in sections:
+        treatments = response_json.get(str(ref_id))
+        if isinstance(treatments, list):
+            results[ref_id] = treatments
+        else:
+            missing.append((ref_id, content))
+    if missing:
+        logging.warning(f"{len(missing)} of {len(sections)} sections missing from the batch response")
+    return results, missing
+
+
+def pack_sections(items, token_budget, max_sections=20):
+    """
+    Group consecutive rows into batches whose content fits in a token budget
+    :param items: list of dicts with the ref_id, content and content_tokens of a row
+    :param token_budget: int, maximum content tokens of a batch. A larger row gets a batch of its own.
+    :param max_sections: int, maximum rows of a batch
+    :return: list of batches, dicts with the sections as (ref_id, content) and the estimated tokens of the request
+    """
+    batches = []
+    batch, batch_tokens = [], 0
+    for item in items:
+        if batch and (batch_tokens + item['content_tokens'] > token_budget or len(batch) >= max_sections):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(item)
+        batch_tokens += item['content_tokens']
+    if batch:
+        batches.append(batch)
+
+    prompt_tokens = estimate_tokens(BATCH_TREATMENT_PROMPT)
+    return [{'sections': [(item['ref_id'], item['content']) for item in batch],
+             'tokens': prompt_tokens + 2 * sum(item['content_tokens'] for item in batch)}
+            for batch in batches]
+
+
 def create_treatment_table(create_new=False):
     """
     Create the treatment table in the SQLite database
@@ -97,65 +218,98 @@ def create_treatment_table(create_new=False):
         notes TEXT
     )
     ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_treatment_ref_id ON treatment (ref_id)')
+    # Lookup index of the backend, also created by its migration 3f9c2a1d7b4e: dropped with the table
+    cursor.execute('CREATE INDEX IF NOT EXISTS ix_treatment_prescription_name ON treatment (prescription_name)')
+    # The extraction checkpoints and the herb_ref high-water mark refer to the dropped treatments
+    cursor.execute('DROP TABLE IF EXISTS extraction_job')
+    cursor.execute("CREATE TABLE IF NOT EXISTS pipeline_state (key TEXT PRIMARY KEY, value INTEGER)")
+    cursor.execute("DELETE FROM pipeline_state WHERE key = 'herb_ref_treatment_id'")
     conn.commit()
+    # The dropped treatment table took its full-text triggers with it
+    init_fulltext(conn)
     conn.close()
 
 
 class LLMProcessor2:
-    def __init__(self, db_path, book_id):
+    def __init__(self, db_path, book_id, concurrency=16, requests_per_minute=None, tokens_per_minute=None,
+                 model_name="gpt-4o", use_cache=True, batch_tokens=None):
         """
         Initialize the LLMProcessor
         :param db_path: str
             Path to the SQLite database
         :param book_id: int
             Book ID for processing
+        :param concurrency: int
+            Maximum number of LLM requests in flight
+        :param requests_per_minute: int
+            Request rate limit of the API account, None for no limit
+        :param tokens_per_minute: int
+            Token rate limit of the API account, None for no limit
+        :param model_name: str
+            OpenAI model used for the extraction
+        :param use_cache: bool
+            Reuse the cached LLM responses of identical earlier requests (see llm_util.LLMCache)
+        :param batch_tokens: int
+            Packing mode: send consecutive rows together, up to this many content tokens per request, so that short
+            sections share the instructions of the prompt. None sends one row per request.
         """
         self.db_path = db_path
         self.book_id = book_id
-
-    def process_row(self, row, db_path, skip_processed=True):
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        if skip_processed:
-            # Check if the row has already been processed in the treatment table
-            cursor.execute('SELECT COUNT(*) FROM treatment WHERE ref_id = ?', (row['ref_id'],))
-            count = cursor.fetchone()[0]
-            if count > 0:
-                conn.close()
-                logging.info(f"Skipping row {row['ref_id']}")
-                return
-
-        if row['chapter'] == 'None':
-            return
-        content = row['content']
+        self.concurrency = concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.model_name = model_name
+        self.use_cache = use_cache
+        self.batch_tokens = batch_tokens
+        self.http_async_client = None
+
+    @staticmethod
+    def row_content(row):
+        """
+        Text sent to the LLM for a book row: chapter and section titles followed by the content
+        """
         chapter_info = f'# Chapter: {row["chapter"]}\n'
         section_info = f'## Section: {row["section"]}\n'
-        content = chapter_info + section_info + content
-
-        response_json = get_treatment(content)
-
-        if response_json:
-            for treatment in response_json:
-                herbs = treatment['herbs']
-                herbs_str = json.dumps(herbs, ensure_ascii=False)
-                cursor.execute('''
-                INSERT INTO treatment (ref_id, disease, symptoms, prescription_name, herbs, notes)
-                VALUES (?, ?, ?, ?, ?, ?)
-                ''', (row['ref_id'], treatment['disease'], treatment['symptoms'], treatment['prescription_name'],
-                      herbs_str, treatment['notes']))
+        return chapter_info + section_info + row['content']
 
-                logging.info(f"Inserted treatment for ref_id {row['ref_id']}")
-
-            conn.commit()
-        conn.close()
-        logging.info(f"Processed ref_id {row['ref_id']}")
+    async def process_row(self, item):
+        """
+        Extract the treatments of one book row
+        :param item: dict with the ref_id and content of the row
+        :return: list of treatments
+        """
+        return await aget_treatment(item['content'], model_name=self.model_name,
+                                    http_async_client=self.http_async_client, use_cache=self.use_cache)
 
-    def worker(self, rows, db_path):
-        for idx, row in rows.iterrows():
-            self.process_row(row, db_path)
+    async def process_batch(self, item):
+        """
+        Extract the treatments of several book rows with one request, or of one row missing from the response of
+        its batch
+        :param item: dict with the sections of the batch, as (ref_id, content), or the ref_id and content of a row
+        :return: (dict of ref_id -> list of treatments, list of the sections missing from the response), or the list
+            of treatments of a row
+        """
+        if 'sections' not in item:
+            return await self.process_row(item)
+        return await aget_treatments_batch(item['sections'], model_name=self.model_name,
+                                           http_async_client=self.http_async_client, use_cache=self.use_cache)
 
-    def process_books(self, max_rows=None):
+    @staticmethod
+    def chunk_siblings(df):
+        """
+        Chunk rows of the same section, identified by their "<section_id>.<n>" sub-ids
+        :param df: DataFrame of book rows
+        :return: dict of ref_id -> tuple of the ref_ids of all the chunks of its section
+        """
+        chunks = df[df['section_id'].astype(str).str.contains('.', regex=False)]
+        siblings = {}
+        for _, group in chunks.groupby([chunks['chapter_id'], chunks['section_id'].map(section_key)]):
+            ref_ids = tuple(int(ref_id) for ref_id in group['ref_id'])
+            siblings.update((ref_id, ref_ids) for ref_id in ref_ids)
+        return siblings
+
+    def process_books(self, max_rows=None, skip_processed=True):
         """
         Convert the book to a set of treatments
         From the ref database (book), we extract the corresponding information of herb, disease, symptom, and treatment
@@ -169,37 +323,132 @@ class LLMProcessor2:
             content TEXT
         Steps:
             1. Get the content from the book table
-            2. Extract the herb, disease, symptom, and treatment information using LLM
-            3. Create new tables for the extracted information
+            2. Extract the herb, disease, symptom, and treatment information using LLM, with up to
+               `concurrency` requests in flight (see async_extractor.ExtractionEngine)
+            3. Insert the extracted treatments into the treatment table, from a single writer thread that commits
+               them in batches together with the state of their rows (see extraction_jobs.JobWriter)
+        The chunks of a long section (chunker.py) are extracted in parallel like any row, and the treatments repeated
+        by the overlap of consecutive chunks are saved once.
+        The state of every row is kept in the extraction_job table, so a killed run resumes with the rows that
+        are not done yet.
+        :param max_rows: int, process only the first rows of the book
+        :param skip_processed: bool, skip the rows done in a previous run, False extracts all the rows again
+        :return: dict, statistics of the extraction run
         """
 
         # Get the content from the book table
-        query = f"SELECT * FROM book WHERE book_id = {self.book_id}"
+        query = "SELECT * FROM book WHERE book_id = ?"
         conn = sqlite3.connect(self.db_path)
-        df = pd.read_sql_query(query, conn)
-        conn.close()
+        init_jobs(conn)
+        pending = queue_jobs(conn, self.book_id, reset=not skip_processed)
+        df = pd.read_sql_query(query, conn, params=(self.book_id,))
+        chunk_siblings = self.chunk_siblings(df)
 
         if max_rows:
             # Process only a subset of rows
             df = df.head(max_rows)
 
-        logging.info(f"Processing {df.shape[0]} rows")
-
-        # Split dataframe into chunks
-        num_processes = mp.cpu_count()
-        chunks = np.array_split(df, num_processes)
-
-        with mp.Pool(processes=num_processes) as pool:
-            print(f"Processing {num_processes} chunks")
-            pool.starmap(self.worker, [(chunk, self.db_path) for chunk in chunks])
+        # Skip the front matter before the first chapter, stored as NULL or as 'None' by older pandas versions
+        df = df[df['chapter'].notna() & (df['chapter'] != 'None')]
+        logging.info(f"Skipping {(~df['ref_id'].isin(pending)).sum()} processed rows")
+        df = df[df['ref_id'].isin(pending)]
+
+        items = []
+        for _, row in df.iterrows():
+            content = self.row_content(row)
+            content_tokens = estimate_tokens(content)
+            # The response restates the content as JSON, count it as much as the prompt
+            tokens = estimate_tokens(TREATMENT_PROMPT) + 2 * content_tokens
+            items.append({'ref_id': int(row['ref_id']), 'content': content, 'content_tokens': content_tokens,
+                          'tokens': tokens})
+        logging.info(f"Processing {len(items)} rows")
+
+        writer = JobWriter(self.db_path)
+        writer.start()
+        writer.start_jobs(item['ref_id'] for item in items)
+        if self.batch_tokens:
+            items = pack_sections(items, self.batch_tokens)
+            logging.info(f"Packed into {len(items)} requests")
+            call = self.process_batch
+
+            def on_result(item, result):
+                check_writer()
+                if 'sections' not in item:
+                    writer.done(item['ref_id'], result, chunk_siblings.get(item['ref_id']))
+                    return
+                results, missing = result
+                for ref_id, treatments in results.items():
+                    writer.done(ref_id, treatments, chunk_siblings.get(ref_id))
+                # The sections missing from the response are extracted one by one, as jobs of the engine so that
+                # they stay within its concurrency and rate limits
+                engine.submit([{'ref_id': ref_id, 'content': content,
+                                'tokens': estimate_tokens(TREATMENT_PROMPT) + 2 * estimate_tokens(content)}
+                               for ref_id, content in missing])
+
+            def on_error(item, e):
+                check_writer()
+                ref_ids = [ref_id for ref_id, _ in item['sections']] if 'sections' in item else [item['ref_id']]
+                for ref_id in ref_ids:
+                    writer.failed(ref_id, e)
+        else:
+            call = self.process_row
+
+            def on_result(item, treatments):
+                check_writer()
+                writer.done(item['ref_id'], treatments, chunk_siblings.get(item['ref_id']))
+
+            def on_error(item, e):
+                check_writer()
+                writer.failed(item['ref_id'], e)
+
+        engine = ExtractionEngine(call,
+                                  concurrency=self.concurrency,
+                                  requests_per_minute=self.requests_per_minute,
+                                  tokens_per_minute=self.tokens_per_minute)
+
+        def check_writer():
+            # Results can no longer be saved: stop paying for requests, the rows left in flight are resumed next run
+            if writer.error:
+                engine.stop()
+
+        async def run_engine():
+            # One HTTP client per event loop, with a connection for every request in flight
+            limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+            async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(600.0)) as client:
+                self.http_async_client = client
+                try:
+                    return await engine.run(items, on_result=on_result, on_error=on_error)
+                finally:
+                    self.http_async_client = None
+                    llm_clients.release(client)
+
+        try:
+            stats = asyncio.run(run_engine())
+        finally:
+            writer.close()
+        logging.info(f"Rows of book {self.book_id}: {job_counts(conn, self.book_id)}")
+        conn.close()
+        llm_cache.flush()
+        logging.info(f"LLM response cache: {llm_cache.stats()}")
+        return stats
 
 
-def update_herb_table(create_new=False):
+def update_herb_table(create_new=False, db_path='../db/tcm.db', incremental=True):
     """
     Create or update the herb table in the SQLite database from the treatment table.
+    The herbs JSON of every treatment is parsed once, herb names are resolved through an in-memory dict and the
+    new herbs and herb references are bulk inserted in one transaction.
+    Treatments are only ever appended by the extraction, so in incremental mode only the treatments above the
+    highest treatment_id of the previous update are read: adding a book costs time proportional to that book.
+    :param create_new: bool, drop and recreate the herb and herb_ref tables
+    :param db_path: str
+    :param incremental: bool, only process the treatments added since the previous update. False rereads the
+        whole treatment table, e.g. after treatments were edited in place.
     """
 
-    conn = sqlite3.connect('../db/tcm.db')
+    conn = sqlite3.connect(db_path)
+    # Room for the herb_ref index, which every insert probes
+    conn.execute('PRAGMA cache_size = -262144')
     cursor = conn.cursor()
 
     if create_new:
@@ -230,39 +479,64 @@ def update_herb_table(create_new=False):
         )
         ''')
         conn.commit()
-
-    # Iterate through the treatment table and insert the data
-    cursor.execute('SELECT treatment_id, ref_id, herbs FROM treatment')
-    rows = cursor.fetchall()
-    for row in rows:
-        herbs = json.loads(row[2])
-        for herb in herbs:
-            herb.setdefault('dosage', '')
-            herb.setdefault('preparation', '')
-
-            # Check if the herb already exists in the herb table
-            cursor.execute('SELECT herb_id FROM herb WHERE name = ?', (herb['name'],))
-            herb_id = cursor.fetchone()
-            if herb_id:
-                herb_id = herb_id[0]
-            else:
-                # Insert new herb if it doesn't exist
-                cursor.execute('INSERT INTO herb (name, description) VALUES (?, ?)', (herb['name'], ''))
-                herb_id = cursor.lastrowid
-
-            # Check if the ref_id already exists for this herb_id and treatment_id
-            cursor.execute('''
-                SELECT 1 FROM herb_ref WHERE herb_id = ? AND treatment_id = ? AND ref_id = ?
-            ''', (herb_id, row[0], row[1]))
-            if not cursor.fetchone():
-                # Insert into herb_ref only if the combination does not exist
-                cursor.execute('''
-                    INSERT INTO herb_ref (herb_id, treatment_id, ref_id, dosage, preparation) 
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (herb_id, row[0], row[1], herb['dosage'], herb['preparation']))
-
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_herb_name ON herb (name)')
+    # High-water mark of the treatments already in herb_ref
+    cursor.execute('CREATE TABLE IF NOT EXISTS pipeline_state (key TEXT PRIMARY KEY, value INTEGER)')
+    if create_new or not incremental:
+        cursor.execute("DELETE FROM pipeline_state WHERE key = 'herb_ref_treatment_id'")
     conn.commit()
-    logging.info('Herb table updated successfully')
+    row = cursor.execute("SELECT value FROM pipeline_state WHERE key = 'herb_ref_treatment_id'").fetchone()
+    last_treatment_id = row[0] if row else 0
+    if last_treatment_id > (cursor.execute('SELECT MAX(treatment_id) FROM treatment').fetchone()[0] or 0):
+        # The treatment table was recreated since the previous update
+        last_treatment_id = 0
+
+    # Resolve herb names in memory, new herbs get the next ids
+    herb_ids = dict(cursor.execute('SELECT name, MIN(herb_id) FROM herb GROUP BY name'))
+    next_herb_id = (cursor.execute('SELECT MAX(herb_id) FROM herb').fetchone()[0] or 0) + 1
+    new_herbs = []
+    skipped = 0
+    treatments = 0
+    max_treatment_id = last_treatment_id
+
+    def herb_refs():
+        nonlocal next_herb_id, skipped, treatments, max_treatment_id
+        for treatment_id, ref_id, herbs in conn.execute('SELECT treatment_id, ref_id, herbs FROM treatment '
+                                                        'WHERE treatment_id > ? ORDER BY treatment_id',
+                                                        (last_treatment_id,)):
+            treatments += 1
+            max_treatment_id = treatment_id
+            for herb in json.loads(herbs or '[]'):
+                name = herb.get('name') if isinstance(herb, dict) else None
+                if not name:
+                    skipped += 1
+                    continue
+                herb_id = herb_ids.get(name)
+                if herb_id is None:
+                    herb_id = herb_ids[name] = next_herb_id
+                    next_herb_id += 1
+                    new_herbs.append((herb_id, name, ''))
+                yield herb_id, treatment_id, ref_id, herb.get('dosage', ''), herb.get('preparation', '')
+
+    with conn:
+        # Insert into herb_ref only the combinations that do not exist, through UNIQUE(herb_id, treatment_id, ref_id)
+        conn.executemany('''
+            INSERT OR IGNORE INTO herb_ref (herb_id, treatment_id, ref_id, dosage, preparation)
+            VALUES (?, ?, ?, ?, ?)
+        ''', herb_refs())
+        conn.executemany('INSERT INTO herb (herb_id, name, description) VALUES (?, ?, ?)', new_herbs)
+        conn.execute("INSERT OR REPLACE INTO pipeline_state (key, value) VALUES ('herb_ref_treatment_id', ?)",
+                     (max_treatment_id,))
+    # Lookup indexes of the backend, also created by its migration 3f9c2a1d7b4e. Built after the bulk insert, as
+    # a recreated herb_ref table has none.
+    with conn:
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_herb_ref_herb_id ON herb_ref (herb_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_herb_ref_treatment_id ON herb_ref (treatment_id)')
+
+    if skipped:
+        logging.warning(f'Skipped {skipped} herbs without a name')
+    conn.close()
+    logging.info(f'Herb table updated successfully: {treatments} treatments read, {len(new_herbs)} new herbs')
 
 
 def test_processor():
@@ -273,6 +547,8 @@ def test_processor():
     processor = LLMProcessor2('../db/tcm.db', book_id=1)
     processor.process_books(max_rows=10)
     update_herb_table(create_new=False)
+    build_read_model('../db/tcm.db')
+    build_fulltext('../db/tcm.db')
 
 
 def run():
@@ -280,9 +556,11 @@ def run():
     Process the data using LLM
     """
     create_treatment_table(create_new=False)
-    processor = LLMProcessor2('../db/tcm.db', book_id=1)
+    processor = LLMProcessor2('../db/tcm.db', book_id=1, batch_tokens=2000)
     processor.process_books()
     update_herb_table(create_new=False)
+    build_read_model('../db/tcm.db')
+    build_fulltext('../db/tcm.db')
 
 
 if __name__ == '__main__':
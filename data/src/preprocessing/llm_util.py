@@ -3,10 +3,19 @@ LLM Utility Functions
 Note: To use OpenAI API, please export OPENAI_API_KEY in your environment variables in ~/.bashrc or ~/.bash_profile.
 """
 
+import atexit
 import boto3
+import hashlib
+import httpx
 import json
+import os
 import sqlite3
 import logging
+import asyncio
+import threading
+import time
+import weakref
+from botocore.config import Config as BotoConfig
 from langchain_openai import ChatOpenAI
 
 # New connection to the SQLite database to store the QA pairs
@@ -24,8 +33,256 @@ CREATE TABLE IF NOT EXISTS qa_pairs (
 conn.commit()
 
 
+class LLMCache:
+    """
+    Read-through cache of LLM responses, content-addressed by a hash of (model, prompt, generation parameters)
+    ----------
+    get: Cached response, None on a miss
+    put: Store a response
+    delete: Remove a response, e.g. rejected by its caller
+    flush: Save the access times of the responses read since the last flush
+    stats: Hit and miss counters
+    """
+
+    def __init__(self, connection, ttl=30 * 24 * 3600, max_entries=200000, evict_every=1000, flush_every=1000):
+        """
+        :param connection: sqlite3 connection of the cache database
+        :param ttl: float, seconds after which a cached response expires, None to never expire
+        :param max_entries: int, maximum number of cached responses, the least recently used are evicted
+        :param evict_every: int, number of insertions between two eviction passes
+        :param flush_every: int, number of hits whose access times are kept in memory before they are saved
+        """
+        self.conn = connection
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self.flush_every = flush_every
+        # key -> time of the last hit, not saved yet: a hit does not write to the database
+        self.accessed = {}
+        self.puts = 0
+        self.hits = 0
+        self.misses = 0
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            model TEXT,
+            response TEXT,
+            created_at REAL,
+            accessed_at REAL
+        ) WITHOUT ROWID
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed_at ON llm_cache (accessed_at)')
+        self.conn.commit()
+
+    @staticmethod
+    def key(model, prompt, params):
+        """
+        Content address of a request
+        :param model: str
+        :param prompt: str
+        :param params: dict of generation parameters
+        :return: str, SHA-256 hex digest
+        """
+        payload = json.dumps({'model': model, 'prompt': prompt, 'params': params}, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, model, prompt, params, validate=None):
+        """
+        :param validate: function (response) -> bool, a cached response it rejects is deleted and counted as a miss
+        :return: str, None on a miss
+        """
+        key = self.key(model, prompt, params)
+        row = self.conn.execute('SELECT response, created_at FROM llm_cache WHERE key = ?', (key,)).fetchone()
+        now = time.time()
+        if row is not None and validate is not None and not validate(row[0]):
+            self.delete(model, prompt, params)
+            row = None
+        if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+            self.misses += 1
+            return None
+        self.accessed[key] = now
+        if len(self.accessed) >= self.flush_every:
+            self.flush()
+        self.hits += 1
+        return row[0]
+
+    def put(self, model, prompt, params, response):
+        now = time.time()
+        key = self.key(model, prompt, params)
+        self.accessed.pop(key, None)
+        self.conn.execute('INSERT OR REPLACE INTO llm_cache (key, model, response, created_at, accessed_at) '
+                          'VALUES (?, ?, ?, ?, ?)', (key, model, response, now, now))
+        self.puts += 1
+        if self.puts % self.evict_every == 0:
+            self.evict()
+        self.conn.commit()
+
+    def delete(self, model, prompt, params):
+        key = self.key(model, prompt, params)
+        self.accessed.pop(key, None)
+        self.conn.execute('DELETE FROM llm_cache WHERE key = ?', (key,))
+        self.conn.commit()
+
+    def flush(self):
+        """
+        Save the access times of the cache hits in one transaction
+        """
+        if not self.accessed:
+            return
+        accessed, self.accessed = self.accessed, {}
+        self.conn.executemany('UPDATE llm_cache SET accessed_at = ? WHERE key = ?',
+                              ((accessed_at, key) for key, accessed_at in accessed.items()))
+        self.conn.commit()
+
+    def evict(self):
+        """
+        Delete the expired responses, then the least recently used ones above max_entries
+        """
+        # The least recently used are chosen on the saved access times
+        self.flush()
+        if self.ttl is not None:
+            self.conn.execute('DELETE FROM llm_cache WHERE created_at < ?', (time.time() - self.ttl,))
+        self.conn.execute('''
+        DELETE FROM llm_cache WHERE key IN (
+            SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+        )
+        ''', (self.max_entries,))
+        self.conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
+
+
+# Responses are cached next to the QA pairs
+llm_cache = LLMCache(conn)
+atexit.register(llm_cache.flush)
+
+
+class ClientRegistry:
+    """
+    Per-process registry of LLM clients, so that credentials, client setup and TLS connections are reused across
+    calls instead of being redone for every request
+    ----------
+    chat_openai: ChatOpenAI of a model and its generation parameters, on a pooled keep-alive HTTP client
+    achat_openai: Same, bound to the async HTTP client of a running event loop
+    release: Forget the clients bound to an async HTTP client that is being closed
+    bedrock: Bedrock Runtime client of a region
+    """
+
+    def __init__(self, max_connections=64, keepalive_expiry=60.0):
+        """
+        :param max_connections: int, size of the HTTP connection pools
+        :param keepalive_expiry: float, seconds an idle connection is kept open
+        """
+        self.max_connections = max_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all the clients. Called automatically in a forked child process, whose inherited connections
+        must not be shared with the parent.
+        """
+        self.pid = os.getpid()
+        self.clients = {}
+        # httpx.AsyncClient -> ChatOpenAI clients bound to it. Not weakly keyed: the ChatOpenAI clients hold their
+        # HTTP client, the entries are dropped by `release` or once the HTTP client is closed.
+        self.async_clients = {}
+        # id of an event loop -> (weak reference to the loop, async HTTP client of the registry bound to it)
+        self.loop_clients = {}
+        self.http_client = None
+
+    def _check_pid(self):
+        if self.pid != os.getpid():
+            self.reset()
+
+    def limits(self):
+        return httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections,
+                            keepalive_expiry=self.keepalive_expiry)
+
+    def chat_openai(self, model_name, **params):
+        """
+        :param model_name: str
+        :param params: ChatOpenAI generation parameters (temperature, max_tokens, ...)
+        :return: ChatOpenAI, shared by all the calls with the same model and parameters
+        """
+        key = ('openai', model_name, tuple(sorted(params.items())))
+        with self.lock:
+            self._check_pid()
+            if key not in self.clients:
+                if self.http_client is None:
+                    self.http_client = httpx.Client(limits=self.limits(), timeout=httpx.Timeout(600.0))
+                self.clients[key] = ChatOpenAI(model=model_name, http_client=self.http_client, **params)
+            return self.clients[key]
+
+    def achat_openai(self, model_name, http_async_client=None, **params):
+        """
+        Must be called from a running event loop
+        :param model_name: str
+        :param http_async_client: httpx.AsyncClient of the running event loop, the clients are dropped when it is
+            released or closed. None for a pooled client of the registry, one per event loop.
+        :param params: ChatOpenAI generation parameters
+        :return: ChatOpenAI, shared by all the calls with the same model, parameters and async client
+        """
+        key = ('openai', model_name, tuple(sorted(params.items())))
+        with self.lock:
+            self._check_pid()
+            self._drop_closed_async_clients()
+            if http_async_client is None:
+                http_async_client = self._loop_client()
+            clients = self.async_clients.setdefault(http_async_client, {})
+            if key not in clients:
+                clients[key] = ChatOpenAI(model=model_name, http_async_client=http_async_client, **params)
+            return clients[key]
+
+    def release(self, http_async_client):
+        """
+        :param http_async_client: httpx.AsyncClient passed to `achat_openai`
+        """
+        with self.lock:
+            self.async_clients.pop(http_async_client, None)
+
+    def _loop_client(self):
+        loop = asyncio.get_running_loop()
+        entry = self.loop_clients.get(id(loop))
+        if entry is None or entry[0]() is not loop:
+            entry = self.loop_clients[id(loop)] = (weakref.ref(loop), httpx.AsyncClient(
+                limits=self.limits(), timeout=httpx.Timeout(600.0)))
+        return entry[1]
+
+    def _drop_closed_async_clients(self):
+        # The clients of a closed event loop can no longer be used, nor closed
+        for loop_id, (loop_ref, http_async_client) in list(self.loop_clients.items()):
+            loop = loop_ref()
+            if loop is None or loop.is_closed():
+                del self.loop_clients[loop_id]
+                self.async_clients.pop(http_async_client, None)
+        for http_async_client in [c for c in self.async_clients if c.is_closed]:
+            del self.async_clients[http_async_client]
+
+    def bedrock(self, region_name):
+        """
+        :param region_name: str, AWS region
+        :return: Bedrock Runtime client, with a connection pool and TCP keep-alive
+        """
+        key = ('bedrock-runtime', region_name)
+        with self.lock:
+            self._check_pid()
+            if key not in self.clients:
+                config = BotoConfig(max_pool_connections=self.max_connections, tcp_keepalive=True,
+                                    retries={'max_attempts': 5, 'mode': 'adaptive'})
+                self.clients[key] = boto3.session.Session().client("bedrock-runtime", region_name=region_name,
+                                                                    config=config)
+            return self.clients[key]
+
+
+clients = ClientRegistry()
+
+
 def get_bedrock_response(user_message, region_name="us-east-1", model_id="meta.llama3-70b-instruct-v1:0",
-                         max_gen_len=2048, temperature=0.5, top_p=0.9):
+                         max_gen_len=2048, temperature=0.5, top_p=0.9, use_cache=True):
     """
     Uses an LLM to process the text data from Traditional Chinese Medicine (TCM) and generate a response.
 
@@ -36,12 +293,19 @@ def get_bedrock_response(user_message, region_name="us-east-1", model_id="meta.l
     max_gen_len (int): The maximum length of the generated response. Default is 512.
     temperature (float): The temperature parameter for the model. Default is 0.5.
     top_p (float): The top_p parameter for the model. Default is 0.9.
+    use_cache (bool): Return the cached response of an identical earlier request if there is one. Default is True.
 
     Returns:
     str: The generated response text from the model.
     """
-    # Create a Bedrock Runtime client in the specified AWS Region.
-    client = boto3.client("bedrock-runtime", region_name=region_name)
+    params = {'max_gen_len': max_gen_len, 'temperature': temperature, 'top_p': top_p}
+    if use_cache:
+        cached = llm_cache.get(model_id, user_message, params)
+        if cached is not None:
+            return cached
+
+    # Bedrock Runtime client of the specified AWS Region, reused across calls
+    client = clients.bedrock(region_name)
 
     # Embed the message in Llama 3's prompt format.
     prompt = f"""
@@ -68,28 +332,42 @@ def get_bedrock_response(user_message, region_name="us-east-1", model_id="meta.l
 
     # Extract and return the generated text.
     response_text = model_response["generation"]
+    stop_reason = model_response.get("stop_reason")
 
     # Save the QA pair to the SQLite database
     cursor.execute('''
     INSERT INTO qa_pairs (question, answer) VALUES (?, ?)
     ''', (user_message, response_text))
     conn.commit()
+    if use_cache and is_cacheable(response_text, stop_reason):
+        llm_cache.put(model_id, user_message, params, response_text)
 
     return response_text
 
 
-def get_chatgpt_response(user_message, model_name="gpt-3.5-turbo", response_raw=False, max_tokens=4096):
+def get_chatgpt_response(user_message, model_name="gpt-3.5-turbo", response_raw=False, max_tokens=4096,
+                         use_cache=True, json_response=False):
     """
     Uses an OpenAI ChatGPT model to process the text data from Traditional Chinese Medicine (TCM) and generate a response.
 
     Parameters:
     user_message (str): The input message to process.
+    use_cache (bool): Return the cached response of an identical earlier request if there is one. Raw responses are
+        never cached, nor responses cut short by max_tokens or a content filter. Default is True.
+    json_response (bool): The response is a JSON value, cached only if it is complete. Default is False.
 
     Returns:
     str: The generated response text from the model.
     """
-    # Initialize the OpenAI ChatGPT model
-    llm = ChatOpenAI(temperature=0, model=model_name, max_tokens=max_tokens)
+    params = {'temperature': 0, 'max_tokens': max_tokens}
+    validate = is_complete_json if json_response else None
+    if use_cache and not response_raw:
+        cached = llm_cache.get(model_name, user_message, params, validate)
+        if cached is not None:
+            return cached
+
+    # OpenAI ChatGPT model, reused across calls
+    llm = clients.chat_openai(model_name, temperature=0, max_tokens=max_tokens)
 
     if response_raw:
         # Generate the raw response using the ChatGPT model
@@ -97,42 +375,159 @@ def get_chatgpt_response(user_message, model_name="gpt-3.5-turbo", response_raw=
         return response_text
     else:
         # Generate a response using the ChatGPT model
-        response_text = llm.invoke(user_message)
-        response_text = response_text.content
+        response = llm.invoke(user_message)
+        response_text = response.content
+        if use_cache and is_cacheable(response_text, response.response_metadata.get('finish_reason'), validate):
+            llm_cache.put(model_name, user_message, params, response_text)
         return response_text
 
 
+async def aget_chatgpt_response(user_message, model_name="gpt-3.5-turbo", max_tokens=4096, http_async_client=None,
+                                use_cache=True, json_response=False):
+    """
+    Async version of `get_chatgpt_response`, for the concurrent extraction engine.
+    Retries are left to the caller (see async_extractor.ExtractionEngine), so the client does not retry.
+
+    Parameters:
+    user_message (str): The input message to process.
+    http_async_client (httpx.AsyncClient): Client bound to the running event loop. Default is a pooled client of
+        the registry for the running event loop (see ClientRegistry.achat_openai).
+    use_cache (bool): Return the cached response of an identical earlier request if there is one. Default is True.
+        The cache is shared with `get_chatgpt_response`.
+    json_response (bool): The response is a JSON value, cached only if it is complete. Default is False.
+
+    Returns:
+    str: The generated response text from the model.
+    """
+    params = {'temperature': 0, 'max_tokens': max_tokens}
+    validate = is_complete_json if json_response else None
+    if use_cache:
+        cached = llm_cache.get(model_name, user_message, params, validate)
+        if cached is not None:
+            return cached
+
+    llm = clients.achat_openai(model_name, http_async_client, temperature=0, max_tokens=max_tokens, max_retries=0)
+    response = await llm.ainvoke(user_message)
+    if use_cache and is_cacheable(response.content, response.response_metadata.get('finish_reason'), validate):
+        llm_cache.put(model_name, user_message, params, response.content)
+    return response.content
+
+
+def is_cacheable(response_text, finish_reason, validate=None):
+    """
+    Whether a response can be cached: the model stopped by itself, not at max_tokens or a content filter, and the
+    caller's check accepts it. A truncated or malformed response is sent again next time instead of being cached.
+    :param response_text: str
+    :param finish_reason: str, reason the generation stopped, 'stop' for a complete response
+    :param validate: function (response_text) -> bool, None to accept any complete response
+    """
+    if finish_reason != 'stop':
+        logging.warning(f'Response not cached, the generation stopped with {finish_reason}')
+        return False
+    return validate is None or validate(response_text)
+
+
+JSON_DECODER = json.JSONDecoder()
+JSON_WHITESPACE = ' \t\n\r'
+
+
+def strip_code_fence(text):
+    """
+    Content of the first ``` fenced block of the text. The rest of the opening fence line is a language tag,
+    unless the fence closes on that line, e.g. ```[...]```. An unclosed fence, as in a truncated response, runs to
+    the end of the text.
+    """
+    start = text.find('```')
+    if start < 0:
+        return text
+    line_end = text.find('\n', start)
+    if line_end < 0:
+        line_end = len(text)
+    end = text.find('```', start + 3, line_end)
+    if end >= 0:
+        # Fence and content on one line
+        return text[start + 3:end]
+    end = text.find('```', line_end)
+    return text[line_end + 1:end if end >= 0 else len(text)]
+
+
+def skip_whitespace(text, pos):
+    while pos < len(text) and text[pos] in JSON_WHITESPACE:
+        pos += 1
+    return pos
+
+
+def parse_llm_json(text):
+    """
+    Parse the JSON array or object of an LLM response in one pass, salvaging what precedes a truncation.
+    The response may be wrapped in a code fence or surrounded by prose. If the JSON is cut short, e.g. by the
+    max_tokens limit, the complete elements of a top-level array, or the complete entries of a top-level object,
+    are returned.
+    :param text: str
+    :return: (JSON value or None, number of salvaged elements, whether the JSON was complete)
+    """
+    text = strip_code_fence(text)
+    starts = [pos for pos in (text.find('['), text.find('{')) if pos >= 0]
+    if not starts:
+        return None, 0, False
+    pos = min(starts)
+    try:
+        return JSON_DECODER.raw_decode(text, pos)[0], 0, True
+    except json.JSONDecodeError:
+        pass
+
+    # Truncated or malformed: decode the top-level container element by element
+    is_array = text[pos] == '['
+    result = [] if is_array else {}
+    pos += 1
+    while True:
+        pos = skip_whitespace(text, pos)
+        try:
+            if is_array:
+                value, pos = JSON_DECODER.raw_decode(text, pos)
+                result.append(value)
+            else:
+                key, pos = JSON_DECODER.raw_decode(text, pos)
+                pos = skip_whitespace(text, pos)
+                if not isinstance(key, str) or text[pos:pos + 1] != ':':
+                    break
+                value, pos = JSON_DECODER.raw_decode(text, skip_whitespace(text, pos + 1))
+                result[key] = value
+        except json.JSONDecodeError:
+            break
+        pos = skip_whitespace(text, pos)
+        if text[pos:pos + 1] != ',':
+            break
+        pos += 1
+    return result, len(result), False
+
+
+def is_complete_json(text):
+    """
+    Whether the text holds a complete JSON value, see `parse_llm_json`
+    """
+    return bool(text) and parse_llm_json(text)[2]
+
+
 def llm_post_processor(text):
     """
     Process the generated text from the LLM model.
     :param text:
-    :return: JSON object
-    """
-    # Check if the text contains 2 or more ``` (triple backticks)
-    if text.count('```') >= 2:
-        # Extract the JSON content between the triple backticks
-        start_index = text.find('```')
-        end_index = text.rfind('```')
-        json_text = text[start_index + 3:end_index].strip()
-        return json.loads(json_text)
-    # if only one ``` is found, remove it and try to load the JSON content
-    elif text.count('```') == 1:
-        text = text.replace('```', '')
-        text = text.strip()
-        return llm_post_processor(text)
+    :return: JSON object, [] if the text holds no JSON
+    """
     # Check if the text is empty
-    if not text:
+    if not text or not text.strip():
         logging.warning("The text is empty.")
         return []
 
-    # Check if the text is JSON
-    try:
-        response_json = json.loads(text)
-        return response_json
-    except json.JSONDecodeError:
+    response_json, salvaged, complete = parse_llm_json(text)
+    if response_json is None:
         # Warn the user that the text is not in JSON format
         logging.warning("The text is not in JSON format.")
         return []
+    if not complete:
+        logging.warning(f"The JSON is truncated or malformed, salvaged {salvaged} complete elements.")
+    return response_json
 
 
 if __name__ == '__main__':
@@ -23,13 +23,31 @@ Content
 
 """
 
+import itertools
 import os
 import pandas as pd
 import sqlite3  # SQLite is used to store the data
-import zhconv  # Convert between simplified and traditional Chinese
 import util
 import yaml
-
+from chunker import chunk_rows
+from conversion import convert_file, iter_converted_lines  # Convert between simplified and traditional Chinese
+from book_parser import BookTokenizer, parse_rows
+from book_writer import BookWriter, METADATA_TABLE, BOOK_TABLE, BOOK_INDEX, BOOK_COLUMNS
+from fulltext_index import init_fulltext, build_fulltext
+
+
+# Metadata keys of the books, in simplified Chinese, and their column in the metadata table
+METADATA_KEYS = {
+    '书名': 'book_title',
+    '作者': 'author',
+    '朝代': 'dynasty',
+    '年份': 'year',
+    '分类': 'category',
+    '品质': 'quality',
+    '版本': 'version',
+    '参本': 'reference',
+    '备考': 'notes',
+}
 
 def init_db(create_new=False):
     """
@@ -44,43 +62,44 @@ def init_db(create_new=False):
     conn.execute('DROP TABLE IF EXISTS book')
 
     # create the tables
-    conn.execute('''
-    CREATE TABLE metadata (
-        book_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        book_title TEXT,
-        author TEXT,
-        dynasty TEXT,
-        year TEXT,
-        category TEXT,
-        quality TEXT,
-        version TEXT,
-        reference TEXT,
-        notes TEXT
-    )
-    ''')
-    conn.execute('''
-    CREATE TABLE book (
-        ref_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        book_id INTEGER,
-        chapter_id INTEGER,
-        section_id TEXT,
-        chapter TEXT,
-        section TEXT,
-        content TEXT
-    )
-    ''')
+    conn.execute(METADATA_TABLE)
+    conn.execute(BOOK_TABLE)
+    conn.execute(BOOK_INDEX)
+    # The dropped book table took its full-text triggers with it
+    init_fulltext(conn)
     conn.close()
 
 
-def post_process_content(content):
+def parse_metadata(metadata_str, book_id):
+    """
+    Parse the key=value lines of the <book> header
+    :param metadata_str: str, text between <book> and </book>
+    :param book_id: int
+    :return: dict of metadata column -> value
+    """
+    metadata = {'book_id': book_id}
+    metadata_list = metadata_str.split('\n')
+    metadata_list = [item.strip() for item in metadata_list if item.strip()]
+
+    for item in metadata_list:
+        key, value = item.split('=')
+        # Replace the keys with English names
+        metadata[METADATA_KEYS.get(key, key)] = value
+    return metadata
+
+
+def book_row_values(row):
     """
-    Post-process the content
-    :param content: str
-    :return: str
+    Values of a book row for the book table, in the order of BOOK_COLUMNS
     """
-    # Remove the spaces and newlines at the beginning and end of the content
-    content = content.strip()
-    return content
+    return tuple(row[column] for column in BOOK_COLUMNS)
+
+
+def write_markdown_row(f, row):
+    f.write(f"## {row['chapter']}\n")
+    f.write(f"### {row['section']}\n")
+    f.write(row['content'])
+    f.write('\n\n')
 
 
 class Preprocessor:
@@ -89,6 +108,7 @@ class Preprocessor:
     ----------
     load_data: Load data from the data directory
     preprocess: Preprocess the data
+    stream_to_sqlite: Parse and save the book in one streaming pass, with bounded memory
     """
 
     def __init__(self,
@@ -97,8 +117,17 @@ class Preprocessor:
                  book_id=0,
                  chapter_break="======",
                  section_break="=====",
-                 remove_title_number=False
+                 remove_title_number=False,
+                 max_section_tokens=None,
+                 chunk_overlap_tokens=64,
+                 conversion_workers=None
                  ):
+        """
+        :param max_section_tokens: int, split the sections longer than this many tokens into chunk rows with the
+            section_ids "<section_id>.<n>" (see chunker.py), None to keep the sections whole
+        :param chunk_overlap_tokens: int, tokens repeated between consecutive chunks
+        :param conversion_workers: int, processes converting the book to simplified Chinese, None for one per CPU
+        """
         self.book_id = book_id
         self.data_dir = data_dir
         self.raw_data = None
@@ -106,7 +135,11 @@ class Preprocessor:
         self.book = None
         self.chapter_break = chapter_break
         self.section_break = section_break
+        self.tokenizer = BookTokenizer(chapter_break, section_break)
         self.remove_title_number = remove_title_number
+        self.max_section_tokens = max_section_tokens
+        self.chunk_overlap_tokens = chunk_overlap_tokens
+        self.conversion_workers = conversion_workers
         if db_path:
             self.db_path = db_path
         else:
@@ -115,18 +148,17 @@ class Preprocessor:
             if not os.path.exists(db_dir):
                 os.makedirs(db_dir)
             self.db_path = os.path.join(db_dir, 'tcm.db')
+        # Converted texts of the books, cached next to the database (see conversion.py)
+        self.conversion_cache = os.path.join(os.path.dirname(os.path.abspath(self.db_path)), 'converted')
 
     def load_data(self):
         """
         Load text data from the txt file and convert it to metadata and book dataframes
         :return:
         """
-        # Load the raw data
+        # Load the raw data, converted to simplified Chinese
         file_path = os.path.join(self.data_dir, 'index.txt')
-        with open(file_path, 'r', encoding='utf-8') as f:
-            self.raw_data = f.read()
-        # Convert to simplified Chinese
-        self.raw_data = zhconv.convert(self.raw_data, 'zh-cn')
+        self.raw_data = convert_file(file_path, 'zh-cn', self.conversion_workers, self.conversion_cache)
 
         # Extract metadata from the raw data
         self.extract_metadata()
@@ -138,37 +170,10 @@ class Preprocessor:
         :return:
         """
         # Extract metadata from the raw data
-        metadata = {'book_id': self.book_id}
         metadata_start = self.raw_data.find('<book>')
         metadata_start += len('<book>')
         metadata_end = self.raw_data.find('</book>')
-        metadata_str = self.raw_data[metadata_start:metadata_end]
-        metadata_list = metadata_str.split('\n')
-        metadata_list = [item.strip() for item in metadata_list if item.strip()]
-
-        for item in metadata_list:
-            key, value = item.split('=')
-            # Replace the keys with English names
-            if key == '书名':
-                key = 'book_title'
-            elif key == '作者':
-                key = 'author'
-            elif key == '朝代':
-                key = 'dynasty'
-            elif key == '年份':
-                key = 'year'
-            elif key == '分类':
-                key = 'category'
-            elif key == '品质':
-                key = 'quality'
-            elif key == '版本':
-                key = 'version'
-            elif key == '参本':
-                key = 'reference'
-            elif key == '备考':
-                key = 'notes'
-            metadata[key] = value
-        self.metadata = metadata
+        self.metadata = parse_metadata(self.raw_data[metadata_start:metadata_end], self.book_id)
 
     def extract_book(self):
         """
@@ -179,70 +184,8 @@ class Preprocessor:
         book_start = self.raw_data.find('</book>')
         book_start += len('</book>')
         book_str = self.raw_data[book_start:]
-        book_str = book_str.strip()
-        book_lines = book_str.split('\n')
-
-        # Remove \\from each line
-        book_lines = [line.replace('\\', '') for line in book_lines]
-        book_lines = [line.strip() for line in book_lines]
-
-        # Convert the book content to a dataframe of chapter_id, chapters, section_id, sections, and content
-        book = []
-        chapter = None
-        section = None
-        chapter_id = 0
-        section_id = 0
-        content = []
-        for line in book_lines:
-            if line.startswith(self.chapter_break):
-                # Processing the chapter
-                if content:
-                    book.append({
-                        'book_id': self.book_id,
-                        'chapter_id': chapter_id,
-                        'section_id': section_id,
-                        'chapter': chapter,
-                        'section': section,
-                        'content': post_process_content("\n".join(content))
-                    })
-                content = []
-                line = line.replace('=', '')
-                line = line.strip()
-                chapter = line
-                chapter_id += 1
-                section_id = 0
-            elif line.startswith(self.section_break):
-                # Processing the section
-                if content:
-                    book.append({
-                        'book_id': self.book_id,
-                        'chapter_id': chapter_id,
-                        'section_id': section_id,
-                        'chapter': chapter,
-                        'section': section,
-                        'content': post_process_content("\n".join(content))
-                    })
-                content = []
-                line = line.replace('=', '')
-                line = line.strip()
-                section = line
-                section_id += 1
-            else:
-                # Processing the content
-                content.append(line)
-                if content == ['']:
-                    content = []
-        if content:
-            book.append({
-                'book_id': self.book_id,
-                'chapter_id': chapter_id,
-                'section_id': section_id,
-                'chapter': chapter,
-                'section': section,
-                'content': post_process_content("\n".join(content))
-            })
-
-        # TODO: Update the content to limit the length of each. Split the content into multiple if it is too long
+
+        book = list(parse_rows(self.tokenizer.tokenize(book_str), self.book_id))
 
         # Export the book to markdown format
         title = self.metadata['book_title']
@@ -251,18 +194,76 @@ class Preprocessor:
         with open(export_path, 'w', encoding='utf-8') as f:
             f.write(f"# {title}\n")
             for row in book:
-                f.write(f"## {row['chapter']}\n")
-                f.write(f"### {row['section']}\n")
-                f.write(row['content'])
-                f.write('\n\n')
+                write_markdown_row(f, row)
 
         if self.remove_title_number:
             for idx, row in enumerate(book):
                 book[idx]['chapter'] = util.remove_number(book[idx]['chapter'])
                 book[idx]['section'] = util.remove_number(book[idx]['section'])
 
+        # Split the long sections to the token budget of the LLM extraction
+        book = list(chunk_rows(book, self.max_section_tokens, self.chunk_overlap_tokens))
+
         self.book = pd.DataFrame(book)
 
+    def iter_lines(self):
+        """
+        Read index.txt line by line, converted to simplified Chinese
+        :return: generator of str
+        """
+        file_path = os.path.join(self.data_dir, 'index.txt')
+        return iter_converted_lines(file_path, 'zh-cn', self.conversion_cache)
+
+    def read_header(self):
+        """
+        Start streaming the book: read the title line and the <book> metadata, up to </book>, and set the metadata
+        :return: iterator of the remaining lines
+        """
+        lines = self.iter_lines()
+        header = []
+        for line in lines:
+            if '</book>' in line:
+                header.append(line[:line.find('</book>')])
+                lines = itertools.chain([line[line.find('</book>') + len('</book>'):]], lines)
+                break
+            header.append(line)
+        header = ''.join(header)
+        self.metadata = parse_metadata(header[header.find('<book>') + len('<book>'):], self.book_id)
+        return lines
+
+    def iter_rows(self, lines):
+        """
+        Parse the streamed book lines and export them to markdown as they go
+        :param lines: iterator of the lines after the header, see `read_header`
+        :return: generator of the book rows, as tuples of BOOK_COLUMNS values
+        """
+        title = self.metadata['book_title']
+        export_path = os.path.join("../../books/markdown", f'{title}.md')
+        with open(export_path, 'w', encoding='utf-8') as f:
+            f.write(f"# {title}\n")
+            for row in parse_rows(self.tokenizer.tokenize_lines(lines), self.book_id):
+                write_markdown_row(f, row)
+                if self.remove_title_number:
+                    row['chapter'] = util.remove_number(row['chapter'])
+                    row['section'] = util.remove_number(row['section'])
+                for chunk in chunk_rows([row], self.max_section_tokens, self.chunk_overlap_tokens):
+                    yield book_row_values(chunk)
+
+    def stream_to_sqlite(self, batch_size=1000):
+        """
+        Streaming version of `book_to_sqlite` for large books: the file is read line by line, and the sections are
+        converted, parsed, and written to SQLite and markdown as they are read, in batches of `batch_size` rows.
+        Only the current section and batch are held in memory. The book replaces its previous rows in a single
+        transaction.
+        :param batch_size: int, rows per insert batch
+        :return: int, number of rows saved
+        """
+        lines = self.read_header()
+        with BookWriter(self.db_path, batch_size) as writer:
+            row_count = writer.write_book(self.metadata, self.iter_rows(lines))
+        print(f"Book: {row_count} rows")
+        return row_count
+
     def get_results(self):
         """
         Get the metadata and book content
@@ -273,38 +274,28 @@ class Preprocessor:
     def save_to_sqlite(self):
         """
         Save the metadata and book content to a SQLite database
+        The book replaces its previous rows, and its metadata row, in one transaction (see book_writer.BookWriter)
         :return:
         """
-        conn = sqlite3.connect(self.db_path)
-
-        # Convert the metadata to a row in the metadata table
-        metadata = pd.DataFrame([self.metadata])
-        # Append the metadata to the metadata table with key=book_id
-        # If exists, replace the row
-        metadata.to_sql('metadata', conn, if_exists='replace', index=False)
-
-        column_count = len(self.book.columns)
-        # Check the type of each column in the book dataframe
-        for col in self.book.columns:
-            if self.book[col].dtype == 'O':
-                self.book[col] = self.book[col].astype(str)
-
-        # If exists, remove this book in the table, then append the new book
-        conn.execute(f'DELETE FROM book WHERE book_id = {self.book_id}')
-
-        self.book.to_sql('book', conn, if_exists='append', index=False)
+        # Python values of the book columns, with None for the missing ones
+        rows = self.book[BOOK_COLUMNS].astype(object).where(self.book[BOOK_COLUMNS].notna(), None).values.tolist()
+        with BookWriter(self.db_path) as writer:
+            row_count = writer.write_book(self.metadata, rows)
 
         # Log the summary
-        print(f"Metadata: {metadata.shape[0]} rows")
-        print(f"Book: {self.book.shape[0]} rows")
-        print(f"Columns: {column_count} columns")
-        conn.close()
+        print("Metadata: 1 rows")
+        print(f"Book: {row_count} rows")
+        print(f"Columns: {len(self.book.columns)} columns")
 
-    def book_to_sqlite(self):
+    def book_to_sqlite(self, stream=False):
         """
         Load the book, preprocess it, and save it to SQLite
+        :param stream: bool, use the streaming mode (`stream_to_sqlite`) for large books
         :return:
         """
+        if stream:
+            self.stream_to_sqlite()
+            return
         self.load_data()
         self.save_to_sqlite()
 
@@ -315,15 +306,24 @@ def load_config(config_path):
     return config
 
 
-def run(config):
-    preprocessor = Preprocessor(
+def from_config(config):
+    """
+    Preprocessor of a book config
+    """
+    return Preprocessor(
         data_dir=config['data_dir'],
         db_path=config['db_path'],
         book_id=config['book_id'],
         chapter_break=config['chapter_break'],
         section_break=config['section_break'],
-        remove_title_number=config['remove_title_number']
+        remove_title_number=config['remove_title_number'],
+        max_section_tokens=config.get('max_section_tokens'),
+        chunk_overlap_tokens=config.get('chunk_overlap_tokens', 64)
     )
+
+
+def run(config):
+    preprocessor = from_config(config)
     preprocessor.book_to_sqlite()
 
 
@@ -333,3 +333,4 @@ if __name__ == '__main__':
     run(config_)
     config_ = load_config("../config/傷寒雜病論_桂本.yaml")
     run(config_)
+    build_fulltext('../db/tcm.db')
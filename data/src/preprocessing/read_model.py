@@ -0,0 +1,116 @@
+"""
+Build the read model of the herb and treatment detail pages.
+
+The backend's `/api/herb` and `/api/treatment` responses are assembled from herb_jointed, herb_ref and treatment.
+This step materializes each response as a JSON document in the `detail_doc` table, keyed by (kind, simplified
+name), so the detail endpoints become a single primary-key fetch. Run it after `update_herb_table()` and the
+herb merge, whenever the tables it reads have changed.
+"""
+import json
+import logging
+import sqlite3
+
+# herb_jointed columns of the /api/herb document, in the order of the backend's response
+HERB_DETAIL_COLUMNS = [
+    'name', 'description', 'herb_pinyin_name', 'herb_en_name', 'herb_latin_name', 'properties', 'meridians',
+    'UsePart', 'function', 'indication', 'toxicity', 'clinical_manifestations', 'therapeutic_en_class',
+    'therapeutic_cn_class', 'tcmid_id', 'tcm_id_id', 'symmap_id', 'tcmsp_id'
+]
+
+
+def dump_doc(doc):
+    return json.dumps(doc, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+
+def herb_docs(conn):
+    """
+    Herb documents, as (name, JSON) pairs. As in the backend, only the first herb of a duplicated name is kept.
+    """
+    columns = ', '.join(f'h.{col}' for col in HERB_DETAIL_COLUMNS)
+    rows = conn.execute(f'''
+    SELECT h.herb_id, {columns}, t.treatment_id, t.prescription_name, r.dosage, r.preparation
+    FROM herb_jointed h
+    LEFT JOIN herb_ref r ON r.herb_id = h.herb_id
+    LEFT JOIN treatment t ON t.treatment_id = r.treatment_id
+    WHERE h.name IS NOT NULL
+    ORDER BY h.name, h.herb_id
+    ''')
+    doc = None
+    for row in rows:
+        herb_id, values, treatment = row[0], row[1:len(HERB_DETAIL_COLUMNS) + 1], row[len(HERB_DETAIL_COLUMNS) + 1:]
+        name = values[0]
+        if doc is None or name != doc['name']:
+            if doc is not None:
+                yield doc['name'], dump_doc(doc)
+            doc = dict(zip(HERB_DETAIL_COLUMNS, values))
+            doc['treatments'] = []
+            first_id = herb_id
+        if herb_id != first_id:
+            continue
+        treatment_id, prescription_name, dosage, preparation = treatment
+        if treatment_id is not None:
+            doc['treatments'].append({'name': prescription_name, 'dosage': dosage, 'preparation': preparation})
+    if doc is not None:
+        yield doc['name'], dump_doc(doc)
+
+
+def treatment_docs(conn):
+    """
+    Treatment documents, as (name, JSON) pairs. Only the first treatment of a duplicated name is kept.
+    """
+    rows = conn.execute('''
+    SELECT t.treatment_id, t.prescription_name, t.notes, h.herb_id, h.name, r.dosage, r.preparation
+    FROM treatment t
+    LEFT JOIN herb_ref r ON r.treatment_id = t.treatment_id
+    LEFT JOIN herb_jointed h ON h.herb_id = r.herb_id
+    WHERE t.prescription_name IS NOT NULL
+    ORDER BY t.prescription_name, t.treatment_id
+    ''')
+    doc = None
+    for treatment_id, name, notes, herb_id, herb_name, dosage, preparation in rows:
+        if doc is None or name != doc['name']:
+            if doc is not None:
+                yield doc['name'], dump_doc(doc)
+            doc = {'name': name, 'notes': notes, 'herbs': []}
+            first_id = treatment_id
+        if treatment_id != first_id:
+            continue
+        if herb_id is not None:
+            doc['herbs'].append({'name': herb_name, 'dosage': dosage, 'preparation': preparation})
+    if doc is not None:
+        yield doc['name'], dump_doc(doc)
+
+
+def build_read_model(db_path='../db/tcm.db'):
+    """
+    Rebuild the detail_doc table. The new documents are written to a staging table that replaces the old one
+    in the same transaction, so readers never see a partial read model.
+    :param db_path: str
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            conn.execute('DROP TABLE IF EXISTS detail_doc_staging')
+            conn.execute('''
+            CREATE TABLE detail_doc_staging (
+                kind TEXT,
+                name TEXT,
+                doc TEXT,
+                PRIMARY KEY (kind, name)
+            ) WITHOUT ROWID
+            ''')
+            conn.executemany('INSERT INTO detail_doc_staging (kind, name, doc) VALUES (?, ?, ?)',
+                             (('herb', name, doc) for name, doc in herb_docs(conn)))
+            conn.executemany('INSERT INTO detail_doc_staging (kind, name, doc) VALUES (?, ?, ?)',
+                             (('treatment', name, doc) for name, doc in treatment_docs(conn)))
+            conn.execute('DROP TABLE IF EXISTS detail_doc')
+            conn.execute('ALTER TABLE detail_doc_staging RENAME TO detail_doc')
+        counts = dict(conn.execute('SELECT kind, COUNT(*) FROM detail_doc GROUP BY kind').fetchall())
+        logging.info(f"Read model built: {counts.get('herb', 0)} herbs, {counts.get('treatment', 0)} treatments")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    build_read_model()
@@ -3,6 +3,9 @@ Utility functions for preprocessing
 """
 
 
+NUMBERS = '一二三四五六七八九十'
+
+
 def remove_number(text):
     """
     Remove all "一、二、三、四、五、六、七、八、九、十" from the end of the text
@@ -10,7 +13,16 @@ def remove_number(text):
     if not text:
         return text
     text = text.strip()
-    if text[-1] in ['一', '二', '三', '四', '五', '六', '七', '八', '九', '十']:
-        text = text[:-1]
-        text = remove_number(text)
+    while text and text[-1] in NUMBERS:
+        text = text[:-1].strip()
     return text
+
+
+def estimate_tokens(text):
+    """
+    Rough token count of a text for rate limiting: about one token per CJK character and per 4 other characters
+    :param text: str
+    :return: int
+    """
+    cjk = sum(1 for ch in text if ord(ch) > 0x2e80)
+    return cjk + (len(text) - cjk) // 4 + 1
@@ -0,0 +1,44 @@
+"""
+Shared setup of the pipeline tests.
+
+The preprocessing modules use paths relative to their working directory, such as '../db/tcm.db', and llm_util
+opens its cache database on import: the tests run in a scratch copy of the directory layout, as the benchmarks
+do (see benchmarks/bench_util.py), with the LLM API served by benchmarks/fake_llm_server.py.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '../benchmarks'))
+
+from bench_util import prepare_workdir, create_book_db
+from fake_llm_server import start_server
+
+prepare_workdir()
+FAKE_SERVER = start_server(latency=0.0)
+os.environ['OPENAI_BASE_URL'] = f'http://127.0.0.1:{FAKE_SERVER.server_port}/v1'
+os.environ.setdefault('OPENAI_API_KEY', 'fake')
+
+
+@pytest.fixture
+def fake_llm():
+    """
+    The fake LLM server, answering every request with the canned treatments unless scripted otherwise
+    """
+    FAKE_SERVER.errors = []
+    FAKE_SERVER.error_rate = 0.0
+    FAKE_SERVER.response_content = None
+    FAKE_SERVER.requests = 0
+    yield FAKE_SERVER
+    FAKE_SERVER.errors = []
+
+
+@pytest.fixture
+def book_db(tmp_path):
+    """
+    Path of a database holding a synthetic book of 10 sections, book_id 0
+    """
+    db_path = str(tmp_path / 'tcm.db')
+    create_book_db(db_path, 10)
+    return db_path
@@ -0,0 +1,38 @@
+import asyncio
+import sqlite3
+
+from async_extractor import ExtractionEngine
+from llm_processor import LLMProcessor2, aget_treatment
+
+
+def extract(item):
+    return aget_treatment(item['content'], use_cache=False)
+
+
+def test_retries_rate_limits_and_server_errors(fake_llm, book_db):
+    fake_llm.errors = [429, 500, 503]
+    processor = LLMProcessor2(book_db, book_id=0, concurrency=1, use_cache=False)
+    stats = processor.process_books()
+    assert (stats['completed'], stats['failed'], stats['retries']) == (10, 0, 3)
+
+    conn = sqlite3.connect(book_db)
+    assert conn.execute('SELECT COUNT(DISTINCT ref_id), COUNT(*) FROM treatment').fetchone() == (10, 10)
+    assert conn.execute("SELECT status, COUNT(*) FROM extraction_job GROUP BY status").fetchall() == [('done', 10)]
+    conn.close()
+
+
+def test_gives_up_after_max_retries(fake_llm):
+    fake_llm.errors = [500] * 3
+    engine = ExtractionEngine(extract, concurrency=1, max_retries=2, base_delay=0.01, progress=False)
+    errors = []
+    stats = asyncio.run(engine.run([{'content': '白芍一两'}], on_error=lambda item, e: errors.append(e)))
+    assert (stats['completed'], stats['failed'], stats['retries']) == (0, 1, 2)
+    assert fake_llm.requests == 3 and len(errors) == 1
+
+
+def test_does_not_retry_client_errors(fake_llm):
+    fake_llm.errors = [409]
+    engine = ExtractionEngine(extract, concurrency=1, base_delay=0.01, progress=False)
+    stats = asyncio.run(engine.run([{'content': '白芍一两'}]))
+    assert (stats['completed'], stats['failed'], stats['retries']) == (0, 1, 0)
+    assert fake_llm.requests == 1
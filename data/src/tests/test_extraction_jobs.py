@@ -0,0 +1,24 @@
+import sqlite3
+
+from llm_processor import LLMProcessor2, update_herb_table
+
+
+def counts(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                for table in ('treatment', 'herb_ref')}
+    finally:
+        conn.close()
+
+
+def test_rerun_replaces_treatments(fake_llm, book_db):
+    processor = LLMProcessor2(book_db, book_id=0, concurrency=4, use_cache=False)
+    processor.process_books()
+    update_herb_table(create_new=True, db_path=book_db)
+    first = counts(book_db)
+    assert first == {'treatment': 10, 'herb_ref': 20}
+
+    processor.process_books(skip_processed=False)
+    update_herb_table(db_path=book_db)
+    assert counts(book_db) == first
@@ -0,0 +1,44 @@
+import sqlite3
+
+import pytest
+
+from llm_util import LLMCache, strip_code_fence, llm_post_processor
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('[1, 2]', '[1, 2]'),
+    ('```json\n[1, 2]\n```', '[1, 2]\n'),
+    ('```\n[1, 2]\n```', '[1, 2]\n'),
+    ('```[1,2]```\n', '[1,2]'),
+    ('Sure:\n```[{"a":1}]``` done\n', '[{"a":1}]'),
+    ('```json\n[1, 2', '[1, 2'),
+])
+def test_strip_code_fence(text, expected):
+    assert strip_code_fence(text) == expected
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('```[1,2]```\n', [1, 2]),
+    ('Sure:\n```[{"a":1}]``` done\n', [{'a': 1}]),
+    ('Here it is:\n```json\n[{"a": 1}]\n```\nDone.', [{'a': 1}]),
+    ('```json\n[{"a": 1}, {"b": 2', [{'a': 1}]),
+    ('不是处方', []),
+])
+def test_llm_post_processor(text, expected):
+    assert llm_post_processor(text) == expected
+
+
+def test_cache_saves_access_times_in_batches():
+    conn = sqlite3.connect(':memory:')
+    cache = LLMCache(conn, max_entries=2)
+    for prompt in ('a', 'b'):
+        cache.put('m', prompt, {}, prompt)
+    conn.execute('UPDATE llm_cache SET accessed_at = 0')
+    assert cache.get('m', 'a', {}) == 'a'
+    assert conn.execute('SELECT MAX(accessed_at) FROM llm_cache').fetchone()[0] == 0
+
+    # Eviction saves the access times first: 'a' was used after 'b'
+    cache.put('m', 'c', {}, 'c')
+    cache.evict()
+    assert [row[0] for row in conn.execute('SELECT response FROM llm_cache ORDER BY response')] == ['a', 'c']
+    assert cache.accessed == {}
@@ -7,17 +7,27 @@ db = SQLAlchemy()
 migrate = Migrate()
 
 
-def create_app():
+def create_app(config_object='config.Config'):
     app = Flask(__name__)
 
     # Load the configuration from config.py
-    app.config.from_object('config.Config')
+    app.config.from_object(config_object)
     app.config['JSON_AS_ASCII'] = False
 
     db.init_app(app)
     migrate.init_app(app, db)
 
+    from .utils import configure_sqlite
+    with app.app_context():
+        configure_sqlite(db.engine, app.config.get('SQLITE_PRAGMAS'))
+
     from . import routes
     app.register_blueprint(routes.bp)
 
+    from .search_index import init_search_index
+    init_search_index(app)
+
+    from .cache import init_response_cache
+    init_response_cache(app)
+
     return app
@@ -0,0 +1,126 @@
+"""
+Response cache for the read-only reference API.
+
+tcm.db does not change while it is being served, so a response only depends on the (normalized) query
+arguments and on the version of the database. Responses are kept in a size-bounded LRU cache that is
+dropped whenever the data version changes, and carry an ETag and Cache-Control so that browsers and the
+reverse proxy can revalidate with conditional GETs (304) or serve them without reaching the app at all.
+"""
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import current_app, request, make_response
+
+from .utils import data_version, normalize_query
+
+# Status codes whose responses only depend on the query and the data
+CACHEABLE_STATUS = (200, 404)
+
+
+class CachedResponse:
+    def __init__(self, body, status, mimetype):
+        self.body = body
+        self.status = status
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()
+
+
+class ResponseCache:
+    """
+    LRU cache of serialized responses, bounded by the total size of the bodies
+    ----------
+    get: Cached response for a key, None on a miss
+    put: Cache a response
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.version = None
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _check_version(self, version):
+        if version != self.version:
+            self.entries.clear()
+            self.size = 0
+            self.version = version
+
+    def get(self, key, version):
+        with self.lock:
+            self._check_version(version)
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, version, entry):
+        if len(entry.body) > self.max_bytes:
+            return
+        with self.lock:
+            self._check_version(version)
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old.body)
+            self.entries[key] = entry
+            self.size += len(entry.body)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted.body)
+
+
+def init_response_cache(app):
+    """
+    Attach the response cache to the app
+    :param app: Flask app
+    """
+    app.extensions['response_cache'] = ResponseCache(app.config.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+
+def cache_key(query_arg):
+    """
+    Cache key of the current request: path, normalized query and the remaining arguments
+    """
+    query = normalize_query(request.args.get(query_arg))
+    args = tuple(sorted((key, tuple(values)) for key, values in request.args.lists() if key != query_arg))
+    return request.path, query, args
+
+
+def cached_response(query_arg):
+    """
+    Decorator caching the response of a GET view and answering conditional requests
+    :param query_arg: str, name of the request argument holding the query
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            cache = current_app.extensions['response_cache']
+            key = cache_key(query_arg)
+            version = data_version()
+            entry = cache.get(key, version)
+            if entry is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code not in CACHEABLE_STATUS:
+                    return response
+                entry = CachedResponse(response.get_data(), response.status_code, response.mimetype)
+                cache.put(key, version, entry)
+
+            response = current_app.response_class(entry.body, status=entry.status, mimetype=entry.mimetype)
+            if response.status_code != 200:
+                return response
+            response.set_etag(entry.etag)
+            response.cache_control.public = True
+            response.cache_control.max_age = current_app.config.get('RESPONSE_CACHE_MAX_AGE', 300)
+            return response.make_conditional(request)
+
+        return wrapper
+
+    return decorator
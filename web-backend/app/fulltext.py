@@ -0,0 +1,109 @@
+"""
+SQLite FTS5 full-text search over the book, treatment and herb tables.
+
+FTS5 has no tokenizer for unsegmented Chinese text, so the indexed copy of every column is stored with a
+separator around each non-ASCII character: the unicode61 tokenizer then treats every Chinese character as
+a token and a query becomes a phrase of consecutive characters, which BM25 ranks as usual.
+
+The index is built and kept up to date by the preprocessing pipeline (data/src/preprocessing/fulltext_index.py),
+which owns the writes to tcm.db: the app only reads it, and also works on a read-only (query_only) connection.
+"""
+import logging
+import re
+import sqlite3
+
+# Separator placed around non-ASCII characters in the indexed text, removed again from the snippets. It must match
+# the pipeline's fulltext_index.SEPARATOR. U+2028 (LINE SEPARATOR) is a separator for unicode61 and does not occur
+# in the book texts.
+SEPARATOR = '\u2028'
+RE_NON_ASCII = re.compile(r'([^\x00-\x7f])')
+RE_TERM = re.compile(r'\S+')
+
+HIGHLIGHT_OPEN = '<b>'
+HIGHLIGHT_CLOSE = '</b>'
+
+# Column weights for bm25(): source and source_id are unindexed, title matches count more than body matches
+BM25_WEIGHTS = (0.0, 0.0, 10.0, 1.0)
+
+
+def segment(text):
+    """
+    Surround every non-ASCII character with the separator so that FTS5 indexes it as one token
+    :param text: str
+    :return: str
+    """
+    return RE_NON_ASCII.sub(SEPARATOR + r'\1' + SEPARATOR, text or '')
+
+
+def desegment(text):
+    """
+    Undo `segment` on a snippet, merging the highlights of consecutive matched characters
+    :param text: str
+    :return: str
+    """
+    text = text.replace(SEPARATOR, '')
+    return text.replace(HIGHLIGHT_CLOSE + HIGHLIGHT_OPEN, '')
+
+
+def build_match_query(query):
+    """
+    Build an FTS5 MATCH expression: every whitespace-separated term of the query must appear as a phrase
+    :param query: str
+    :return: str, empty if the query has no terms
+    """
+    phrases = []
+    for term in RE_TERM.findall(query):
+        tokens = segment(term).replace(SEPARATOR, ' ').split()
+        tokens = [token.replace('"', '""') for token in tokens]
+        if tokens:
+            phrases.append('"' + ' '.join(tokens) + '"')
+    return ' AND '.join(phrases)
+
+
+def connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def search_fulltext(db_path, query, limit=20, sources=None):
+    """
+    BM25-ranked full-text search
+    :param db_path: str
+    :param query: str, simplified Chinese query, whitespace separates terms that must all appear
+    :param limit: int, maximum number of hits
+    :param sources: list of str, restrict the hits to these sources ('book', 'treatment', 'herb')
+    :return: list of dict with source, id, title, snippet and score (lower is better, as in bm25())
+    """
+    match = build_match_query(query)
+    if not match:
+        return []
+    sql = f'''
+    SELECT source, source_id, title,
+           snippet(fulltext, 3, '{HIGHLIGHT_OPEN}', '{HIGHLIGHT_CLOSE}', '…', 32) AS snippet,
+           bm25(fulltext, {', '.join(str(w) for w in BM25_WEIGHTS)}) AS score
+    FROM fulltext
+    WHERE fulltext MATCH ?
+    '''
+    params = [match]
+    if sources:
+        sql += f" AND source IN ({', '.join('?' for _ in sources)})"
+        params += list(sources)
+    sql += ' ORDER BY score LIMIT ?'
+    params.append(limit)
+
+    conn = connect(db_path)
+    try:
+        rows = conn.execute(sql, params).fetchall()
+    except sqlite3.OperationalError as e:
+        if 'no such table' not in str(e):
+            raise
+        logging.warning('Full-text index not built, run data/src/preprocessing/fulltext_index.py')
+        return []
+    finally:
+        conn.close()
+    return [{'source': row['source'],
+             'id': row['source_id'],
+             'title': desegment(row['title']).strip(),
+             'snippet': desegment(row['snippet']),
+             'score': row['score']} for row in rows]
@@ -8,7 +8,7 @@ class Herb(db.Model):
     __tablename__ = 'herb_jointed'
     herb_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     # name = db.Column(db.String(80), nullable=False)
-    name = db.Column(db.String(80))
+    name = db.Column(db.String(80), index=True)
     # description = db.Column(db.String(200), nullable=False)
     description = db.Column(db.String(200))
 
@@ -34,11 +34,15 @@ class Treatment(db.Model):
     Use flask SQLAlchemy to interact with table treatment. It has seven columns: treatment_id, ref_id, disease, symptoms, prescription_name, herbs, and notes.
     """
     __tablename__ = 'treatment'
+    __table_args__ = (
+        # Prescription names are not unique across books in the extracted data, so the lookup index is not unique
+        db.Index('ix_treatment_prescription_name', 'prescription_name'),
+    )
     treatment_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     ref_id = db.Column(db.Integer)
     disease = db.Column(db.String(200))
     symptoms = db.Column(db.String(200))
-    prescription_name = db.Column(db.String(80), unique=True, nullable=False)
+    prescription_name = db.Column(db.String(80), nullable=False)
     herbs = db.Column(db.String(200))
     notes = db.Column(db.String(200), nullable=False)
 
@@ -49,8 +53,8 @@ class HerbRef(db.Model):
     """
     __tablename__ = 'herb_ref'
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    herb_id = db.Column(db.Integer, db.ForeignKey('herb_jointed.herb_id'))
-    treatment_id = db.Column(db.Integer, db.ForeignKey('treatment.treatment_id'))
+    herb_id = db.Column(db.Integer, db.ForeignKey('herb_jointed.herb_id'), index=True)
+    treatment_id = db.Column(db.Integer, db.ForeignKey('treatment.treatment_id'), index=True)
     ref_id = db.Column(db.Integer)
     dosage = db.Column(db.String(50))
     preparation = db.Column(db.String(100))
@@ -0,0 +1,146 @@
+"""
+Queries behind the herb and treatment detail APIs.
+
+Details are fetched with a single query that joins the herb or treatment rows with their references and
+projects only the columns of the response, instead of loading the ORM object first and joining afterwards.
+The batch variants resolve any number of names with the same query through `IN (...)`.
+
+When the read model has been built (data/src/preprocessing/read_model.py), the finished JSON documents are
+read from the detail_doc table with a primary-key fetch instead, see `get_detail_docs`.
+"""
+from sqlalchemy import text, bindparam
+from sqlalchemy.exc import OperationalError
+
+from . import db
+from .models import Herb, Treatment, HerbRef
+
+DETAIL_DOC_QUERY = text('SELECT name, doc FROM detail_doc WHERE kind = :kind AND name IN :names') \
+    .bindparams(bindparam('names', expanding=True))
+
+# Columns of herb_jointed returned by /api/herb, in response order
+HERB_DETAIL_COLUMNS = [
+    Herb.name,
+    Herb.description,
+    Herb.herb_pinyin_name,
+    Herb.herb_en_name,
+    Herb.herb_latin_name,
+    Herb.properties,
+    Herb.meridians,
+    Herb.UsePart,
+    Herb.function,
+    Herb.indication,
+    Herb.toxicity,
+    Herb.clinical_manifestations,
+    Herb.therapeutic_en_class,
+    Herb.therapeutic_cn_class,
+    Herb.tcmid_id,
+    Herb.tcm_id_id,
+    Herb.symmap_id,
+    Herb.tcmsp_id,
+]
+
+
+def get_herb_detail(name):
+    """
+    Herb with the treatments it is used in
+    :param name: str, simplified Chinese name of the herb
+    :return: dict, or None if the herb does not exist
+    """
+    return get_herb_details([name]).get(name)
+
+
+def get_herb_details(names):
+    """
+    Herbs with the treatments they are used in, fetched with one query for all the names
+    :param names: list of str, simplified Chinese names of the herbs
+    :return: dict of name -> herb detail, names of herbs that do not exist are left out
+    """
+    rows = db.session.query(
+        Herb.herb_id,
+        *HERB_DETAIL_COLUMNS,
+        Treatment.treatment_id,
+        Treatment.prescription_name,
+        HerbRef.dosage,
+        HerbRef.preparation
+    ).outerjoin(HerbRef, HerbRef.herb_id == Herb.herb_id) \
+        .outerjoin(Treatment, Treatment.treatment_id == HerbRef.treatment_id) \
+        .filter(Herb.name.in_(set(names))).all()
+
+    details = {}
+    for herb_rows in group_by_first_id(rows, 'name', 'herb_id').values():
+        detail = {column.key: getattr(herb_rows[0], column.key) for column in HERB_DETAIL_COLUMNS}
+        detail['treatments'] = [{'name': row.prescription_name, 'dosage': row.dosage, 'preparation': row.preparation}
+                                for row in herb_rows if row.treatment_id is not None]
+        details[detail['name']] = detail
+    return details
+
+
+def get_treatment_detail(name):
+    """
+    Treatment with the herbs of its prescription
+    :param name: str, simplified Chinese prescription name
+    :return: dict, or None if the treatment does not exist
+    """
+    return get_treatment_details([name]).get(name)
+
+
+def get_treatment_details(names):
+    """
+    Treatments with the herbs of their prescriptions, fetched with one query for all the names
+    :param names: list of str, simplified Chinese prescription names
+    :return: dict of name -> treatment detail, names of treatments that do not exist are left out
+    """
+    rows = db.session.query(
+        Treatment.treatment_id,
+        Treatment.prescription_name,
+        Treatment.notes,
+        Herb.herb_id,
+        Herb.name,
+        HerbRef.dosage,
+        HerbRef.preparation
+    ).outerjoin(HerbRef, HerbRef.treatment_id == Treatment.treatment_id) \
+        .outerjoin(Herb, Herb.herb_id == HerbRef.herb_id) \
+        .filter(Treatment.prescription_name.in_(set(names))).all()
+
+    details = {}
+    for name, treatment_rows in group_by_first_id(rows, 'prescription_name', 'treatment_id').items():
+        herb_list = [{'name': row.name, 'dosage': row.dosage, 'preparation': row.preparation}
+                     for row in treatment_rows if row.herb_id is not None]
+        details[name] = {'name': name, 'notes': treatment_rows[0].notes, 'herbs': herb_list}
+    return details
+
+
+def group_by_first_id(rows, name_key, id_key):
+    """
+    Group joined rows by name. Several rows could share the name, only the one with the lowest id is kept,
+    as filter_by(...).first() did.
+    :return: dict of name -> list of rows
+    """
+    first_ids = {}
+    for row in rows:
+        name, row_id = getattr(row, name_key), getattr(row, id_key)
+        if name not in first_ids or row_id < first_ids[name]:
+            first_ids[name] = row_id
+    groups = {}
+    for row in rows:
+        name = getattr(row, name_key)
+        if getattr(row, id_key) == first_ids[name]:
+            groups.setdefault(name, []).append(row)
+    return groups
+
+
+def get_detail_docs(kind, names):
+    """
+    Precomputed JSON documents of the read model
+    :param kind: str, 'herb' or 'treatment'
+    :param names: list of str, simplified Chinese names
+    :return: dict of name -> JSON document (str) for the names that exist,
+        or None if the read model has not been built
+    """
+    try:
+        rows = db.session.execute(DETAIL_DOC_QUERY, {'kind': kind, 'names': list(set(names))}).all()
+    except OperationalError:
+        # No detail_doc table: fall back to the queries above
+        db.session.rollback()
+        return None
+    return dict(rows)
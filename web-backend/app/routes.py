@@ -1,131 +1,276 @@
-from flask import Blueprint, jsonify, request
-from .models import db, Herb, Treatment, HerbRef
+from flask import Blueprint, jsonify, request, current_app
+from .queries import get_herb_detail, get_treatment_detail, get_herb_details, get_treatment_details, get_detail_docs
+from .search_index import get_search_index
+from .fulltext import search_fulltext
+from .utils import database_path, normalize_query
+from .cache import cached_response
+import base64
+import json
 import logging
-import zhconv
 
 # set logging level to info
 logging.basicConfig(level=logging.INFO)
 
 bp = Blueprint('main', __name__)
 
+# Page sizes of the search endpoints: (default, maximum)
+SEARCH_LIMITS = (50, 200)
+SUGGESTION_LIMITS = (10, 50)
+# Maximum number of names in one batch lookup
+MAX_BATCH_SIZE = 100
+
+
+def encode_cursor(positions):
+    """
+    Encode the keyset positions of the next page into an opaque cursor
+    :param positions: dict of result type -> (rank, id), types without a next page are left out
+    :return: str, or None if there is no next page
+    """
+    positions = {key: value for key, value in positions.items() if value is not None}
+    if not positions:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(positions, separators=(',', ':')).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor returned by `encode_cursor`
+    :param cursor: str
+    :return: dict of result type -> [rank, id]
+    """
+    try:
+        positions = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, UnicodeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(positions, dict) or not all(
+            isinstance(value, list) and len(value) == 2 and all(isinstance(item, int) for item in value)
+            for value in positions.values()):
+        raise ValueError('Invalid cursor')
+    return positions
+
+
+def page_args(limits):
+    """
+    Read the limit and cursor arguments of a paginated search request
+    :param limits: (default, maximum) page size
+    :return: (limit, positions), positions is None on the first page
+    """
+    default_limit, max_limit = limits
+    limit = request.args.get('limit', default_limit, type=int)
+    limit = max(1, min(limit, max_limit))
+    cursor = request.args.get('cursor')
+    return limit, decode_cursor(cursor) if cursor else None
+
+
+def search_page(index, query, limits):
+    """
+    One page of the herbs and treatments matching the query
+    :return: (herbs, treatments, next cursor)
+    """
+    limit, positions = page_args(limits)
+    herbs, treatments = [], []
+    herbs_next = treatments_next = None
+    # On later pages, a result type missing from the cursor has already been exhausted
+    if positions is None or 'herbs' in positions:
+        herbs, herbs_next = index.search_herbs(query, limit, positions and positions['herbs'])
+    if positions is None or 'treatments' in positions:
+        treatments, treatments_next = index.search_treatments(query, limit, positions and positions['treatments'])
+    return herbs, treatments, encode_cursor({'herbs': herbs_next, 'treatments': treatments_next})
+
 
 @bp.route('/api/search', methods=['GET'])
+@cached_response('query')
 def search():
-    query = request.args.get('query')
-    # Convert query to simplified Chinese
-    query = zhconv.convert(query, 'zh-cn')
+    # Strip the query and convert it to simplified Chinese
+    query = normalize_query(request.args.get('query'))
     if not query:
         return jsonify({'error': 'No search query provided'}), 400
 
-    herbs = Herb.query.filter(Herb.name.contains(query)).all()
-    treatments = Treatment.query.filter(Treatment.prescription_name.contains(query)).all()
+    if request.args.get('mode') == 'fulltext':
+        return fulltext_search(query)
+
+    try:
+        herbs, treatments, next_cursor = search_page(get_search_index(), query, SEARCH_LIMITS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     herbs_result = [
         {
-            'id': herb.herb_id,
-            'name': herb.name,
-            'description': herb.description,
-            'link': f'/ref/herb/?herb={herb.name}'
+            'id': herb['id'],
+            'name': herb['name'],
+            'description': herb['description'],
+            'link': f'/ref/herb/?herb={herb["name"]}'
         } for herb in herbs
     ]
     treatments_result = [
         {
-            'id': treatment.treatment_id,
-            'name': treatment.prescription_name,
-            'description': treatment.notes,
-            'link': f'/ref/treatment/?treatment={treatment.prescription_name}'
+            'id': treatment['id'],
+            'name': treatment['name'],
+            'description': treatment['description'],
+            'link': f'/ref/treatment/?treatment={treatment["name"]}'
         } for treatment in treatments
     ]
 
-    return jsonify({'herbs': herbs_result, 'treatments': treatments_result})
+    return jsonify({'herbs': herbs_result, 'treatments': treatments_result, 'next_cursor': next_cursor})
+
+
+FULLTEXT_LINKS = {
+    'herb': '/ref/herb/?herb={}',
+    'treatment': '/ref/treatment/?treatment={}',
+}
+
+
+def fulltext_search(query):
+    """
+    Full-text search over the book contents, treatments and herb functions/indications, ranked by BM25
+    :param query: str
+    :return: JSON response
+    """
+    limit = request.args.get('limit', 20, type=int)
+    limit = max(1, min(limit, 100))
+    sources = request.args.getlist('source') or None
+
+    hits = search_fulltext(database_path(), query, limit=limit, sources=sources)
+    for hit in hits:
+        link = FULLTEXT_LINKS.get(hit['source'])
+        hit['link'] = link.format(hit['title']) if link else None
+
+    return jsonify({'hits': hits})
 
 
 @bp.route('/api/herb', methods=['GET'])
+@cached_response('herb')
 def get_herb_info():
-    query = request.args.get('herb')
-    # Convert query to simplified Chinese
-    query = zhconv.convert(query, 'zh-cn')
-
+    # Strip the query and convert it to simplified Chinese
+    query = normalize_query(request.args.get('herb'))
     if not query:
         return jsonify({'error': 'No herb query provided'}), 400
 
-    herb = Herb.query.filter_by(name=query).first()
+    docs = get_detail_docs('herb', [query])
+    if docs is not None:
+        if query not in docs:
+            return jsonify({'error': 'Herb not found'}), 404
+        return json_document(docs[query])
+
+    herb = get_herb_detail(query)
     if not herb:
         return jsonify({'error': 'Herb not found'}), 404
 
-    treatments = db.session.query(
-        Treatment.prescription_name,
-        HerbRef.dosage,
-        HerbRef.preparation
-    ).join(HerbRef, HerbRef.treatment_id == Treatment.treatment_id).filter(HerbRef.herb_id == herb.herb_id).all()
-
-    treatment_list = [{'name': t[0], 'dosage': t[1], 'preparation': t[2]} for t in treatments]
-
-    return jsonify({'name': herb.name,
-                    'description': herb.description,
-                    'treatments': treatment_list,
-                    'herb_pinyin_name': herb.herb_pinyin_name,
-                    'herb_en_name': herb.herb_en_name,
-                    'herb_latin_name': herb.herb_latin_name,
-                    'properties': herb.properties,
-                    'meridians': herb.meridians,
-                    'UsePart': herb.UsePart,
-                    'function': herb.function,
-                    'indication': herb.indication,
-                    'toxicity': herb.toxicity,
-                    'clinical_manifestations': herb.clinical_manifestations,
-                    'therapeutic_en_class': herb.therapeutic_en_class,
-                    'therapeutic_cn_class': herb.therapeutic_cn_class,
-                    'tcmid_id': herb.tcmid_id,
-                    'tcm_id_id': herb.tcm_id_id,
-                    'symmap_id': herb.symmap_id,
-                    'tcmsp_id': herb.tcmsp_id
-                    })
+    return jsonify(herb)
 
 
 @bp.route('/api/treatment', methods=['GET'])
+@cached_response('treatment')
 def get_treatment_info():
-    query = request.args.get('treatment')
-    # Convert query to simplified Chinese
-    query = zhconv.convert(query, 'zh-cn')
-
+    # Strip the query and convert it to simplified Chinese
+    query = normalize_query(request.args.get('treatment'))
     if not query:
         return jsonify({'error': 'No treatment query provided'}), 400
 
-    treatment = Treatment.query.filter_by(prescription_name=query).first()
+    docs = get_detail_docs('treatment', [query])
+    if docs is not None:
+        if query not in docs:
+            return jsonify({'error': 'Treatment not found'}), 404
+        return json_document(docs[query])
+
+    treatment = get_treatment_detail(query)
     if not treatment:
         return jsonify({'error': 'Treatment not found'}), 404
 
-    herbs = db.session.query(
-        Herb.name,
-        HerbRef.dosage,
-        HerbRef.preparation
-    ).join(HerbRef, HerbRef.herb_id == Herb.herb_id).filter(HerbRef.treatment_id == treatment.treatment_id).all()
+    return jsonify(treatment)
+
+
+def batch_names():
+    """
+    Read the names of a batch lookup from the JSON body: {"names": [...]}
+    :return: list of str
+    """
+    body = request.get_json(silent=True)
+    names = body.get('names') if isinstance(body, dict) else None
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        raise ValueError('Expected a JSON body {"names": [...]}')
+    if len(names) > MAX_BATCH_SIZE:
+        raise ValueError(f'At most {MAX_BATCH_SIZE} names per batch')
+    return names
+
+
+def json_document(document):
+    """
+    Response with an already serialized JSON document
+    :param document: str
+    """
+    return current_app.response_class(document, mimetype='application/json')
+
+
+def batch_lookup(kind, key, get_details):
+    """
+    Resolve a batch of names with one query, from the read model if it has been built
+    :param kind: str, 'herb' or 'treatment'
+    :param key: str, key of the map in the response
+    :param get_details: function mapping a list of simplified names to a dict of name -> detail
+    :return: JSON response {key: {requested name: detail or null}}
+    """
+    names = batch_names()
+    normalized = {name: normalize_query(name) for name in names}
+    queries = [query for query in normalized.values() if query]
+
+    docs = get_detail_docs(kind, queries)
+    if docs is None:
+        details = get_details(queries)
+        return jsonify({key: {name: details.get(query) for name, query in normalized.items()}})
 
-    herb_list = [{'name': h[0], 'dosage': h[1], 'preparation': h[2]} for h in herbs]
+    # Splice the stored documents into the response instead of parsing and serializing them again
+    items = ','.join(f'{json.dumps(name, ensure_ascii=False)}:{docs.get(query, "null")}'
+                     for name, query in normalized.items())
+    return json_document(f'{{{json.dumps(key)}:{{{items}}}}}')
 
-    return jsonify({'name': treatment.prescription_name, 'notes': treatment.notes, 'herbs': herb_list})
 
+@bp.route('/api/herb/batch', methods=['POST'])
+def get_herb_info_batch():
+    """
+    Herb details for a list of names, e.g. all the herbs of a prescription
+    :return: {"herbs": {name: herb detail or null}}
+    """
+    try:
+        return batch_lookup('herb', 'herbs', get_herb_details)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@bp.route('/api/treatment/batch', methods=['POST'])
+def get_treatment_info_batch():
+    """
+    Treatment details for a list of prescription names
+    :return: {"treatments": {name: treatment detail or null}}
+    """
+    try:
+        return batch_lookup('treatment', 'treatments', get_treatment_details)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
 
 @bp.route('/api/suggestions', methods=['GET'])
+@cached_response('query')
 def suggestions():
     """
     Search suggestions
     :return:
     """
-    query = request.args.get('query')
-    # Convert query to simplified Chinese
-    query = zhconv.convert(query, 'zh-cn')
+    # Strip the query and convert it to simplified Chinese
+    query = normalize_query(request.args.get('query'))
     if not query:
         return jsonify({'error': 'No query provided'}), 400
 
-    herb_suggestions = Herb.query.filter(Herb.name.contains(query)).all()
-    treatment_suggestions = Treatment.query.filter(Treatment.prescription_name.contains(query)).all()
+    try:
+        herb_suggestions, treatment_suggestions, next_cursor = search_page(get_search_index(), query,
+                                                                           SUGGESTION_LIMITS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    herb_suggestions_result = [{'id': herb.herb_id, 'name': herb.name, 'type': 'herb'} for herb in herb_suggestions]
+    herb_suggestions_result = [{'id': herb['id'], 'name': herb['name'], 'type': 'herb'} for herb in herb_suggestions]
     treatment_suggestions_result = [
-        {'id': treatment.treatment_id, 'name': treatment.prescription_name, 'type': 'treatment'} for treatment in
+        {'id': treatment['id'], 'name': treatment['name'], 'type': 'treatment'} for treatment in
         treatment_suggestions]
 
-    return jsonify({'herbs': herb_suggestions_result, 'treatments': treatment_suggestions_result})
+    return jsonify({'herbs': herb_suggestions_result, 'treatments': treatment_suggestions_result,
+                    'next_cursor': next_cursor})
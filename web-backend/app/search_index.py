@@ -0,0 +1,234 @@
+"""
+In-memory character n-gram inverted index for the search and suggestion APIs.
+
+Every searchable field (herb name, pinyin and Latin name, prescription name) is split into character
+unigrams and bigrams. A substring query is answered by intersecting the posting lists of its n-grams and
+verifying the few remaining candidates, so a lookup costs time proportional to the matching postings
+instead of a `LIKE '%q%'` scan over the whole table.
+
+Matches are ordered by relevance (exact match, then prefix, then substring) and id, and paginated with
+keyset positions (rank, id), so a page only costs a partial sort of the matches.
+"""
+import heapq
+import logging
+import threading
+
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import db
+from .models import Herb, Treatment
+from .utils import data_version
+
+
+def ngrams(text):
+    """
+    Character unigrams and bigrams of the text
+    :param text: str
+    :return: set of str
+    """
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+def query_grams(query):
+    """
+    N-grams that must all be present in a field containing the query
+    :param query: str
+    :return: set of str
+    """
+    if len(query) == 1:
+        return {query}
+    return {query[i:i + 2] for i in range(len(query) - 1)}
+
+
+# Relevance ranks, lower is better
+EXACT, PREFIX, SUBSTRING = 0, 1, 2
+
+
+def relevance(fields, query):
+    """
+    Relevance rank of a document whose fields contain the query
+    :param fields: tuple of str, lowercased fields of the document
+    :param query: str, lowercased query
+    :return: int
+    """
+    if query in fields:
+        return EXACT
+    if any(field.startswith(query) for field in fields):
+        return PREFIX
+    return SUBSTRING
+
+
+class NgramIndex:
+    """
+    Inverted index from character n-grams to document ids
+    ----------
+    add: Index the searchable fields of a document
+    search: Ids of the documents with a field containing the query
+    search_ranked: Page of the matching documents ordered by relevance
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.fields = {}
+
+    def add(self, doc_id, fields):
+        """
+        Index a document
+        :param doc_id: int
+        :param fields: list of str, the searchable fields of the document (None values are ignored)
+        """
+        fields = tuple(field.lower() for field in fields if field)
+        self.fields[doc_id] = fields
+        for field in fields:
+            for gram in ngrams(field):
+                self.postings.setdefault(gram, set()).add(doc_id)
+
+    def search(self, query):
+        """
+        Ids of the documents with at least one field containing the query, in ascending order
+        :param query: str
+        :return: list of int
+        """
+        return sorted(self._match(query.lower()))
+
+    def search_ranked(self, query, limit=None, after=None):
+        """
+        Documents containing the query ordered by relevance (exact match, then prefix, then substring) and id
+        :param query: str
+        :param limit: int, maximum number of documents, None for all
+        :param after: (rank, doc_id) keyset position, only the documents after it are returned
+        :return: list of (rank, doc_id)
+        """
+        query = query.lower()
+        keys = ((relevance(self.fields[doc_id], query), doc_id) for doc_id in self._match(query))
+        if after is not None:
+            after = tuple(after)
+            keys = (key for key in keys if key > after)
+        if limit is None:
+            return sorted(keys)
+        return heapq.nsmallest(limit, keys)
+
+    def _match(self, query):
+        if not query:
+            return []
+        postings = []
+        for gram in query_grams(query):
+            posting = self.postings.get(gram)
+            if not posting:
+                return []
+            postings.append(posting)
+        # Intersect starting from the rarest gram, so the work is bounded by the shortest posting list
+        postings.sort(key=len)
+        candidates = postings[0].intersection(*postings[1:])
+        if len(query) > 2:
+            # The bigrams of a field can all be present without forming the query, verify the candidates
+            candidates = [doc_id for doc_id in candidates
+                          if any(query in field for field in self.fields[doc_id])]
+        return candidates
+
+
+class SearchIndex:
+    """
+    N-gram indexes over herbs and treatments, with the rows needed to render search results
+    """
+
+    def __init__(self, version=None):
+        self.version = version
+        self.herbs = {}
+        self.treatments = {}
+        self.herb_index = NgramIndex()
+        self.treatment_index = NgramIndex()
+
+    @classmethod
+    def build(cls, version=None):
+        """
+        Build the index from the herb and treatment tables
+        :param version: data version stamp of the database the index is built from
+        :return: SearchIndex
+        """
+        index = cls(version)
+        herbs = db.session.query(
+            Herb.herb_id, Herb.name, Herb.description, Herb.herb_pinyin_name, Herb.herb_latin_name
+        ).all()
+        for herb_id, name, description, pinyin_name, latin_name in herbs:
+            index.herbs[herb_id] = {'id': herb_id, 'name': name, 'description': description}
+            index.herb_index.add(herb_id, [name, pinyin_name, latin_name])
+
+        treatments = db.session.query(
+            Treatment.treatment_id, Treatment.prescription_name, Treatment.notes
+        ).all()
+        for treatment_id, prescription_name, notes in treatments:
+            index.treatments[treatment_id] = {'id': treatment_id, 'name': prescription_name, 'description': notes}
+            index.treatment_index.add(treatment_id, [prescription_name])
+
+        logging.info(f'Search index built: {len(index.herbs)} herbs, {len(index.treatments)} treatments')
+        return index
+
+    def search_herbs(self, query, limit=None, after=None):
+        """
+        Herbs whose name, pinyin or Latin name contains the query, most relevant first
+        :param query: str
+        :param limit: int, page size, None for all the herbs
+        :param after: (rank, id) keyset position returned with the previous page
+        :return: (list of dict, keyset position of the next page or None if this is the last page)
+        """
+        return self._page(self.herb_index, self.herbs, query, limit, after)
+
+    def search_treatments(self, query, limit=None, after=None):
+        """
+        Treatments whose prescription name contains the query, most relevant first
+        :param query: str
+        :param limit: int, page size, None for all the treatments
+        :param after: (rank, id) keyset position returned with the previous page
+        :return: (list of dict, keyset position of the next page or None if this is the last page)
+        """
+        return self._page(self.treatment_index, self.treatments, query, limit, after)
+
+    @staticmethod
+    def _page(index, rows, query, limit, after):
+        # Fetch one extra key to know whether there is a next page
+        keys = index.search_ranked(query, None if limit is None else limit + 1, after)
+        next_key = None
+        if limit is not None and len(keys) > limit:
+            keys = keys[:limit]
+            next_key = list(keys[-1])
+        return [rows[doc_id] for _, doc_id in keys], next_key
+
+
+_rebuild_lock = threading.Lock()
+
+
+def init_search_index(app):
+    """
+    Build the search index when the app is created
+    :param app: Flask app
+    """
+    with app.app_context():
+        version = data_version()
+        try:
+            index = SearchIndex.build(version)
+        except SQLAlchemyError as e:
+            # The tables may not exist yet, e.g. before the preprocessing pipeline has run
+            logging.warning(f'Search index not built: {e}')
+            index = SearchIndex(version)
+        app.extensions['search_index'] = index
+
+
+def get_search_index():
+    """
+    Search index of the current app, rebuilt first if tcm.db has changed since it was built
+    :return: SearchIndex
+    """
+    index = current_app.extensions['search_index']
+    version = data_version()
+    if index.version == version:
+        return index
+    with _rebuild_lock:
+        index = current_app.extensions['search_index']
+        if index.version != version:
+            index = SearchIndex.build(version)
+            current_app.extensions['search_index'] = index
+    return index
@@ -0,0 +1,171 @@
+"""
+Utility functions shared by the API routes
+"""
+import functools
+import os
+import re
+import sqlite3
+import threading
+
+from sqlalchemy import event
+from zhconv import zhconv
+
+from . import db
+
+# Number of distinct queries whose normalized form is memoized
+NORMALIZE_CACHE_SIZE = 16384
+
+
+def database_path():
+    """
+    Path of the SQLite database file used by the app
+    :return: str
+    """
+    return db.engine.url.database
+
+
+def configure_sqlite(engine, pragmas):
+    """
+    Run the PRAGMAs on every new connection of the engine
+    :param engine: SQLAlchemy engine
+    :param pragmas: list of str
+    """
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+class DataVersion:
+    """
+    Version counter of the database, incremented whenever another connection commits a change to it.
+    Changes are detected with `PRAGMA data_version` on a connection held by the process. Unlike the mtimes of the
+    database and WAL files, it does not change on reads, checkpoints or PRAGMAs. The counter is inherited by the
+    forked gunicorn workers, which open their own connection.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.conn = None
+        self.file_id = None
+        self.last = None
+        self.generation = 0
+
+    def get(self, path):
+        """
+        :param path: str, database file
+        :return: int
+        """
+        try:
+            stat = os.stat(path)
+            file_id = (stat.st_dev, stat.st_ino)
+        except OSError:
+            file_id = None
+        with self.lock:
+            if self.pid != os.getpid() or file_id != self.file_id:
+                # New worker process, or the database file was replaced: hold a connection to the current file
+                replaced = self.pid == os.getpid()
+                if self.conn is not None:
+                    self.conn.close()
+                self.conn = sqlite3.connect(path, check_same_thread=False) if file_id else None
+                self.pid, self.file_id = os.getpid(), file_id
+                self.last = None
+                if replaced:
+                    self.generation += 1
+            if self.conn is None:
+                return self.generation
+            version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+            if self.last is not None and version != self.last:
+                self.generation += 1
+            self.last = version
+            return self.generation
+
+
+_data_version = DataVersion()
+
+
+def data_version():
+    """
+    Version stamp of the database, which changes whenever tcm.db is written (see DataVersion)
+    :return: int
+    """
+    return _data_version.get(database_path())
+
+
+@functools.lru_cache(maxsize=None)
+def conversion_tables():
+    """
+    Traditional to simplified conversion tables derived from zhconv's zh-cn dictionary
+    :return: (single character translation table, phrase dict, set of phrase prefixes, regex of phrase initials)
+    """
+    mapping = zhconv.getdict('zh-cn')
+    table = str.maketrans({word: target for word, target in mapping.items() if len(word) == 1})
+    phrases = {word: target for word, target in mapping.items() if len(word) > 1}
+    prefixes = frozenset(word[:i] for word in phrases for i in range(2, len(word)))
+    initials = re.compile('[' + re.escape(''.join(sorted({word[0] for word in phrases}))) + ']')
+    return table, phrases, prefixes, initials
+
+
+def to_simplified(text):
+    """
+    Convert text to simplified Chinese with the same maximal forward matching as `zhconv.convert(text, 'zh-cn')`.
+    Only the characters that can start a phrase are matched one by one, the runs between them are converted
+    with a single `str.translate` call.
+    :param text: str
+    :return: str
+    """
+    if text.isascii():
+        return text
+    table, phrases, prefixes, initials = conversion_tables()
+
+    converted = []
+    start = 0
+    n = len(text)
+    match = initials.search(text)
+    while match:
+        pos = match.start()
+        end = None
+        length = 2
+        while pos + length <= n:
+            fragment = text[pos:pos + length]
+            if fragment in phrases:
+                end = pos + length
+            elif fragment not in prefixes:
+                break
+            length += 1
+        if end is None:
+            match = initials.search(text, pos + 1)
+            continue
+        converted.append(text[start:pos].translate(table))
+        converted.append(phrases[text[pos:end]])
+        start = end
+        match = initials.search(text, end)
+    if not converted:
+        return text.translate(table)
+    converted.append(text[start:].translate(table))
+    return ''.join(converted)
+
+
+@functools.lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _normalize(text):
+    return to_simplified(text)
+
+
+def normalize_query(query):
+    """
+    Normalize a query argument: strip it and convert it to simplified Chinese (memoized)
+    :param query: str or None
+    :return: str, empty if the query is missing or blank
+    """
+    if not query:
+        return ''
+    query = query.strip()
+    if not query:
+        return ''
+    return _normalize(query)
@@ -0,0 +1,107 @@
+"""
+Regression benchmark for the herb and treatment detail lookups.
+
+Builds synthetic databases with a growing herb_ref table, creates the schema (and its indexes) from the
+models, and measures the latency of `get_herb_detail` / `get_treatment_detail`. With the lookup indexes in
+place the p99 latency must stay flat as herb_ref grows; the script exits with status 1 otherwise.
+
+Usage:
+    python benchmarks/bench_lookup.py --sizes 10000 100000 1000000 3000000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from flask import Flask  # noqa: E402
+
+from app import db  # noqa: E402
+from app.queries import get_herb_detail, get_treatment_detail  # noqa: E402
+
+HERBS_PER_TREATMENT = 10
+TREATMENTS_PER_HERB = 20
+
+
+def build_database(path, herb_ref_rows):
+    """
+    Create a synthetic database whose herb_ref table has herb_ref_rows rows. The number of herbs grows with the
+    table, so the size of each response stays the same and only the cost of finding it is measured.
+    """
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+
+    n_herbs = max(1, herb_ref_rows // TREATMENTS_PER_HERB)
+    n_treatments = max(1, herb_ref_rows // HERBS_PER_TREATMENT)
+    rng = random.Random(0)
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany('INSERT INTO herb_jointed (herb_id, name, description) VALUES (?, ?, ?)',
+                         ((i, f'herb{i}', f'description {i}') for i in range(1, n_herbs + 1)))
+        conn.executemany('INSERT INTO treatment (treatment_id, prescription_name, notes) VALUES (?, ?, ?)',
+                         ((i, f'treatment{i}', f'notes {i}') for i in range(1, n_treatments + 1)))
+        conn.executemany('INSERT INTO herb_ref (herb_id, treatment_id, dosage, preparation) VALUES (?, ?, ?, ?)',
+                         ((rng.randint(1, n_herbs), i // HERBS_PER_TREATMENT + 1, '一两', '')
+                          for i in range(herb_ref_rows)))
+    conn.close()
+    return app, n_herbs, n_treatments
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def measure(app, n_herbs, n_treatments, lookups):
+    rng = random.Random(1)
+    herb_times = []
+    treatment_times = []
+    with app.app_context():
+        for _ in range(lookups):
+            start = time.perf_counter()
+            get_herb_detail(f'herb{rng.randint(1, n_herbs)}')
+            herb_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            get_treatment_detail(f'treatment{rng.randint(1, n_treatments)}')
+            treatment_times.append(time.perf_counter() - start)
+    return herb_times, treatment_times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='herb_ref row counts to benchmark')
+    parser.add_argument('--lookups', type=int, default=500, help='lookups per endpoint and size')
+    parser.add_argument('--max-ratio', type=float, default=3.0,
+                        help='maximum allowed ratio between the p99 of the largest and the smallest size')
+    args = parser.parse_args()
+
+    p99s = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in args.sizes:
+            path = os.path.join(tmp_dir, f'bench_{size}.db')
+            app, n_herbs, n_treatments = build_database(path, size)
+            herb_times, treatment_times = measure(app, n_herbs, n_treatments, args.lookups)
+            p99 = max(percentile(herb_times, 99), percentile(treatment_times, 99))
+            p99s.append(p99)
+            print(f'herb_ref={size:>10,}  '
+                  f'herb p50={percentile(herb_times, 50) * 1000:.2f}ms p99={percentile(herb_times, 99) * 1000:.2f}ms  '
+                  f'treatment p50={percentile(treatment_times, 50) * 1000:.2f}ms '
+                  f'p99={percentile(treatment_times, 99) * 1000:.2f}ms')
+
+    ratio = p99s[-1] / p99s[0]
+    print(f'p99 ratio largest/smallest: {ratio:.2f} (max {args.max_ratio})')
+    if ratio > args.max_ratio:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
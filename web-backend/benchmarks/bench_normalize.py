@@ -0,0 +1,70 @@
+"""
+Microbenchmark of the query normalization against bare `zhconv.convert`.
+
+Queries are sampled from a book text (keystroke prefixes of short snippets, as sent by the suggestion box)
+and converted with `zhconv.convert`, the uncached `to_simplified` and the memoized `normalize_query`.
+
+Usage:
+    python benchmarks/bench_normalize.py --text ../data/books/fuqing/傅青主女科.txt
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+import zhconv  # noqa: E402
+
+from app.utils import to_simplified, normalize_query  # noqa: E402
+
+DEFAULT_TEXT = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../data/books/fuqing/傅青主女科.txt')
+
+
+def sample_queries(text, n_queries, seed=0):
+    """
+    Keystroke sequences: every prefix of random 2-8 character snippets of the text
+    """
+    rng = random.Random(seed)
+    queries = []
+    while len(queries) < n_queries:
+        start = rng.randrange(len(text) - 8)
+        snippet = text[start:start + rng.randint(2, 8)].strip()
+        queries.extend(snippet[:i] for i in range(1, len(snippet) + 1))
+    return queries[:n_queries]
+
+
+def timed(function, queries, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for query in queries:
+            function(query)
+    return (time.perf_counter() - start) / (repeat * len(queries))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--text', default=DEFAULT_TEXT, help='text file the queries are sampled from')
+    parser.add_argument('--queries', type=int, default=5000, help='number of queries')
+    parser.add_argument('--repeat', type=int, default=5, help='passes over the queries')
+    args = parser.parse_args()
+
+    with open(args.text, 'r', encoding='utf-8') as f:
+        text = f.read()
+    queries = sample_queries(text, args.queries)
+
+    mismatches = sum(to_simplified(query) != zhconv.convert(query, 'zh-cn') for query in queries)
+    to_simplified('預熱')  # build the conversion tables outside of the measurement
+
+    baseline = timed(lambda q: zhconv.convert(q, 'zh-cn'), queries, args.repeat)
+    uncached = timed(to_simplified, queries, args.repeat)
+    memoized = timed(normalize_query, queries, args.repeat)
+    print(f'{len(queries)} queries, {mismatches} mismatches with zhconv.convert')
+    print(f'zhconv.convert   {baseline * 1e6:8.2f} us/query')
+    print(f'to_simplified    {uncached * 1e6:8.2f} us/query  ({baseline / uncached:.1f}x)')
+    print(f'normalize_query  {memoized * 1e6:8.2f} us/query  ({baseline / memoized:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
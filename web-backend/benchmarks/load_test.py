@@ -0,0 +1,130 @@
+"""
+Load test of the production server: requests/sec for an increasing number of gunicorn workers.
+
+For every worker count, gunicorn is started with gunicorn.conf.py and wsgi:app, then client processes replay
+a mix of suggestion, search and detail requests over keep-alive connections for a fixed duration.
+
+Usage:
+    python benchmarks/load_test.py --workers 1 2 4 8 --clients 32 --duration 20
+    python benchmarks/load_test.py --url http://127.0.0.1:5111 --clients 32   # existing server
+"""
+import argparse
+import http.client
+import multiprocessing as mp
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.parse
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+
+QUERIES = ['甘', '甘草', '当归', '白芍', '人参', '黄芪', '草', '汤', '清肝', '地黄', '茯苓', '川芎']
+
+
+def request_paths(seed):
+    """
+    Endless mix of the requests sent by the frontend: mostly suggestions, then searches and detail pages
+    """
+    rng = random.Random(seed)
+    while True:
+        query = urllib.parse.quote(rng.choice(QUERIES))
+        kind = rng.random()
+        if kind < 0.6:
+            yield f'/api/suggestions?query={query}'
+        elif kind < 0.8:
+            yield f'/api/search?query={query}'
+        elif kind < 0.9:
+            yield f'/api/herb?herb={query}'
+        else:
+            yield f'/api/treatment?treatment={query}'
+
+
+def client(host, port, duration, seed, results):
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    count = errors = 0
+    deadline = time.perf_counter() + duration
+    for path in request_paths(seed):
+        if time.perf_counter() >= deadline:
+            break
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 500:
+                errors += 1
+            count += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+    conn.close()
+    results.put((count, errors))
+
+
+def run_load(host, port, clients, duration):
+    """
+    Run the client processes against a server
+    :return: (requests/sec, errors)
+    """
+    results = mp.Queue()
+    processes = [mp.Process(target=client, args=(host, port, duration, seed, results)) for seed in range(clients)]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    totals = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+    return sum(count for count, _ in totals) / elapsed, sum(errors for _, errors in totals)
+
+
+def wait_until_ready(host, port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=2)
+            conn.request('GET', '/api/suggestions?query=%E8%8D%89')
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError('The server did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='test an already running server instead of starting gunicorn')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='gunicorn worker counts')
+    parser.add_argument('--threads', type=int, default=4, help='threads per gunicorn worker')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent client processes')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of load per run')
+    parser.add_argument('--port', type=int, default=5199, help='port of the started servers')
+    args = parser.parse_args()
+
+    if args.url:
+        url = urllib.parse.urlparse(args.url)
+        rps, errors = run_load(url.hostname, url.port or 80, args.clients, args.duration)
+        print(f'{args.url}: {rps:.0f} req/s, {errors} errors')
+        return
+
+    baseline = None
+    for workers in args.workers:
+        env = dict(os.environ, WEB_CONCURRENCY=str(workers), GUNICORN_THREADS=str(args.threads),
+                   GUNICORN_BIND=f'127.0.0.1:{args.port}')
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                                  cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_until_ready('127.0.0.1', args.port)
+            rps, errors = run_load('127.0.0.1', args.port, args.clients, args.duration)
+        finally:
+            server.terminate()
+            server.wait()
+        baseline = baseline or rps
+        print(f'workers={workers:>3} threads={args.threads}: {rps:8.0f} req/s ({rps / baseline:.2f}x), {errors} errors')
+
+
+if __name__ == '__main__':
+    main()
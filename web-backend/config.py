@@ -6,6 +6,34 @@ class Config:
     SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(basedir, '../data/src/db/tcm.db')}"
     # SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(basedir, '../data/src/db-processing/Joined.db')}"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Response cache of the reference API: total size of the cached bodies, and max-age sent to clients/proxies
+    RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+    RESPONSE_CACHE_MAX_AGE = 300
+    # PRAGMAs run on every new SQLite connection of the app, in order
+    SQLITE_PRAGMAS = []
     print(f'Config basedir: {basedir}')
     # if not os.path.exists('../data/src/db-processing/Joined.db'):
     #     print(f"Error: Cannot access the database at {'../data/src/db-processing/Joined.db'}")
+
+
+class ProductionConfig(Config):
+    """
+    Configuration for serving with gunicorn (see gunicorn.conf.py): tcm.db is only read, so the connections are
+    opened in WAL mode and read-only, with a large page cache and memory-mapped I/O.
+    """
+    # Threads per gunicorn worker, each worker process has its own pool with one connection per thread
+    THREADS = int(os.environ.get('GUNICORN_THREADS', 4))
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': THREADS,
+        'max_overflow': 0,
+        'pool_pre_ping': False,
+        'connect_args': {'check_same_thread': False, 'timeout': 30},
+    }
+    SQLITE_PRAGMAS = [
+        'PRAGMA journal_mode = WAL',
+        'PRAGMA synchronous = NORMAL',
+        'PRAGMA mmap_size = 268435456',
+        'PRAGMA cache_size = -65536',
+        'PRAGMA temp_store = MEMORY',
+        'PRAGMA query_only = ON',
+    ]
@@ -0,0 +1,23 @@
+"""
+gunicorn settings for the production backend (wsgi.py)
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:5111')
+# One worker process per core; each worker serves GUNICORN_THREADS requests at once, matching its connection pool
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+keepalive = 5
+# Build the search index once in the master and share it with the workers copy-on-write
+preload_app = True
+
+
+def post_fork(server, worker):
+    # SQLite connections must not be shared across processes: drop the ones opened by the master while preloading
+    from app import db
+    from wsgi import app
+
+    with app.app_context():
+        db.engine.dispose(close=False)
@@ -0,0 +1,35 @@
+"""Add indexes for the herb and treatment lookups
+
+Revision ID: 3f9c2a1d7b4e
+Revises:
+Create Date: 2026-10-18 10:12:31.482913
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9c2a1d7b4e'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# The tables are created by the preprocessing pipeline, which also creates these indexes when it recreates the
+# treatment and herb_ref tables (llm_processor.create_treatment_table and update_herb_table): the upgrade is then
+# a no-op
+INDEXES = [
+    ('ix_herb_jointed_name', 'herb_jointed', 'name'),
+    ('ix_treatment_prescription_name', 'treatment', 'prescription_name'),
+    ('ix_herb_ref_herb_id', 'herb_ref', 'herb_id'),
+    ('ix_herb_ref_treatment_id', 'herb_ref', 'treatment_id'),
+]
+
+
+def upgrade():
+    for name, table, column in INDEXES:
+        op.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({column})')
+
+
+def downgrade():
+    for name, _, _ in INDEXES:
+        op.execute(f'DROP INDEX IF EXISTS {name}')
@@ -2,5 +2,5 @@
 
 conda activate open-tcm
 
-# Start the Flask server with pm2
-pm2 start run.py --name "opentcm-backend" --interpreter python
+# Start the production server (gunicorn, see gunicorn.conf.py) with pm2
+pm2 start gunicorn --name "opentcm-backend" --interpreter none -- -c gunicorn.conf.py wsgi:app
@@ -0,0 +1,7 @@
+"""
+Production entry point, served by gunicorn:
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+from app import create_app
+
+app = create_app('config.ProductionConfig')